@@ -0,0 +1,80 @@
+"""
+リクエストごとのAgent生成コストのベンチマーク
+
+before: 呼び出しごとにモデルID文字列からAgentを生成（BedrockModel・boto3クライアントも毎回生成）
+after:  共有のBedrockModelを使い、Agentだけを生成
+
+ネットワークには接続しない（生成コストのみを計測）
+
+    uv run python benchmarks/bench_agent_construction.py [--iterations 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+
+from strands import Agent
+
+import model_pool
+
+
+SYSTEM_PROMPT = "あなたは家族情報ハブのアシスタントです。"
+
+
+def build_before() -> Agent:
+    return Agent(
+        model=model_pool.DEFAULT_MODEL_ID,
+        system_prompt=SYSTEM_PROMPT,
+        callback_handler=None,
+    )
+
+
+def build_after() -> Agent:
+    return model_pool.new_agent(SYSTEM_PROMPT)
+
+
+def measure(build, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        build()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    # インポートや初回生成の影響を除くためにウォームアップする
+    build_before()
+    model_pool.warm_up()
+
+    results = {
+        "before": measure(build_before, args.iterations),
+        "after": measure(build_after, args.iterations),
+    }
+
+    print(f"iterations={args.iterations}")
+    print(f"{'variant':<8} {'mean_ms':>9} {'p50_ms':>9} {'p99_ms':>9}")
+    for name, samples in results.items():
+        print(
+            f"{name:<8} {statistics.mean(samples):>9.3f} "
+            f"{percentile(samples, 50):>9.3f} {percentile(samples, 99):>9.3f}"
+        )
+    speedup = statistics.mean(results["before"]) / statistics.mean(results["after"])
+    print(f"speedup={speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
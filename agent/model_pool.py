@@ -0,0 +1,78 @@
+"""
+プロセス全体で共有するモデルプロバイダーのプール
+
+BedrockModel（boto3セッション・認証情報の解決・HTTPコネクションプールを含む）は
+会話状態を持たないため、プロセス内で1度だけ生成して全リクエストで共有する。
+会話履歴を持つAgentは呼び出しごとに生成し、セッション・ユーザー間で混ざらないようにする。
+"""
+import os
+import threading
+from typing import Dict, Optional
+
+import boto3
+from botocore.config import Config
+from strands import Agent
+from strands.models.bedrock import BedrockModel
+
+
+DEFAULT_MODEL_ID = os.environ.get("AGENT_MODEL_ID", "us.anthropic.claude-sonnet-4-6")
+
+# AgentCore Runtimeは1コンテナで複数リクエストを並行処理するため、プールを広めに取る
+BOTO_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("MODEL_MAX_POOL_CONNECTIONS", "50")),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=120,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+)
+
+_models: Dict[str, BedrockModel] = {}
+_lock = threading.Lock()
+_session: Optional[boto3.Session] = None
+
+
+def get_model(model_id: str = DEFAULT_MODEL_ID) -> BedrockModel:
+    """共有のモデルプロバイダーを返す（初回のみ生成）"""
+    model = _models.get(model_id)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(model_id)
+        if model is None:
+            model = BedrockModel(
+                model_id=model_id,
+                boto_session=_get_session(),
+                boto_client_config=BOTO_CLIENT_CONFIG,
+            )
+            _models[model_id] = model
+    return model
+
+
+def new_agent(system_prompt: str, model_id: str = DEFAULT_MODEL_ID) -> Agent:
+    """共有モデルを使い、会話履歴だけを持つリクエスト専用のAgentを生成"""
+    return Agent(
+        model=get_model(model_id),
+        system_prompt=system_prompt,
+        callback_handler=None,
+    )
+
+
+def warm_up(model_ids=(DEFAULT_MODEL_ID,)) -> None:
+    """起動時にモデルプロバイダーを生成しておく"""
+    for model_id in model_ids:
+        get_model(model_id)
+
+
+def clear() -> None:
+    """プールを破棄（テスト・ベンチマーク用）"""
+    global _session
+    with _lock:
+        _models.clear()
+        _session = None
+
+
+def _get_session() -> boto3.Session:
+    global _session
+    if _session is None:
+        _session = boto3.Session(region_name=os.environ.get("AWS_DEFAULT_REGION", "us-west-2"))
+    return _session
@@ -1,29 +1,50 @@
 import os
 from bedrock_agentcore import BedrockAgentCoreApp
-from strands import Agent
 
 # デフォルトリージョンを設定
 os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
 
+import model_pool
+
 app = BedrockAgentCoreApp()
 
 SYSTEM_PROMPT = os.environ.get("LINE_SYSTEM_PROMPT", "")
 
+# モデルプロバイダー（boto3クライアント・コネクションプール）は起動時に1度だけ生成する
+model_pool.warm_up()
+
 
 @app.entrypoint
 def invoke(payload, context=None):
-    """エージェントのエントリーポイント"""
+    """エージェントのエントリーポイント
+
+    payload["stream"] が真の場合はテキストの差分を生成順にストリーミングする（SSE）
+    """
     user_message = payload.get("prompt", "こんにちは！")
 
     # 呼び出しごとに新しいAgentを生成する。
     # グローバルで使い回すと内部会話履歴が全セッション・全ユーザーで混入するため、
     # コンテキストはLambda側がメモリ経由で注入する方式に統一する。
-    agent = Agent(model="us.anthropic.claude-sonnet-4-6", system_prompt=SYSTEM_PROMPT)
+    # 会話状態を持たないモデルプロバイダーはプロセス内で共有する。
+    agent = model_pool.new_agent(SYSTEM_PROMPT)
+
+    if payload.get("stream"):
+        return stream_response(agent, user_message)
+
     result = agent(user_message)
 
     return {"result": result.message}
 
 
+async def stream_response(agent, user_message):
+    """テキストの差分を {"delta": ...} として順に返し、最後に完成したメッセージを返す"""
+    async for event in agent.stream_async(user_message):
+        if "data" in event:
+            yield {"delta": event["data"]}
+        elif "result" in event:
+            yield {"result": event["result"].message}
+
+
 if __name__ == "__main__":
     # ローカルでテスト実行（ポート8080で起動）
     print("Starting agent on http://localhost:8080")
@@ -113,3 +113,31 @@ def test_agent_empty_prompt(agent_server):
     assert response.status_code == 200
     data = response.json()
     assert "result" in data
+
+
+def test_agent_streaming_response(agent_server):
+    """ストリーミング応答のテスト"""
+    deltas = []
+    final = None
+    with httpx.stream(
+        "POST",
+        "http://localhost:8080/invocations",
+        json={"prompt": "こんにちは", "stream": True},
+        timeout=30.0,
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        for line in response.iter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = json.loads(line[len("data: "):])
+            if "delta" in data:
+                deltas.append(data["delta"])
+            elif "result" in data:
+                final = data["result"]
+
+    # 差分が複数チャンクで届き、最後に完成したメッセージが届くこと
+    assert len(deltas) > 0
+    assert final is not None
+    assert "".join(deltas) == final["content"][0]["text"]
@@ -0,0 +1,35 @@
+"""
+モデルプロバイダープールのテスト（ネットワーク接続なし）
+"""
+import os
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+
+import model_pool
+
+
+def test_model_is_shared_across_calls():
+    """同じモデルIDには同じプロバイダーが返されることを確認"""
+    model_pool.clear()
+
+    assert model_pool.get_model() is model_pool.get_model()
+    assert model_pool.get_model("other-model") is not model_pool.get_model()
+
+
+def test_agents_share_model_but_not_messages():
+    """Agentはモデルを共有し、会話履歴は共有しないことを確認"""
+    first = model_pool.new_agent("system")
+    second = model_pool.new_agent("system")
+
+    assert first.model is second.model
+    first.messages.append({"role": "user", "content": [{"text": "秘密"}]})
+    assert second.messages == []
+
+
+def test_model_uses_pooled_client_config():
+    """共有モデルのboto3クライアントにコネクションプール設定が適用されることを確認"""
+    model_pool.clear()
+    client = model_pool.get_model().client
+
+    assert client.meta.config.max_pool_connections == model_pool.BOTO_CLIENT_CONFIG.max_pool_connections
+    assert client.meta.config.tcp_keepalive is True
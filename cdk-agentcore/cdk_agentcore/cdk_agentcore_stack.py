@@ -7,6 +7,8 @@ from aws_cdk import (
     aws_iam as iam,
     aws_lambda as lambda_,
     aws_dynamodb as dynamodb,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
 )
 from aws_cdk import aws_bedrock_agentcore_alpha as agentcore
 from constructs import Construct
@@ -112,6 +114,34 @@ class CdkAgentcoreStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,  # 開発用：本番環境ではRETAINに変更
         )
 
+        # DynamoDBテーブル（コンテナ間で共有するキャッシュ用）
+        cache_table = dynamodb.Table(
+            self,
+            "LineAgentCacheTable",
+            table_name="LineAgentCache",
+            partition_key=dynamodb.Attribute(
+                name="cache_key",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ttl",
+            removal_policy=RemovalPolicy.DESTROY,  # キャッシュなので保持不要
+        )
+
+        # DynamoDBテーブル（再送されたWebhookイベントの重複排除用）
+        idempotency_table = dynamodb.Table(
+            self,
+            "LineAgentIdempotencyTable",
+            table_name="LineAgentIdempotency",
+            partition_key=dynamodb.Attribute(
+                name="event_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ttl",
+            removal_policy=RemovalPolicy.DESTROY,  # 一時的な記録なので保持不要
+        )
+
         # AgentCore Memory（短期・長期記憶）
         memory = agentcore.Memory(self, "FamilyInfoMemory",
             memory_name="family_info_hub",
@@ -129,44 +159,104 @@ class CdkAgentcoreStack(Stack):
             ]
         )
 
+        # Webhookイベントのキュー（セッションキーをメッセージグループにして順序を保証）
+        event_dlq = sqs.Queue(
+            self,
+            "LineBotEventDLQ",
+            fifo=True,
+            retention_period=Duration.days(14),
+        )
+        event_queue = sqs.Queue(
+            self,
+            "LineBotEventQueue",
+            fifo=True,
+            # ワーカーのタイムアウトより十分長くする
+            visibility_timeout=Duration.seconds(360),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=event_dlq),
+        )
+
+        lambda_code = lambda_.Code.from_asset(
+            "../line-bot-lambda",
+            bundling=core.BundlingOptions(
+                image=lambda_.Runtime.PYTHON_3_13.bundling_image,
+                command=[
+                    "bash", "-c",
+                    "pip install --platform manylinux2014_x86_64 --only-binary=:all: -r requirements.txt -t /asset-output && cp -au . /asset-output"
+                ],
+            )
+        )
+        lambda_environment = {
+            "LINE_CHANNEL_ACCESS_TOKEN": os.environ.get("LINE_CHANNEL_ACCESS_TOKEN", ""),
+            "LINE_CHANNEL_SECRET": os.environ.get("LINE_CHANNEL_SECRET", ""),
+            "AGENT_RUNTIME_ARN": runtime.agent_runtime_arn,
+            "SESSION_TABLE_NAME": session_table.table_name,
+            "CACHE_TABLE_NAME": cache_table.table_name,
+            "IDEMPOTENCY_TABLE_NAME": idempotency_table.table_name,
+            "MEMORY_ID": memory.memory_id,
+            "LINE_SYSTEM_PROMPT": LINE_SYSTEM_PROMPT,
+            # 初期化フェーズでAWSの各エンドポイントへ接続しておく
+            "PREWARM_CONNECTIONS": "true",
+        }
+
         # Lambda Function（LINE Bot Webhook Handler）
+        # 署名検証してキューに積むだけなので、モデルの応答時間に関係なく即座に200を返す
         line_bot_lambda = lambda_.Function(
             self,
             "LineBotWebhookHandler",
             runtime=lambda_.Runtime.PYTHON_3_13,
             handler="lambda_function.lambda_handler",
-            code=lambda_.Code.from_asset(
-                "../line-bot-lambda",
-                bundling=core.BundlingOptions(
-                    image=lambda_.Runtime.PYTHON_3_13.bundling_image,
-                    command=[
-                        "bash", "-c",
-                        "pip install --platform manylinux2014_x86_64 --only-binary=:all: -r requirements.txt -t /asset-output && cp -au . /asset-output"
-                    ],
-                )
-            ),
+            code=lambda_code,
             timeout=Duration.seconds(30),
             memory_size=256,
             environment={
-                "LINE_CHANNEL_ACCESS_TOKEN": os.environ.get("LINE_CHANNEL_ACCESS_TOKEN", ""),
-                "LINE_CHANNEL_SECRET": os.environ.get("LINE_CHANNEL_SECRET", ""),
-                "AGENT_RUNTIME_ARN": runtime.agent_runtime_arn,
-                "SESSION_TABLE_NAME": session_table.table_name,
-                "MEMORY_ID": memory.memory_id,
-                "LINE_SYSTEM_PROMPT": LINE_SYSTEM_PROMPT,
+                **lambda_environment,
+                "PROCESSING_MODE": "async",
+                "EVENT_QUEUE_URL": event_queue.queue_url,
             }
         )
+        event_queue.grant_send_messages(line_bot_lambda)
+
+        # Lambda Function（LINE Bot Worker）
+        # キューからイベントを受け取り、エージェント呼び出しと返信を行う
+        line_bot_worker = lambda_.Function(
+            self,
+            "LineBotWorker",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            handler="lambda_function.worker_handler",
+            code=lambda_code,
+            timeout=Duration.seconds(60),
+            memory_size=256,
+            environment={
+                **lambda_environment,
+                # タイムアウトまでに書き込みきれない会話の保存は同じキューに退避する
+                "EVENT_QUEUE_URL": event_queue.queue_url,
+            },
+        )
+        event_queue.grant_send_messages(line_bot_worker)
+        line_bot_worker.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                event_queue,
+                batch_size=10,
+                report_batch_item_failures=True,
+            )
+        )
 
         # Lambda Function URLを作成
         function_url = line_bot_lambda.add_function_url(
             auth_type=lambda_.FunctionUrlAuthType.NONE,  # LINE署名で保護
         )
 
+        # 受信Lambdaはキューへの送信と重複排除のテーブルだけを使う
+        idempotency_table.grant_read_write_data(line_bot_lambda)
+
+        # エージェント呼び出し・記憶・画像分析はワーカーだけが行う
         # DynamoDBテーブルへのアクセス権限
-        session_table.grant_read_write_data(line_bot_lambda)
+        session_table.grant_read_write_data(line_bot_worker)
+        cache_table.grant_read_write_data(line_bot_worker)
+        idempotency_table.grant_read_write_data(line_bot_worker)
 
         # AgentCore Runtime呼び出し権限
-        line_bot_lambda.add_to_role_policy(
+        line_bot_worker.add_to_role_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
                 actions=["bedrock-agentcore:InvokeAgentRuntime"],
@@ -178,7 +268,7 @@ class CdkAgentcoreStack(Stack):
         )
 
         # AgentCore Memory操作権限
-        line_bot_lambda.add_to_role_policy(
+        line_bot_worker.add_to_role_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
                 actions=[
@@ -197,7 +287,7 @@ class CdkAgentcoreStack(Stack):
 
         # Bedrock Claude vision（画像分析）呼び出し権限
         # クロスリージョン推論プロファイル(us.*)は内部でfoundation modelにルーティングするため両方必要
-        line_bot_lambda.add_to_role_policy(
+        line_bot_worker.add_to_role_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
                 actions=["bedrock:InvokeModel"],
@@ -227,3 +317,10 @@ class CdkAgentcoreStack(Stack):
             description="AgentCore Memory ID",
             value=memory.memory_id
         )
+
+        CfnOutput(
+            self,
+            "EventQueueUrl",
+            description="SQS FIFO queue URL for webhook events",
+            value=event_queue.queue_url
+        )
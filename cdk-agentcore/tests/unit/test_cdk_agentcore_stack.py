@@ -99,3 +99,48 @@ def test_lambda_function_url_created():
 
 
 
+
+
+def test_event_queue_and_worker_created():
+    """イベントキューとワーカーLambdaが作成されることを確認"""
+    app = core.App()
+    stack = CdkAgentcoreStack(app, "cdk-agentcore")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::SQS::Queue", {
+        "FifoQueue": True,
+        "VisibilityTimeout": 360
+    })
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.worker_handler",
+        "Timeout": 60
+    })
+
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 10,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Environment": {
+            "Variables": assertions.Match.object_like({"PROCESSING_MODE": "async"})
+        }
+    })
+
+
+def test_cache_table_created():
+    """共有キャッシュ用のDynamoDBテーブルが作成されることを確認"""
+    app = core.App()
+    stack = CdkAgentcoreStack(app, "cdk-agentcore")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "TableName": "LineAgentCache",
+        "KeySchema": [{"AttributeName": "cache_key", "KeyType": "HASH"}],
+        "TimeToLiveSpecification": {
+            "AttributeName": "ttl",
+            "Enabled": True
+        }
+    })
@@ -0,0 +1,151 @@
+"""
+AgentCore Runtimeのストリーミング応答（Server-Sent Events）の逐次パーサー
+
+チャンクを受け取るたびに解析し、文や段落が完成した時点でセグメントとして記録する
+"""
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, List, Optional
+
+
+# 文末とみなす文字
+SENTENCE_TERMINATORS = "。！？!?"
+
+
+def iter_sse_data(lines: Iterable[bytes]) -> Iterator[Any]:
+    """SSEの行ストリームから data フィールドのJSONを順に取り出す
+
+    複数行にまたがる data は仕様どおり改行で連結してから解析する
+    """
+    buffer: List[str] = []
+    for raw in lines:
+        line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        line = line.rstrip("\r\n")
+        if not line:
+            if buffer:
+                yield _parse_data("\n".join(buffer))
+                buffer = []
+            continue
+        if line.startswith(":"):
+            continue
+        if line.startswith("data:"):
+            value = line[5:]
+            buffer.append(value[1:] if value.startswith(" ") else value)
+    if buffer:
+        yield _parse_data("\n".join(buffer))
+
+
+def _parse_data(data: str) -> Any:
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError:
+        return data
+
+
+class SentenceSegmenter:
+    """テキストの差分を受け取り、完成した文（または段落）を切り出す"""
+
+    def __init__(self, mode: str = "sentence"):
+        if mode not in ("sentence", "paragraph"):
+            raise ValueError(f"Unknown segment mode: {mode}")
+        self.mode = mode
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """差分を追加し、新たに完成したセグメントを返す"""
+        self._buffer += text
+        segments = []
+        while True:
+            end = self._find_boundary()
+            if end < 0:
+                return segments
+            segment, self._buffer = self._buffer[:end], self._buffer[end:]
+            if segment.strip():
+                segments.append(segment.strip())
+
+    def flush(self) -> List[str]:
+        """残りのテキストを最後のセグメントとして返す"""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+    def _find_boundary(self) -> int:
+        paragraph = self._buffer.find("\n\n")
+        if self.mode == "paragraph":
+            return paragraph + 2 if paragraph >= 0 else -1
+        candidates = [paragraph + 2] if paragraph >= 0 else []
+        newline = self._buffer.find("\n")
+        if newline >= 0:
+            candidates.append(newline + 1)
+        for i, ch in enumerate(self._buffer):
+            if ch in SENTENCE_TERMINATORS:
+                # 「！？」のように文末記号が続く場合はまとめて1つの文末にする
+                j = i + 1
+                while j < len(self._buffer) and self._buffer[j] in SENTENCE_TERMINATORS:
+                    j += 1
+                if j < len(self._buffer):
+                    candidates.append(j)
+                break
+        return min(candidates) if candidates else -1
+
+
+@dataclass
+class StreamResult:
+    """ストリーム全体の結果"""
+    text: str
+    segments: List[str] = field(default_factory=list)
+    chunks: int = 0
+    first_segment_ms: Optional[float] = None
+    total_ms: float = 0.0
+
+
+def consume_agent_stream(
+    lines: Iterable[bytes],
+    mode: str = "sentence",
+    started: Optional[float] = None,
+) -> StreamResult:
+    """エージェントのストリーミング応答を逐次解析する
+
+    エージェントは {"delta": "..."} を順に送り、最後に {"result": message} を送る。
+    エラーイベント（{"error": ...}）を受け取った場合は RuntimeError を送出する。
+    started にはリクエストを送った時刻（time.perf_counter()）を渡す。
+    first_segment_ms と total_ms はそこから計る（省略時は解析の開始から）
+    """
+    if started is None:
+        started = time.perf_counter()
+    segmenter = SentenceSegmenter(mode)
+    parts: List[str] = []
+    result = StreamResult(text="")
+    final_message: Optional[Any] = None
+
+    def emit(segments: List[str]) -> None:
+        for segment in segments:
+            if result.first_segment_ms is None:
+                result.first_segment_ms = (time.perf_counter() - started) * 1000
+            result.segments.append(segment)
+
+    for data in iter_sse_data(lines):
+        result.chunks += 1
+        if isinstance(data, dict):
+            if "error" in data:
+                raise RuntimeError(f"Agent stream error: {data['error']}")
+            if "delta" in data:
+                parts.append(data["delta"])
+                emit(segmenter.feed(data["delta"]))
+            elif "result" in data:
+                final_message = data["result"]
+        elif isinstance(data, str):
+            parts.append(data)
+            emit(segmenter.feed(data))
+
+    emit(segmenter.flush())
+
+    result.text = "".join(parts)
+    if not result.text and isinstance(final_message, dict):
+        # 差分が届かなかった場合は最終メッセージから本文を取り出す
+        content = final_message.get("content", [])
+        if isinstance(content, list) and content:
+            result.text = content[0].get("text", "")
+            emit([result.text] if result.text else [])
+    result.total_ms = (time.perf_counter() - started) * 1000
+    return result
@@ -0,0 +1,156 @@
+"""
+プロセス全体で共有するAWSクライアントのレジストリ
+
+クライアントはサービスごとに1度だけ生成し、ウォームコンテナ内の全リクエストで使い回す。
+botocoreの既定値（コネクションプール10、タイムアウト60秒、legacyリトライ）の代わりに、
+サービスごとに明示した設定を使う。prewarm() でLambdaの初期化中に各エンドポイントへ接続しておくと、
+最初のリクエストがTCP・TLSの確立を待たずに済む。
+LazyClient はモジュール変数として公開しつつ、生成を初回利用時まで遅らせる（コールドスタート対策）
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import boto3
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+
+import log
+
+
+AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "us-west-2")
+# ステージ・イベント・長期記憶検索のスレッドが同時に使うため、既定の10より広めに取る
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "32"))
+
+# サービスごとのタイムアウト（秒）とリトライ回数
+# モデルの呼び出しはワーカーLambdaのタイムアウト（60秒）に収まるようにする
+SERVICE_SETTINGS: Dict[str, Dict[str, Any]] = {
+    "dynamodb": {"connect_timeout": 2, "read_timeout": 5, "max_attempts": 3},
+    "sqs": {"connect_timeout": 2, "read_timeout": 10, "max_attempts": 3},
+    "lambda": {"connect_timeout": 2, "read_timeout": 10, "max_attempts": 3},
+    "bedrock-agentcore": {"connect_timeout": 3, "read_timeout": 50, "max_attempts": 2},
+    "bedrock-runtime": {"connect_timeout": 3, "read_timeout": 50, "max_attempts": 2},
+}
+DEFAULT_SETTINGS = {"connect_timeout": 3, "read_timeout": 30, "max_attempts": 3}
+
+_clients: Dict[str, Any] = {}
+_resources: Dict[str, Any] = {}
+_lock = threading.Lock()
+_session: Optional[boto3.Session] = None
+
+
+def build_config(service: str) -> Config:
+    """サービスごとのbotocore設定"""
+    settings = SERVICE_SETTINGS.get(service, DEFAULT_SETTINGS)
+    return Config(
+        region_name=AWS_REGION,
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings["connect_timeout"],
+        read_timeout=settings["read_timeout"],
+        retries={"max_attempts": settings["max_attempts"], "mode": "adaptive"},
+        tcp_keepalive=True,
+    )
+
+
+def client(service: str) -> Any:
+    """共有のクライアントを返す（初回のみ生成）"""
+    found = _clients.get(service)
+    if found is not None:
+        return found
+    # boto3のセッションはスレッドセーフではないため、生成はロック内で行う
+    with _lock:
+        found = _clients.get(service)
+        if found is None:
+            found = _get_session().client(service, config=build_config(service))
+            _clients[service] = found
+    return found
+
+
+def resource(service: str) -> Any:
+    """共有のリソースを返す（初回のみ生成）"""
+    found = _resources.get(service)
+    if found is not None:
+        return found
+    with _lock:
+        found = _resources.get(service)
+        if found is None:
+            found = _get_session().resource(service, config=build_config(service))
+            _resources[service] = found
+    return found
+
+
+class LazyClient:
+    """初回の属性アクセスで生成されるクライアント・リソースの代理
+
+    モジュール変数として置いたままテストからpatchでき、import時にはbotocoreのモデルを読み込まない
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._target: Any = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> Any:
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+
+def lazy_client(service: str) -> LazyClient:
+    return LazyClient(lambda: client(service))
+
+
+def lazy_resource(service: str) -> LazyClient:
+    return LazyClient(lambda: resource(service))
+
+
+def prewarm(clients: Iterable[Any]) -> Dict[str, bool]:
+    """各クライアントのエンドポイントへ接続し、コネクションプールにTLS接続を残す
+
+    署名なしのHEADリクエストを送るだけなので、権限もAPIの副作用もない。
+    応答の内容（403など）は問わず、失敗しても通常の処理には影響しない。
+    待ち時間は各クライアントの接続・読み込みタイムアウトで抑えられる
+    """
+    clients = list(clients)
+    if not clients:
+        return {}
+
+    def open_connection(aws_client: Any) -> bool:
+        try:
+            request = AWSRequest(method="HEAD", url=aws_client.meta.endpoint_url).prepare()
+            # クライアント自身のHTTPセッション（コネクションプール）を使う
+            aws_client._endpoint.http_session.send(request)
+            return True
+        except Exception as e:
+            log.warning(
+                "Connection prewarm failed",
+                service=aws_client.meta.service_model.service_name,
+                error=str(e),
+            )
+            return False
+
+    with ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix="prewarm") as pool:
+        futures = {c.meta.service_model.service_name: pool.submit(open_connection, c) for c in clients}
+        return {name: f.result() for name, f in futures.items()}
+
+
+def clear() -> None:
+    """レジストリを破棄（テスト用）"""
+    global _session
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _session = None
+
+
+def _get_session() -> boto3.Session:
+    global _session
+    if _session is None:
+        _session = boto3.Session(region_name=AWS_REGION)
+    return _session
@@ -0,0 +1,108 @@
+"""
+Webhook Lambdaのコールドスタート（モジュールのimportと初期化）のベンチマーク
+
+新しいPythonプロセスで `import lambda_function` を繰り返し、所要時間とピークRSSを計測する。
+`-X importtime` の結果から、累積時間の大きいモジュールも表示する。
+予算（README記載）を超えた場合は終了コード1で終わる
+
+    uv run python benchmarks/bench_cold_start.py [--iterations 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# コールドスタートの予算（README・tests/test_cold_start.py と合わせる）
+IMPORT_BUDGET_MS = 600
+RSS_BUDGET_MB = 60
+# import時に読み込まれてはならない重いモジュール（初回利用時に読み込む）
+DEFERRED_MODULES = ("linebot", "pydantic", "aiohttp", "PIL")
+
+CHILD_CODE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import lambda_function
+elapsed = (time.perf_counter() - started) * 1000
+# ru_maxrssはfork元のピークを引き継ぐことがあるため、Linuxではexec後のVmHWMを使う
+try:
+    with open("/proc/self/status") as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_ms": elapsed,
+    "rss_mb": peak_kb / 1024,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def child_env() -> Dict[str, str]:
+    """lambda_functionのimportに必要な環境変数（ダミー値）"""
+    env = dict(os.environ)
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "dummy")
+    env.setdefault("LINE_CHANNEL_SECRET", "dummy")
+    env.setdefault("AGENT_RUNTIME_ARN", "arn:aws:bedrock-agentcore:us-west-2:000000000000:runtime/dummy")
+    env.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+    # 接続の事前確立はネットワークに依存するため計測から外す
+    env["PREWARM_CONNECTIONS"] = "false"
+    return env
+
+
+def measure_once(importtime: bool = False) -> Tuple[dict, str]:
+    """新しいプロセスで1回importし、(計測結果, -X importtimeの出力) を返す"""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    result = subprocess.run(
+        command + ["-c", CHILD_CODE],
+        cwd=LAMBDA_DIR, env=child_env(), check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def top_imports(importtime_output: str, top: int) -> List[Tuple[int, str]]:
+    """-X importtime の出力から累積時間（マイクロ秒）の大きい順に返す"""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    samples = [measure_once()[0] for _ in range(args.iterations)]
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    rss_mb = statistics.median(s["rss_mb"] for s in samples)
+    loaded = sorted({m for s in samples for m in s["loaded"]})
+
+    _, importtime_output = measure_once(importtime=True)
+    print(f"{'cumulative_ms':>13}  module")
+    for cumulative, name in top_imports(importtime_output, args.top):
+        print(f"{cumulative / 1000:>13.1f}  {name}")
+    print()
+    print(f"import_ms: {import_ms:.0f} (budget {IMPORT_BUDGET_MS})")
+    print(f"rss_mb:    {rss_mb:.1f} (budget {RSS_BUDGET_MB})")
+    print(f"deferred modules loaded at import: {loaded or 'none'}")
+
+    if import_ms > IMPORT_BUDGET_MS or rss_mb > RSS_BUDGET_MB or loaded:
+        print("Cold-start budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Webhookのホットパスのベンチマーク（AgentCore・DynamoDB・LINE・Bedrockはプロセス内の擬似実装）
+
+lambda_handler（テキストメッセージ1件のエンドツーエンド）と、verify_signature・get_short_term_memory・
+get_long_term_memory・invoke_agent・analyze_image を個別に計測し、p50/p99を表示する。
+擬似実装は呼び出しごとに BACKEND_LATENCY_MS × --latency-scale だけ待つため、
+ステージの並列化・呼び出し回数・CPU処理の変化が所要時間に表れる。
+
+- キャッシュ（長期記憶・画像分析）は無効にし、毎回バックエンドを呼ぶ経路を計測する
+- セッション行は作成済み、ウォームコンテナのLRUキャッシュは毎回空にする（DynamoDBのget_itemを含める）
+
+結果は benchmarks/baseline.json と比較する。p50が許容幅（--tolerance、かつ --min-delta-ms）を超えて
+遅くなった項目があれば、--check 指定時は終了コード1で終わる。--update-baseline で基準を更新する
+
+    uv run python benchmarks/bench_hot_path.py [--iterations 30] [--latency-scale 0.1] [--check]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, LAMBDA_DIR)
+
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "bench-secret")
+os.environ.setdefault("AGENT_RUNTIME_ARN", "arn:aws:bedrock-agentcore:us-west-2:000000000000:runtime/bench")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("MEMORY_ID", "bench-memory")
+os.environ["PROCESSING_MODE"] = "sync"
+os.environ["PREWARM_CONNECTIONS"] = "false"
+os.environ["LTM_CACHE_ENABLED"] = "false"
+os.environ["IMAGE_CACHE_ENABLED"] = "false"
+os.environ["CACHE_TABLE_NAME"] = ""
+# ログとEMFの出力は計測から外す
+os.environ["LOG_LEVEL"] = "ERROR"
+os.environ["METRICS_ENABLED"] = "false"
+
+import aws_clients  # noqa: E402
+import lambda_function  # noqa: E402
+from session_manager import SessionManager  # noqa: E402
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 擬似バックエンドの1回あたりの待ち時間（ミリ秒、--latency-scale 1 のとき）
+BACKEND_LATENCY_MS = {
+    "dynamodb": 8,
+    "list_events": 40,
+    "retrieve_memory_records": 80,
+    "create_event": 30,
+    "invoke_agent_runtime": 1500,
+    "invoke_model": 2000,
+    "line_reply": 40,
+    "line_content": 60,
+}
+
+SESSION_KEY = "Ubench"
+USER_MESSAGE = "明日の持ち物を教えて"
+
+
+class FakeBackends:
+    """擬似バックエンドの共通設定（待ち時間）"""
+
+    def __init__(self, scale: float):
+        self.scale = scale
+
+    def wait(self, name: str) -> None:
+        delay = BACKEND_LATENCY_MS[name] * self.scale / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeAgentCore:
+    """bedrock-agentcore（Memory・Runtime）"""
+
+    def __init__(self, backends: FakeBackends):
+        self.backends = backends
+
+    def list_events(self, **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("list_events")
+        return {"events": [
+            {"payload": [
+                {"conversational": {"role": "USER", "content": {"text": f"質問{i}"}}},
+                {"conversational": {"role": "ASSISTANT", "content": {"text": f"回答{i}" * 20}}},
+            ]}
+            for i in range(kwargs.get("maxResults", 10) // 2)
+        ]}
+
+    def retrieve_memory_records(self, **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("retrieve_memory_records")
+        namespace = kwargs["namespace"]
+        return {"memoryRecordSummaries": [
+            {"content": {"text": f"{namespace} の記録{i}"}, "score": 0.9 - i * 0.1}
+            for i in range(kwargs["searchCriteria"]["topK"])
+        ]}
+
+    def create_event(self, **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("create_event")
+        return {}
+
+    def invoke_agent_runtime(self, **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("invoke_agent_runtime")
+        body = json.dumps({"result": {"content": [{"text": "体操服と水筒です。"}]}}).encode("utf-8")
+        return {"contentType": "application/json", "response": io.BytesIO(body)}
+
+
+class FakeTable:
+    """DynamoDBのセッションテーブル（条件式は評価しない）"""
+
+    def __init__(self, backends: FakeBackends):
+        self.backends = backends
+        self.items: Dict[str, Dict[str, Any]] = {}
+
+    def get_item(self, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("dynamodb")
+        item = self.items.get(Key["user_id"])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("dynamodb")
+        self.items[Item["user_id"]] = dict(Item)
+        return {}
+
+    def update_item(self, Key: Dict[str, Any], ExpressionAttributeValues: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("dynamodb")
+        item = self.items[Key["user_id"]]
+        names = kwargs.get("ExpressionAttributeNames", {})
+        # 「属性 = :値」の代入だけを反映する
+        for name, value in re.findall(r"([#\w]+) = (:\w+)", kwargs.get("UpdateExpression", "")):
+            item[names.get(name, name)] = ExpressionAttributeValues[value]
+        return {}
+
+
+class FakeDynamoDB:
+    """DynamoDBのリソース（Table・batch_get_item）"""
+
+    def __init__(self, backends: FakeBackends):
+        self.backends = backends
+        self.tables: Dict[str, FakeTable] = {}
+
+    def Table(self, name: str) -> FakeTable:
+        return self.tables.setdefault(name, FakeTable(self.backends))
+
+    def batch_get_item(self, RequestItems: Dict[str, Any]) -> Dict[str, Any]:
+        self.backends.wait("dynamodb")
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [table.items[k["user_id"]] for k in request["Keys"] if k["user_id"] in table.items]
+        return {"Responses": responses}
+
+
+class FakeBedrockRuntime:
+    """bedrock-runtime（Claude vision）"""
+
+    def __init__(self, backends: FakeBackends):
+        self.backends = backends
+
+    def invoke_model(self, **kwargs: Any) -> Dict[str, Any]:
+        self.backends.wait("invoke_model")
+        body = json.dumps({"content": [{"text": "学校からのお知らせです。"}]}).encode("utf-8")
+        return {"body": io.BytesIO(body)}
+
+
+def fake_line_sdk(backends: FakeBackends, image: bytes) -> Dict[str, Any]:
+    """lambda_function が関数内で読み込むLINE SDK（linebot.v3.messaging）の名前の代わり"""
+
+    class FakeMessagingApi:
+        def __init__(self, api_client: Any):
+            pass
+
+        def reply_message(self, request: Any, **kwargs: Any) -> None:
+            backends.wait("line_reply")
+
+        def push_message(self, request: Any, **kwargs: Any) -> None:
+            backends.wait("line_reply")
+
+    class FakeMessagingApiBlob:
+        def __init__(self, api_client: Any):
+            pass
+
+        def get_message_content(self, message_id: str, **kwargs: Any) -> bytes:
+            backends.wait("line_content")
+            return image
+
+    return {
+        "MessagingApi": FakeMessagingApi,
+        "MessagingApiBlob": FakeMessagingApiBlob,
+        "ReplyMessageRequest": lambda **kwargs: kwargs,
+        "PushMessageRequest": lambda **kwargs: kwargs,
+        "TextMessage": lambda **kwargs: kwargs,
+    }
+
+
+def make_photo() -> bytes:
+    """スマートフォンの写真相当のJPEG（前処理の縮小・再エンコードを含めて計測する）"""
+    from PIL import Image
+
+    size = (3024, 4032)
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def install_fakes(scale: float) -> FakeBackends:
+    """lambda_function の外部呼び出しを擬似実装に差し替える"""
+    backends = FakeBackends(scale)
+    dynamodb = FakeDynamoDB(backends)
+    lambda_function.bedrock_client = FakeAgentCore(backends)
+    lambda_function.session_manager = SessionManager(dynamodb, lambda_function.SESSION_TABLE_NAME)
+    lambda_function.session_manager.get_or_create(SESSION_KEY)
+    aws_clients._clients["bedrock-runtime"] = FakeBedrockRuntime(backends)
+    from linebot.v3 import messaging
+
+    for name, value in fake_line_sdk(backends, make_photo()).items():
+        setattr(messaging, name, value)
+    lambda_function._line_api_client = object()
+    return backends
+
+
+def webhook_event() -> Dict[str, Any]:
+    """署名付きのテキストメッセージ1件のFunction URLイベント"""
+    body = json.dumps({"events": [{
+        "type": "message",
+        "replyToken": "bench-reply-token",
+        "source": {"type": "user", "userId": SESSION_KEY},
+        "message": {"type": "text", "text": USER_MESSAGE},
+    }]})
+    digest = hmac.new(lambda_function.LINE_CHANNEL_SECRET.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return {"headers": {"x-line-signature": base64.b64encode(digest).decode("utf-8")}, "body": body}
+
+
+def cases() -> Dict[str, Callable[[], Any]]:
+    event = webhook_event()
+    signature = event["headers"]["x-line-signature"]
+    session_id = lambda_function.session_manager.get_or_create(SESSION_KEY)
+
+    def end_to_end() -> None:
+        # ウォームコンテナのセッションキャッシュを空にし、DynamoDBの読み込みを含める
+        lambda_function.session_manager.clear()
+        response = lambda_function.lambda_handler(event, None)
+        assert response["statusCode"] == 200, response
+
+    def short_term_memory() -> str:
+        # キャッシュ済みのバッファではなく、セッション行の get_item 1回で読む経路を計測する
+        lambda_function.session_manager.clear()
+        return lambda_function.get_short_term_memory(SESSION_KEY, session_id)
+
+    return {
+        "lambda_handler": end_to_end,
+        "verify_signature": lambda: lambda_function.verify_signature(event["body"], signature),
+        "get_short_term_memory": short_term_memory,
+        "get_long_term_memory": lambda: lambda_function.get_long_term_memory(SESSION_KEY, USER_MESSAGE),
+        "invoke_agent": lambda: lambda_function.invoke_agent(session_id, USER_MESSAGE, "履歴", "記憶"),
+        "analyze_image": lambda: lambda_function.analyze_image("bench-image"),
+    }
+
+
+def measure(func: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+    }
+
+
+def run_suite(iterations: int, scale: float, only: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    install_fakes(scale)
+    return {
+        name: measure(func, iterations)
+        for name, func in cases().items()
+        if not only or name in only
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+    min_delta_ms: float,
+) -> List[str]:
+    """基準より遅くなった項目を返す（p50の比率と差の両方が閾値を超えたもの）"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        delta = result["p50_ms"] - base["p50_ms"]
+        if delta > min_delta_ms and result["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--latency-scale", type=float, default=0.1)
+    parser.add_argument("--only", nargs="*", help="計測する項目（省略時はすべて）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p50の許容比率（デフォルト: 0.2 = 20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="これ未満の差は回帰としない")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="回帰があれば終了コード1で終わる")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    results = run_suite(args.iterations, args.latency_scale, args.only)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    comparable = baseline.get("latency_scale") == args.latency_scale
+    base_results = baseline.get("results", {}) if comparable else {}
+
+    if args.json:
+        print(json.dumps({"latency_scale": args.latency_scale, "results": results}, ensure_ascii=False))
+    else:
+        print(f"iterations: {args.iterations}, latency_scale: {args.latency_scale}")
+        if baseline and not comparable:
+            print(f"baseline latency_scale {baseline.get('latency_scale')} differs; not comparing")
+        print(f"{'function':<22} {'p50_ms':>9} {'p99_ms':>9} {'base_p50':>9} {'change':>8}")
+        for name, r in results.items():
+            base = base_results.get(name)
+            base_p50 = f"{base['p50_ms']:>9.3f}" if base else f"{'-':>9}"
+            change = f"{(r['p50_ms'] / base['p50_ms'] - 1) * 100:>+7.0f}%" if base and base["p50_ms"] else f"{'-':>8}"
+            print(f"{name:<22} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {base_p50} {change}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"latency_scale": args.latency_scale, "iterations": args.iterations, "results": results},
+                f, ensure_ascii=False, indent=2,
+            )
+            f.write("\n")
+        return
+
+    regressions = compare(results, base_results, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print(f"Regressions (p50 > baseline +{args.tolerance:.0%}): {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+画像分析リクエスト組み立てのベンチマーク（ピークメモリと所要時間）
+
+baseline:     元画像をそのままbase64文字列にしてJSONボディを組み立てる（従来の analyze_image）
+preprocessed: 縮小・再エンコードしてからバイト列のままボディを組み立てる
+
+スマートフォンの写真相当（4032x3024など、数MBのJPEG）を合成して使う。
+ピークRSSの増分は変種ごとに別プロセスで計測する（traced_MBはPythonオブジェクトのピーク）
+
+    uv run python benchmarks/bench_image_preprocess.py [--iterations 5]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image
+
+from image_preprocess import build_vision_body, preprocess_image
+
+
+PROMPT = "この画像について日本語で説明してください。"
+
+PHOTO_SIZES = {
+    "12mp": (4032, 3024),
+    "8mp": (3264, 2448),
+}
+
+
+def make_photo(size) -> bytes:
+    """グラデーションとノイズで実写に近い圧縮率のJPEGを合成"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def baseline(data: bytes) -> bytes:
+    image_base64 = base64.b64encode(data).decode("utf-8")
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1024,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": image_base64}},
+                {"type": "text", "text": PROMPT},
+            ],
+        }],
+    }
+    return json.dumps(body).encode("utf-8")
+
+
+def preprocessed(data: bytes) -> bytes:
+    return build_vision_body([preprocess_image(data)], PROMPT)
+
+
+VARIANTS = {"baseline": baseline, "preprocessed": preprocessed}
+
+
+def reset_peak_rss() -> None:
+    """ピークRSSを現在のRSSに戻す（Linuxのみ。インポートやファイル読み込みのピークを除くため）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrssはLinuxではKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(variant: str, path: str, iterations: int) -> dict:
+    """子プロセスで1つの変種を計測（写真の合成によるメモリ使用を含めないようファイルから読む）"""
+    with open(path, "rb") as f:
+        data = f.read()
+    func = VARIANTS[variant]
+    reset_peak_rss()
+    rss_before = peak_rss_kb()
+
+    samples = []
+    body_bytes = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        body_bytes = len(func(data))
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    func(data)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_after = peak_rss_kb()
+    return {
+        "input_bytes": len(data),
+        "body_bytes": body_bytes,
+        "p50_ms": statistics.median(samples),
+        "max_ms": max(samples),
+        "traced_peak_mb": traced_peak / 1e6,
+        "rss_growth_mb": (rss_after - rss_before) / 1e3,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("VARIANT", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], args.iterations)))
+        return
+
+    print(f"{'photo':<6} {'variant':<13} {'input_MB':>9} {'body_MB':>8} {'p50_ms':>8} {'max_ms':>8} {'traced_MB':>10} {'rss_MB':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for photo, size in PHOTO_SIZES.items():
+            path = os.path.join(tmp, f"{photo}.jpg")
+            with open(path, "wb") as f:
+                f.write(make_photo(size))
+            for variant in VARIANTS:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--iterations", str(args.iterations), "--child", variant, path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                r = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{photo:<6} {variant:<13} {r['input_bytes'] / 1e6:>9.2f} {r['body_bytes'] / 1e6:>8.2f} "
+                    f"{r['p50_ms']:>8.1f} {r['max_ms']:>8.1f} {r['traced_peak_mb']:>10.2f} {r['rss_growth_mb']:>7.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
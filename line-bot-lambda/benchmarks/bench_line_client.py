@@ -0,0 +1,132 @@
+"""
+LINE Reply APIの呼び出しレイテンシのベンチマーク（ローカルの擬似LINEサーバー）
+
+per_call: 返信ごとに `with ApiClient(configuration)` を開く（従来の reply_message）
+shared:   コンテナ内で共有するApiClient（keep-alive接続を使い回す）
+
+opensslコマンドがあれば自己署名証明書でHTTPSサーバーを立て、TLSハンドシェイクの費用も含めて計測する。
+--latency-ms で擬似的なネットワーク往復時間（接続確立時と各応答に加算）を指定できる
+
+    uv run python benchmarks/bench_line_client.py [--iterations 200] [--latency-ms 0]
+"""
+import argparse
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import urllib3
+from linebot.v3.messaging import ApiClient, Configuration, MessagingApi, ReplyMessageRequest, TextMessage
+
+from line_client import REPLY_TIMEOUT, build_configuration
+
+
+class FakeLineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に書き出すため、Nagleアルゴリズムと遅延ACKによる待ちを避ける
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def setup(self):
+        # 接続の確立（TCP・TLS）に往復時間を加える
+        time.sleep(self.latency)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        body = json.dumps({"sentMessages": [{"id": "1", "quoteToken": "q"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(tmp: str, latency: float):
+    """擬似LINEサーバーを起動し、(server, host, tls) を返す"""
+    FakeLineHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLineHandler)
+    tls = shutil.which("openssl") is not None
+    if tls:
+        cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+            check=True, capture_output=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = "https" if tls else "http"
+    return server, f"{scheme}://127.0.0.1:{server.server_port}", tls
+
+
+def request() -> ReplyMessageRequest:
+    return ReplyMessageRequest(reply_token="token", messages=[TextMessage(text="こんにちは")])
+
+
+def measure(reply, iterations: int) -> dict:
+    reply()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        reply()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": statistics.median(samples),
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "mean_ms": statistics.mean(samples),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, host, tls = start_server(tmp, args.latency_ms / 1000)
+        try:
+            # 自己署名証明書のため、両方とも証明書の検証を無効にして条件をそろえる
+            def per_call():
+                configuration = Configuration(access_token="token", host=host)
+                configuration.verify_ssl = False
+                with ApiClient(configuration) as api_client:
+                    MessagingApi(api_client).reply_message(request())
+
+            shared_configuration = build_configuration("token", host=host)
+            shared_configuration.verify_ssl = False
+            shared_client = ApiClient(shared_configuration)
+
+            def shared():
+                MessagingApi(shared_client).reply_message(request(), _request_timeout=REPLY_TIMEOUT)
+
+            urllib3.disable_warnings()
+
+            print(f"server: {host} (tls={tls}, latency={args.latency_ms}ms), iterations: {args.iterations}")
+            print(f"{'variant':<10} {'p50_ms':>8} {'p99_ms':>8} {'mean_ms':>8}")
+            for name, reply in (("per_call", per_call), ("shared", shared)):
+                r = measure(reply, args.iterations)
+                print(f"{name:<10} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['mean_ms']:>8.2f}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+2層キャッシュの共通部品
+
+- TTLCache: ウォームコンテナ内のLRU（件数上限＋TTL）
+- DynamoDBCacheTier: コンテナ間で共有するDynamoDBの層（パーティションキー cache_key、TTL属性 ttl）
+- LocalCacheTier: 共有層のプロセス内代替（テスト・ローカル実行用）
+- TwoTierCache: ローカル層→共有層の順に参照し、共有層のヒットはローカル層に載せる
+"""
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import log
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュの値と格納時刻"""
+    value: Any
+    stored_at: float
+    expires_at: float
+
+
+class TTLCache:
+    """件数上限とTTLを持つスレッドセーフなLRUキャッシュ"""
+
+    def __init__(
+        self,
+        capacity: int = 512,
+        ttl_seconds: float = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        """期限内のエントリを返す（ヒット・ミスを記録）"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.get_entry(key)
+        return entry.value if entry else None
+
+    def put(
+        self,
+        key: str,
+        value: Any,
+        ttl_seconds: Optional[float] = None,
+        stored_at: Optional[float] = None,
+    ) -> None:
+        now = self.clock()
+        stored_at = now if stored_at is None else stored_at
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = CacheEntry(value, stored_at, stored_at + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> int:
+        """キーが prefix で始まるエントリを削除し、削除件数を返す"""
+        with self._lock:
+            keys = [k for k in self._entries if k.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+
+class SharedCacheTier(ABC):
+    """コンテナ間で共有するキャッシュ層のインターフェース"""
+
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[Any, float]]:
+        """期限内のキー → (値, 格納時刻) を返す"""
+
+    @abstractmethod
+    def put(self, key: str, value: Any, ttl_seconds: float, stored_at: float) -> None:
+        """値を格納する（ttl_seconds 後に期限切れ）"""
+
+
+class LocalCacheTier(SharedCacheTier):
+    """共有層のプロセス内代替"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._items: Dict[str, Tuple[str, float, float]] = {}
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[Any, float]]:
+        now = self.clock()
+        found = {}
+        with self._lock:
+            self.reads += 1
+            for key in keys:
+                item = self._items.get(key)
+                if item and item[2] > now:
+                    # DynamoDB層と同じくJSONで保存し、呼び出し側との値の共有を避ける
+                    found[key] = (json.loads(item[0]), item[1])
+        return found
+
+    def put(self, key: str, value: Any, ttl_seconds: float, stored_at: float) -> None:
+        with self._lock:
+            self.writes += 1
+            self._items[key] = (
+                json.dumps(value, ensure_ascii=False),
+                stored_at,
+                stored_at + ttl_seconds,
+            )
+
+
+class DynamoDBCacheTier(SharedCacheTier):
+    """DynamoDBの共有キャッシュ層
+
+    値はJSON文字列で保存する（数値のDecimal変換を避けるため）。
+    DynamoDBのTTL削除は遅延するため、読み込み時にも期限を確認する
+    """
+
+    BATCH_GET_LIMIT = 100
+
+    def __init__(self, dynamodb: Any, table_name: str, clock: Callable[[], float] = time.time):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self._table: Any = None
+        self.clock = clock
+
+    @property
+    def table(self) -> Any:
+        """DynamoDBのTableは初回利用時に生成する"""
+        if self._table is None:
+            self._table = self.dynamodb.Table(self.table_name)
+        return self._table
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[Any, float]]:
+        keys = list(dict.fromkeys(keys))
+        now = self.clock()
+        found = {}
+        for i in range(0, len(keys), self.BATCH_GET_LIMIT):
+            response = self.dynamodb.batch_get_item(RequestItems={
+                self.table_name: {"Keys": [{"cache_key": k} for k in keys[i:i + self.BATCH_GET_LIMIT]]}
+            })
+            for item in response.get("Responses", {}).get(self.table_name, []):
+                if int(item.get("ttl", 0)) > now:
+                    found[item["cache_key"]] = (json.loads(item["value"]), float(item["stored_at"]))
+        return found
+
+    def put(self, key: str, value: Any, ttl_seconds: float, stored_at: float) -> None:
+        self.table.put_item(Item={
+            "cache_key": key,
+            "value": json.dumps(value, ensure_ascii=False),
+            # DynamoDBの数値はDecimalになるため文字列で保存する
+            "stored_at": repr(stored_at),
+            "ttl": int(stored_at + ttl_seconds),
+        })
+
+
+class TwoTierCache:
+    """ローカル層（LRU）と任意の共有層からなるキャッシュ
+
+    共有層の読み書きに失敗してもキャッシュミスとして扱い、呼び出し側の処理は継続させる
+    """
+
+    def __init__(
+        self,
+        local: TTLCache,
+        shared: Optional[SharedCacheTier] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self.local = local
+        self.shared = shared
+        self.ttl_seconds = local.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+
+    def get_entry(self, key: str, extra_keys: Iterable[str] = ()) -> Tuple[Optional[CacheEntry], Dict[str, Tuple[Any, float]]]:
+        """エントリを返す
+
+        共有層を参照した場合は extra_keys も同じリクエストでまとめて読み込み、2つ目の戻り値で返す
+        """
+        entries, extra = self.get_entries([key], extra_keys)
+        return entries.get(key), extra
+
+    def get_entries(
+        self, keys: Iterable[str], extra_keys: Iterable[str] = ()
+    ) -> Tuple[Dict[str, CacheEntry], Dict[str, Tuple[Any, float]]]:
+        """複数のキーのエントリを返す（ローカル層にないキーは extra_keys と合わせて共有層から1回で読み込む）"""
+        entries: Dict[str, CacheEntry] = {}
+        missing = []
+        for key in keys:
+            entry = self.local.get_entry(key)
+            if entry is not None:
+                entries[key] = entry
+            else:
+                missing.append(key)
+        if not missing or self.shared is None:
+            return entries, {}
+        try:
+            found = self.shared.get_many([*missing, *extra_keys])
+        except Exception as e:
+            log.warning("Shared cache read error", error=str(e))
+            self.shared_errors += 1
+            return entries, {}
+        for key in missing:
+            if key not in found:
+                self.shared_misses += 1
+                continue
+            self.shared_hits += 1
+            value, stored_at = found.pop(key)
+            self.local.put(key, value, stored_at=stored_at, ttl_seconds=self.ttl_seconds)
+            entries[key] = CacheEntry(value, stored_at, stored_at + self.ttl_seconds)
+        return entries, found
+
+    def get(self, key: str) -> Optional[Any]:
+        entry, _ = self.get_entry(key)
+        return entry.value if entry else None
+
+    def put(self, key: str, value: Any) -> None:
+        stored_at = self.local.clock()
+        self.local.put(key, value, stored_at=stored_at, ttl_seconds=self.ttl_seconds)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, value, self.ttl_seconds, stored_at)
+            except Exception as e:
+                log.warning("Shared cache write error", error=str(e))
+                self.shared_errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        if self.shared is not None:
+            stats.update({
+                "shared_hits": self.shared_hits,
+                "shared_misses": self.shared_misses,
+                "shared_errors": self.shared_errors,
+            })
+        return stats
+
+
+def build_shared_tier(dynamodb: Any, table_name: str) -> Optional[SharedCacheTier]:
+    """設定に応じた共有層を返す（"local" ならプロセス内代替、空なら共有層なし）"""
+    if not table_name:
+        return None
+    if table_name == "local":
+        return LocalCacheTier()
+    return DynamoDBCacheTier(dynamodb, table_name)
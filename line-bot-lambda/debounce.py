@@ -0,0 +1,271 @@
+"""
+同じチャットに短時間で続けて送られたテキストメッセージのまとめ処理
+
+1. 同じWebhook（またはワーカーの同じバッチ）内のまとめ（coalesce_text_bursts）
+   同じセッションキーのテキストイベントが window_ms 以内の間隔で続いていれば、最初のイベントを代表にして
+   本文を改行でつなぎ、残りのイベントを処理済みの印（type: text_burst_member）に置き換える。
+   応答には最新の replyToken を使う。待ち時間は増えない。代表を最初に置くため、代表の処理が失敗すると
+   ワーカーは同じメッセージグループの後続（まとめたメッセージ）もまとめて再試行させる。
+   SQS FIFOのワーカーは同じチャットのメッセージを順番に受け取るため、処理中に届いたメッセージは
+   次のバッチにまとめて入り、ここでまとめられる
+
+2. Lambdaの呼び出しをまたいだまとめ（Debouncer、syncモードのみ）
+   受信したメッセージをセッションテーブルの保留リストに追加してから window 秒待ち、その間に新しいメッセージが
+   届いていなければ保留中のメッセージをまとめて取り出して応答する（届いていれば後のメッセージの呼び出しに任せる）。
+   処理の順序は、セッションテーブルへの条件付き書き込みによるロックで保つ（前のまとまりの応答・記録が
+   終わるまで次のまとまりを処理しない）。待ったあとは応答トークンが失効していることがあるため、呼び出し側は
+   返信に失敗したらプッシュメッセージで送る
+
+保留リストとロックは、セッションの行とは別の行（user_id: "debounce|<セッションキー>"）に保存する。
+別のWebhookで届いた同じ imageSet の画像も、セッションキーの代わりに imageSet ごとのキーを使ってまとめる
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+import log
+
+
+TEXT_BURST_MEMBER_TYPE = "text_burst_member"
+# 1回にまとめるメッセージの上限（プロンプトが長くなりすぎないようにする）
+MAX_MESSAGES_PER_TURN = 10
+
+
+def coalesce_text_bursts(
+    events: List[Dict[str, Any]],
+    session_key_of: Callable[[Dict[str, Any]], str],
+    window_ms: int,
+    max_messages: int = MAX_MESSAGES_PER_TURN,
+) -> List[Dict[str, Any]]:
+    """同じセッションで window_ms 以内の間隔で続いたテキストイベントを、最初のイベントにまとめる
+
+    イベントの件数と並びは変えない。同じセッションのテキスト以外のイベントを挟む場合はまとめない。
+    代表イベントの replyToken はまとめた中で最新のものに置き換え、まとめた件数を coalescedCount に入れる
+    """
+    if window_ms <= 0:
+        return events
+    runs: List[List[int]] = []
+    current: Dict[str, List[int]] = {}
+    for index, event in enumerate(events):
+        if event.get("type") != "message" or "source" not in event:
+            continue
+        key = session_key_of(event)
+        run = current.get(key)
+        if event["message"].get("type") != "text" or "timestamp" not in event:
+            current.pop(key, None)
+            continue
+        if (
+            run is not None
+            and len(run) < max_messages
+            and event["timestamp"] - events[run[-1]]["timestamp"] <= window_ms
+        ):
+            run.append(index)
+        else:
+            run = [index]
+            runs.append(run)
+            current[key] = run
+
+    coalesced = list(events)
+    for run in runs:
+        if len(run) < 2:
+            continue
+        leader = run[0]
+        coalesced[leader] = {
+            **events[leader],
+            "replyToken": events[run[-1]].get("replyToken", events[leader].get("replyToken")),
+            "message": {
+                **events[leader]["message"],
+                "text": "\n".join(events[i]["message"]["text"] for i in run),
+            },
+            "coalescedCount": len(run),
+        }
+        for i in run[1:]:
+            coalesced[i] = {**events[i], "type": TEXT_BURST_MEMBER_TYPE}
+    return coalesced
+
+
+@dataclass
+class Turn:
+    """まとめて応答するメッセージ"""
+    text: str
+    reply_token: str
+    count: int
+    # 待ち始めてからの経過時間（応答トークンの失効の目安）
+    waited_ms: float
+
+
+class Debouncer:
+    """セッションテーブルを使った、Lambdaの呼び出しをまたぐメッセージのまとめ"""
+
+    KEY_PREFIX = "debounce"
+
+    def __init__(
+        self,
+        dynamodb: Any,
+        table_name: str,
+        window_seconds: float,
+        lock_seconds: int = 30,
+        lock_wait_seconds: float = 10,
+        poll_seconds: float = 0.2,
+        retention_seconds: int = 3600,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self._table: Any = None
+        self.window_seconds = window_seconds
+        self.lock_seconds = lock_seconds
+        self.lock_wait_seconds = lock_wait_seconds
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.turns = 0
+        self.merged_into_later = 0
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+
+    @property
+    def table(self) -> Any:
+        """DynamoDBのTableは初回利用時に生成する"""
+        if self._table is None:
+            self._table = self.dynamodb.Table(self.table_name)
+        return self._table
+
+    @contextmanager
+    def turn(self, session_key: str, text: str, reply_token: str) -> Iterator[Optional[Turn]]:
+        """メッセージを保留リストに追加して待ち、このメッセージが最新なら保留分をまとめて返す
+
+        後から届いたメッセージがあれば None を返す（そのメッセージの呼び出しがまとめて応答する）。
+        ブロックを抜けるまでロックを保持し、次のまとまりの処理を待たせる
+        """
+        started = time.perf_counter()
+        key = f"{self.KEY_PREFIX}|{session_key}"
+        try:
+            seq = self._append(key, text, reply_token)
+        except Exception as e:
+            # テーブルが使えなければ、まとめずにこのメッセージだけ応答する
+            log.warning("Debounce append error", error=str(e))
+            yield Turn(text=text, reply_token=reply_token, count=1, waited_ms=0.0)
+            return
+        self.sleep(self.window_seconds)
+
+        owner = str(uuid.uuid4())
+        locked = self._acquire(key, owner)
+        try:
+            messages = self._take(key, seq)
+            if not messages:
+                self._count("merged_into_later")
+                yield None
+                return
+            self._count("turns")
+            yield Turn(
+                text="\n".join(m["text"] for m in messages),
+                reply_token=reply_token,
+                count=len(messages),
+                waited_ms=(time.perf_counter() - started) * 1000,
+            )
+        finally:
+            if locked:
+                self._release(key, owner)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "appended": self.appended,
+                "turns": self.turns,
+                "merged_into_later": self.merged_into_later,
+                "lock_waits": self.lock_waits,
+                "lock_timeouts": self.lock_timeouts,
+            }
+
+    def _append(self, key: str, text: str, reply_token: str) -> int:
+        """保留リストに追加し、追加後の通し番号を返す"""
+        response = self.table.update_item(
+            Key={"user_id": key},
+            UpdateExpression=(
+                "SET pending = list_append(if_not_exists(pending, :empty), :message), #ttl = :ttl "
+                "ADD seq :one"
+            ),
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={
+                ":empty": [],
+                ":message": [{"text": text, "reply_token": reply_token}],
+                ":ttl": int(self.clock()) + self.retention_seconds,
+                ":one": 1,
+            },
+            ReturnValues="UPDATED_NEW",
+        )
+        self._count("appended")
+        return int(response["Attributes"]["seq"])
+
+    def _acquire(self, key: str, owner: str) -> bool:
+        """ロックを取得する（取得できないまま lock_wait_seconds を過ぎたらロックなしで続ける）"""
+        deadline = time.monotonic() + self.lock_wait_seconds
+        waited = False
+        while True:
+            now = int(self.clock())
+            try:
+                self.table.update_item(
+                    Key={"user_id": key},
+                    UpdateExpression="SET lock_owner = :owner, lock_expires = :expires",
+                    ConditionExpression="attribute_not_exists(lock_owner) OR lock_expires <= :now",
+                    ExpressionAttributeValues={
+                        ":owner": owner, ":expires": now + self.lock_seconds, ":now": now,
+                    },
+                )
+                return True
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    log.warning("Debounce lock error", error=str(e))
+                    return False
+            if not waited:
+                waited = True
+                self._count("lock_waits")
+            if time.monotonic() >= deadline:
+                # 取り出しは条件付きなので二重には応答しない。順序よりも応答を優先する
+                log.warning("Debounce lock wait timed out")
+                self._count("lock_timeouts")
+                return False
+            self.sleep(self.poll_seconds)
+
+    def _take(self, key: str, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """通し番号が変わっていなければ保留リストを取り出す（変わっていれば None）"""
+        try:
+            response = self.table.update_item(
+                Key={"user_id": key},
+                UpdateExpression="REMOVE pending",
+                ConditionExpression="seq = :seq",
+                ExpressionAttributeValues={":seq": seq},
+                ReturnValues="ALL_OLD",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return None
+        return response.get("Attributes", {}).get("pending", [])
+
+    def _release(self, key: str, owner: str) -> None:
+        try:
+            self.table.update_item(
+                Key={"user_id": key},
+                UpdateExpression="REMOVE lock_owner, lock_expires",
+                ConditionExpression="lock_owner = :owner",
+                ExpressionAttributeValues={":owner": owner},
+            )
+        except ClientError as e:
+            # 期限切れで他の呼び出しに取られていれば何もしない
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                log.warning("Debounce lock release error", error=str(e))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
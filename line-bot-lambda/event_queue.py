@@ -0,0 +1,159 @@
+"""
+Webhookイベントのキュー
+
+受信（署名検証＋キュー投入）と処理（エージェント呼び出し＋返信）を分離するためのキュー実装
+- SqsEventQueue: SQS FIFOキュー（セッションキーをメッセージグループにして順序を保証）
+- LambdaAsyncEventQueue: ワーカーLambdaの非同期呼び出し
+- LocalEventQueue: オフラインテスト用のプロセス内キュー
+"""
+import hashlib
+import json
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+import log
+
+
+SessionKeyFunc = Callable[[Dict[str, Any]], Optional[str]]
+
+
+def _group_id(event: Dict[str, Any], session_key_of: SessionKeyFunc) -> str:
+    try:
+        return session_key_of(event) or "default"
+    except (KeyError, TypeError):
+        return "default"
+
+
+def _dedup_id(event: Dict[str, Any]) -> str:
+    """LINEのwebhookEventIdがあればそれを、なければイベント内容のハッシュを重複排除IDにする"""
+    event_id = event.get("webhookEventId")
+    if event_id:
+        return event_id
+    return hashlib.sha256(json.dumps(event, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class EventQueue(ABC):
+    """イベントキューの共通インターフェース"""
+
+    @abstractmethod
+    def send(self, events: List[Dict[str, Any]], session_key_of: SessionKeyFunc) -> int:
+        """イベントをキューに投入し、投入した件数を返す"""
+
+
+class SqsEventQueue(EventQueue):
+    """SQS FIFOキュー
+
+    1イベント1メッセージで、セッションキーをMessageGroupIdにする。
+    同じセッションのイベントは順番に、別セッションのイベントは並列にワーカーへ届く
+    """
+
+    # SendMessageBatchの上限
+    BATCH_SIZE = 10
+
+    def __init__(self, queue_url: str, sqs_client: Any):
+        self.queue_url = queue_url
+        self.sqs_client = sqs_client
+
+    def send(self, events: List[Dict[str, Any]], session_key_of: SessionKeyFunc) -> int:
+        entries = [
+            {
+                "Id": str(i),
+                "MessageBody": json.dumps({"event": event}, ensure_ascii=False),
+                "MessageGroupId": _group_id(event, session_key_of),
+                "MessageDeduplicationId": _dedup_id(event),
+            }
+            for i, event in enumerate(events)
+        ]
+        for i in range(0, len(entries), self.BATCH_SIZE):
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=entries[i:i + self.BATCH_SIZE],
+            )
+            failed = response.get("Failed", [])
+            if failed:
+                raise RuntimeError(f"Failed to enqueue {len(failed)} events: {failed}")
+        return len(entries)
+
+
+class LambdaAsyncEventQueue(EventQueue):
+    """ワーカーLambdaを非同期（InvocationType=Event）で呼び出す"""
+
+    def __init__(self, function_name: str, lambda_client: Any):
+        self.function_name = function_name
+        self.lambda_client = lambda_client
+
+    def send(self, events: List[Dict[str, Any]], session_key_of: SessionKeyFunc) -> int:
+        if not events:
+            return 0
+        self.lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"events": events}, ensure_ascii=False).encode("utf-8"),
+        )
+        return len(events)
+
+
+class LocalEventQueue(EventQueue):
+    """プロセス内キュー（オフラインテスト・ローカル実行用）
+
+    send()でワーカーLambdaの非同期呼び出しと同じペイロードを積み、
+    drain()または start()で起動したスレッドがワーカーに渡す
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def send(self, events: List[Dict[str, Any]], session_key_of: SessionKeyFunc) -> int:
+        if not events:
+            return 0
+        self._queue.put({"events": list(events)})
+        return len(events)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def drain(self, worker: Callable[[Dict[str, Any], Any], Any]) -> int:
+        """積まれているペイロードをすべてワーカーに渡し、処理したペイロード数を返す"""
+        count = 0
+        while True:
+            try:
+                payload = self._queue.get_nowait()
+            except queue.Empty:
+                return count
+            if payload is not None:
+                worker(payload, None)
+                count += 1
+            self._queue.task_done()
+
+    def start(self, worker: Callable[[Dict[str, Any], Any], Any]) -> None:
+        """バックグラウンドスレッドでワーカーを起動"""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                payload = self._queue.get()
+                try:
+                    if payload is None:
+                        return
+                    worker(payload, None)
+                except Exception as e:
+                    log.exception("Local worker error", e)
+                finally:
+                    self._queue.task_done()
+
+        self._thread = threading.Thread(target=loop, name="local-worker", daemon=True)
+        self._thread.start()
+
+    def join(self) -> None:
+        """投入済みのペイロードがすべて処理されるまで待つ"""
+        self._queue.join()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,145 @@
+"""
+Webhookイベントの重複排除（webhookEventId単位の冪等性）
+
+LINEは応答が遅い・エラーのWebhookを再送し（deliveryContext.isRedelivery）、SQSも失敗したメッセージを再配信する。
+重複したイベントでエージェント・vision・記憶の書き込みを繰り返さないよう、処理前に webhookEventId を確保する。
+
+- ウォームコンテナ内のTTLキャッシュで、同じコンテナに届いた重複はDynamoDBを読まずに捨てる
+- DynamoDB（パーティションキー event_id、TTL属性 ttl）への条件付き書き込み1回で、コンテナ間でも確保する
+- 確保は処理中のリース（lease_seconds）として書き、処理が終わったら保持期間（ttl_seconds）に延ばす。
+  処理が失敗したら確保を解除し、再送で処理し直せるようにする（タイムアウトで解除できなかった場合はリースの期限で解放）
+- DynamoDBが使えない場合は確保できたものとして処理を続ける（重複排除より応答を優先）
+"""
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from botocore.exceptions import ClientError
+
+import log
+from cache import TTLCache
+
+
+class IdempotencyStore:
+    """webhookEventIdの確保と、重複で省略できた処理の集計"""
+
+    def __init__(
+        self,
+        dynamodb: Any,
+        table_name: str,
+        local: TTLCache,
+        ttl_seconds: int = 86400,
+        lease_seconds: int = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self._table: Any = None
+        self.local = local
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.duplicates = 0
+        self.local_duplicates = 0
+        self.redeliveries = 0
+        self.releases = 0
+        self.errors = 0
+        # 重複を捨てたことで省略できた外部呼び出しの件数
+        self.avoided: Dict[str, int] = {}
+
+    @property
+    def table(self) -> Any:
+        """DynamoDBのTableは初回利用時に生成する"""
+        if self._table is None:
+            self._table = self.dynamodb.Table(self.table_name)
+        return self._table
+
+    def claim(self, event_id: str) -> bool:
+        """イベントの処理権を確保する（既に確保・処理済みならFalse）"""
+        with self._lock:
+            if self.local.get(event_id) is not None:
+                self.local_duplicates += 1
+                self.duplicates += 1
+                return False
+            # 同じコンテナ内で同時に届いた重複は、DynamoDBへの書き込みより先にここで止める
+            self.local.put(event_id, "processing", ttl_seconds=self.lease_seconds)
+        if self.table_name:
+            now = int(self.clock())
+            try:
+                self.table.put_item(
+                    Item={"event_id": event_id, "status": "processing", "ttl": now + self.lease_seconds},
+                    # 期限切れ（リースの失効・TTL削除の遅延）の行は取り直せる
+                    ConditionExpression="attribute_not_exists(event_id) OR #ttl <= :now",
+                    ExpressionAttributeNames={"#ttl": "ttl"},
+                    ExpressionAttributeValues={":now": now},
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    self._record_error("claim", e)
+                else:
+                    # 他のコンテナが処理中・処理済みのイベントは、このコンテナでも以後は読まずに捨てる
+                    self.local.put(event_id, "seen")
+                    self._count("duplicates")
+                    return False
+            except Exception as e:
+                self._record_error("claim", e)
+        self._count("claims")
+        return True
+
+    def complete(self, event_id: str) -> None:
+        """処理済みとして保持期間を延ばす"""
+        self.local.put(event_id, "done")
+        if not self.table_name:
+            return
+        try:
+            self.table.update_item(
+                Key={"event_id": event_id},
+                UpdateExpression="SET #status = :done, #ttl = :ttl",
+                ExpressionAttributeNames={"#status": "status", "#ttl": "ttl"},
+                ExpressionAttributeValues={":done": "done", ":ttl": int(self.clock()) + self.ttl_seconds},
+            )
+        except Exception as e:
+            # リースが切れると再送を処理し直すことになるが、応答済みの処理は失敗させない
+            self._record_error("complete", e)
+
+    def release(self, event_id: str) -> None:
+        """処理の失敗時に確保を解除し、再送で処理し直せるようにする"""
+        self.local.delete(event_id)
+        self._count("releases")
+        if not self.table_name:
+            return
+        try:
+            self.table.delete_item(Key={"event_id": event_id})
+        except Exception as e:
+            self._record_error("release", e)
+
+    def record_redelivery(self) -> None:
+        self._count("redeliveries")
+
+    def record_avoided(self, costs: Dict[str, int]) -> None:
+        """重複を捨てたことで省略できた外部呼び出しを加算"""
+        with self._lock:
+            for name, count in costs.items():
+                self.avoided[name] = self.avoided.get(name, 0) + count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "claims": self.claims,
+                "duplicates": self.duplicates,
+                "local_duplicates": self.local_duplicates,
+                "redeliveries": self.redeliveries,
+                "releases": self.releases,
+                "errors": self.errors,
+                "avoided": dict(self.avoided),
+            }
+
+    def _record_error(self, operation: str, error: Exception) -> None:
+        log.warning("Idempotency store error", operation=operation, error=str(error))
+        self._count("errors")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
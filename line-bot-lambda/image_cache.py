@@ -0,0 +1,45 @@
+"""
+画像分析結果のキャッシュ
+
+ダウンロードした画像のSHA-256をキーに、Claude visionの分析結果をキャッシュする。
+同じお知らせやスクリーンショットが複数のチャットに転送された場合、前処理とvisionの呼び出しを省略できる。
+モデル・プロンプト・前処理の設定が変わった場合に古い結果を返さないよう、設定の指紋もキーに含める
+"""
+import hashlib
+from typing import Any, Dict, Optional
+
+from cache import TwoTierCache
+
+
+def fingerprint(*settings: Any) -> str:
+    """分析結果に影響する設定の指紋"""
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:12]
+
+
+class ImageAnalysisCache:
+    """画像分析結果のキャッシュ"""
+
+    KEY_PREFIX = "img"
+
+    def __init__(self, cache: TwoTierCache, settings_fingerprint: str = ""):
+        self.cache = cache
+        self.settings_fingerprint = settings_fingerprint
+
+    def key(self, *images: bytes) -> str:
+        """画像のバイト列からキーを作る（元画像を手放せるよう、以降はキーだけを持ち回す）
+
+        複数枚をまとめて分析する場合は、各画像のハッシュを順に連ねたもののハッシュをキーにする
+        """
+        digests = [hashlib.sha256(data).digest() for data in images]
+        digest = digests[0] if len(digests) == 1 else hashlib.sha256(b"".join(digests)).digest()
+        return f"{self.KEY_PREFIX}|{self.settings_fingerprint}|{digest.hex()}"
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの分析結果を返す。なければNone"""
+        return self.cache.get(key)
+
+    def put(self, key: str, analysis: str) -> None:
+        self.cache.put(key, analysis)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
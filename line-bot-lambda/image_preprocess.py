@@ -0,0 +1,169 @@
+"""
+画像分析（Claude vision）前の画像前処理
+
+- 先頭バイトから実際のメディアタイプを判定
+- モデルに合わせて長辺を縮小（JPEGはデコード時点で縮小し、メモリと時間を抑える）
+- 品質を調整して再エンコードし、EXIFなどのメタデータを取り除く
+- 入力サイズと出力サイズに上限を設ける
+
+Pillowがない環境では、メディアタイプの判定とサイズ上限の確認だけを行う
+"""
+import base64
+import io
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+# Claude visionが縮小せずに扱える長辺の目安
+DEFAULT_MAX_LONG_EDGE = 1568
+DEFAULT_JPEG_QUALITY = 85
+# base64にした後でAPIの上限（5MB）に収まるサイズ
+DEFAULT_MAX_OUTPUT_BYTES = 3_750_000
+# これより大きい入力はデコードせずに拒否する
+DEFAULT_MAX_INPUT_BYTES = 20_000_000
+# デコードする画素数の上限（展開爆弾対策）
+MAX_IMAGE_PIXELS = 50_000_000
+
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+
+class ImageTooLargeError(ValueError):
+    """入力画像がサイズ上限を超えている"""
+
+
+@dataclass
+class PreparedImage:
+    """前処理済みの画像"""
+    data: bytes
+    media_type: str
+    original_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    reencoded: bool = False
+
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """先頭バイト（マジックナンバー）からメディアタイプを判定"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _load_pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    return Image, ImageOps
+
+
+def preprocess_image(
+    data: bytes,
+    max_long_edge: int = DEFAULT_MAX_LONG_EDGE,
+    quality: int = DEFAULT_JPEG_QUALITY,
+    max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+    max_input_bytes: int = DEFAULT_MAX_INPUT_BYTES,
+) -> PreparedImage:
+    """画像を縮小・再エンコードしてモデルに渡せる形にする"""
+    if len(data) > max_input_bytes:
+        raise ImageTooLargeError(f"Image is too large: {len(data)} bytes")
+
+    media_type = sniff_media_type(data)
+    pillow = _load_pillow()
+    if pillow is None:
+        if media_type is None:
+            raise ValueError("Unsupported image format")
+        if len(data) > max_output_bytes:
+            raise ImageTooLargeError(f"Image is too large without Pillow: {len(data)} bytes")
+        return PreparedImage(data=data, media_type=media_type, original_bytes=len(data))
+
+    Image, ImageOps = pillow
+    with Image.open(io.BytesIO(data)) as image:
+        if media_type is None:
+            media_type = Image.MIME.get(image.format or "")
+        scale = max_long_edge / max(image.size)
+        if image.format == "JPEG" and scale < 1:
+            # JPEGはDCTの段階で1/2〜1/8に縮小してデコードする（縮小後のサイズを下回らない範囲で）
+            image.draft("RGB", (int(image.width * scale) + 1, int(image.height * scale) + 1))
+        # 縮小してから向きを画素へ反映する（メタデータを捨てても向きが保たれる）
+        image.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        image = ImageOps.exif_transpose(image)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if has_alpha:
+            # 透過のある画像（スクリーンショット・図など）はPNGのまま保つ
+            output, out_type = _encode(image.convert("RGBA"), "PNG", quality), "image/png"
+        else:
+            rgb = image.convert("RGB")
+            output, out_type = _encode(rgb, "JPEG", quality), "image/jpeg"
+            # 上限を超える場合は品質を下げて再エンコード
+            while len(output) > max_output_bytes and quality > 40:
+                quality -= 15
+                output = _encode(rgb, "JPEG", quality)
+        width, height = image.size
+
+    if len(output) > max_output_bytes:
+        raise ImageTooLargeError(f"Encoded image is still too large: {len(output)} bytes")
+    return PreparedImage(
+        data=output,
+        media_type=out_type,
+        original_bytes=len(data),
+        width=width,
+        height=height,
+        reencoded=True,
+    )
+
+
+def _encode(image: Any, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        # exifを渡さないため、メタデータは書き出されない（progressiveはエンコードが数倍遅くなるため使わない）
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def build_vision_body(
+    images: List[PreparedImage],
+    prompt: str,
+    system: str = "",
+    max_tokens: int = 1024,
+) -> bytes:
+    """invoke_model用のリクエストボディをバイト列で組み立てる
+
+    base64文字列をPythonのstrに変換したりJSONエスケープしたりせず、
+    プレースホルダーの位置にbase64のバイト列を直接つなぐことで、大きなコピーを減らす
+    """
+    content: List[Dict[str, Any]] = [
+        {
+            "type": "image",
+            "source": {"type": "base64", "media_type": image.media_type, "data": f"\x00IMAGE{i}\x00"},
+        }
+        for i, image in enumerate(images)
+    ]
+    content.append({"type": "text", "text": prompt})
+    body: Dict[str, Any] = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": content}],
+    }
+    if system:
+        body["system"] = system
+
+    template = json.dumps(body).encode("utf-8")
+    parts = []
+    for i, image in enumerate(images):
+        placeholder = json.dumps(f"\x00IMAGE{i}\x00").encode("utf-8")
+        head, template = template.split(placeholder, 1)
+        parts.extend((head, b'"', base64.b64encode(image.data), b'"'))
+    parts.append(template)
+    return b"".join(parts)
@@ -0,0 +1,66 @@
+"""
+複数枚同時に送信された画像（imageSet）のまとめ処理
+
+LINEは同時に送信された画像を、同じ imageSet.id を持つ別々の image イベントとして配信する。
+同じWebhook（またはワーカーの同じバッチ）に含まれる画像イベントをまとめ、
+最初のイベントを代表（type: image_set）に、残りを処理済みの印（type: image_set_member）に置き換える。
+イベントの件数と並びは変えないため、イベントごとの処理結果（部分バッチ失敗の判定）とも対応が保たれる
+"""
+from typing import Any, Dict, List, Tuple
+
+
+IMAGE_SET_TYPE = "image_set"
+IMAGE_SET_MEMBER_TYPE = "image_set_member"
+# 1回のvisionリクエストに含める画像の上限（Claudeの1リクエストあたりの上限）
+MAX_IMAGES_PER_REQUEST = 20
+
+
+def _image_set_of(event: Dict[str, Any]) -> Tuple[str, str]:
+    """画像イベントの (セッションのソース, imageSet.id) を返す。まとめ対象でなければ空"""
+    if event.get("type") != "message":
+        return "", ""
+    message = event.get("message", {})
+    if message.get("type") != "image":
+        return "", ""
+    image_set = message.get("imageSet") or {}
+    source = event.get("source", {})
+    owner = source.get("groupId") or source.get("roomId") or source.get("userId") or ""
+    return owner, image_set.get("id", "")
+
+
+def coalesce_image_sets(
+    events: List[Dict[str, Any]],
+    max_images: int = MAX_IMAGES_PER_REQUEST,
+) -> List[Dict[str, Any]]:
+    """同じ imageSet の画像イベントを1つの image_set イベントにまとめる
+
+    代表イベントの message.imageIds に、imageSet.index の順でメッセージIDを並べる。
+    応答には代表イベントの replyToken を使う。max_images を超える分は別のまとまりにする
+    """
+    sets: Dict[Tuple[str, str], List[int]] = {}
+    for index, event in enumerate(events):
+        owner, set_id = _image_set_of(event)
+        if set_id:
+            sets.setdefault((owner, set_id), []).append(index)
+
+    coalesced = list(events)
+    for indices in sets.values():
+        ordered = sorted(indices, key=lambda i: events[i]["message"]["imageSet"].get("index", 0))
+        for start in range(0, len(ordered), max_images):
+            members = ordered[start:start + max_images]
+            if len(members) < 2:
+                continue
+            # 受信順で最初のイベントを代表にし、残りはその後で処理済みとして扱う
+            leader = min(members)
+            coalesced[leader] = {
+                **events[leader],
+                "message": {
+                    **events[leader]["message"],
+                    "type": IMAGE_SET_TYPE,
+                    "imageIds": [events[i]["message"]["id"] for i in members],
+                },
+            }
+            for i in members:
+                if i != leader:
+                    coalesced[i] = {**events[i], "type": IMAGE_SET_MEMBER_TYPE}
+    return coalesced
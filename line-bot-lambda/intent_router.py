@@ -0,0 +1,115 @@
+"""
+メッセージのルーティング（エージェントを呼ぶ前の高速経路）
+
+ルートの定義はコードではなくデータ（routes.json）で持ち、上から順に最初に一致したルートを使う。
+スタンプ・ヘルプ・セッションのリセットのような単純な意図はLambdaの中で直接応答し、
+エージェントを呼ぶルートでも、短期記憶・長期記憶の取得が必要かをルートごとに決める。
+
+ルートの項目
+- name: ルート名（集計・ログに使う）
+- message_types: 対象のメッセージの種類（省略時は patterns があれば ["text"]、なければすべて）
+- patterns: 正規化した本文に対する正規表現（いずれかに一致すれば対象、省略時は本文を問わない）
+- action: reply（reply の文面で返信）/ reset_session（セッションを作り直して返信）/
+          agent（エージェントで応答）/ ignore（何もしない）
+- short_term_memory, long_term_memory: agent のときに取得するか（省略時は true）
+
+ルートごとの件数と処理時間を集計する
+"""
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple
+
+from response_cache import normalize_message
+
+
+ACTIONS = ("reply", "reset_session", "agent", "ignore")
+
+
+@dataclass
+class Route:
+    """ルート1件"""
+    name: str
+    action: str
+    message_types: Optional[Tuple[str, ...]] = None
+    patterns: List[Pattern[str]] = field(default_factory=list)
+    reply: str = ""
+    short_term_memory: bool = True
+    long_term_memory: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Route":
+        action = data.get("action", "agent")
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action {action!r} in route {data.get('name')!r}")
+        if action in ("reply", "reset_session") and not data.get("reply"):
+            raise ValueError(f"Route {data.get('name')!r} needs a reply text")
+        patterns = [re.compile(p) for p in data.get("patterns", [])]
+        message_types = data.get("message_types")
+        if message_types is None and patterns:
+            message_types = ["text"]
+        return cls(
+            name=data["name"],
+            action=action,
+            message_types=tuple(message_types) if message_types is not None else None,
+            patterns=patterns,
+            reply=data.get("reply", ""),
+            short_term_memory=data.get("short_term_memory", True),
+            long_term_memory=data.get("long_term_memory", True),
+        )
+
+    def matches(self, message_type: str, normalized_text: str) -> bool:
+        if self.message_types is not None and message_type not in self.message_types:
+            return False
+        return not self.patterns or any(p.search(normalized_text) for p in self.patterns)
+
+
+# どのルートにも一致しない場合（テキストはエージェント、それ以外は何もしない）
+DEFAULT_ROUTES = (
+    Route(name="text", action="agent", message_types=("text",)),
+    Route(name="unsupported", action="ignore"),
+)
+
+
+class IntentRouter:
+    """ルートの選択と、ルートごとの件数・処理時間の集計"""
+
+    def __init__(self, routes: Sequence[Route]):
+        self.routes = list(routes) + list(DEFAULT_ROUTES)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._total_ms: Dict[str, float] = {}
+        self._max_ms: Dict[str, float] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "IntentRouter":
+        """ルート定義のJSONファイル（{"routes": [...]}）から作る"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([Route.from_dict(r) for r in data.get("routes", [])])
+
+    def route(self, message_type: str, text: str = "") -> Route:
+        """最初に一致したルートを返す"""
+        normalized = normalize_message(text) if text else ""
+        for route in self.routes:
+            if route.matches(message_type, normalized):
+                return route
+        return DEFAULT_ROUTES[-1]
+
+    def record(self, name: str, duration_ms: float) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._total_ms[name] = self._total_ms.get(name, 0.0) + duration_ms
+            self._max_ms[name] = max(self._max_ms.get(name, 0.0), duration_ms)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "count": count,
+                    "avg_ms": round(self._total_ms[name] / count, 1),
+                    "max_ms": round(self._max_ms[name], 1),
+                }
+                for name, count in self._counts.items()
+            }
@@ -2,25 +2,41 @@
 LINE Bot Lambda Function for AgentCore Runtime
 
 LINEからのWebhookを受信し、AgentCore Runtimeのエージェントと会話する
+
+コールドスタートを短くするため、LINE SDKとAWSクライアントは初回利用時に読み込む・生成する
 """
+import functools
 import json
 import os
-import hashlib
-import hmac
-import base64
-from typing import Any, Dict
-import boto3
-from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    MessagingApiBlob,
-    ReplyMessageRequest,
-    TextMessage,
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import aws_clients
+import log
+import metrics
+import turn_buffer
+from agent_stream import consume_agent_stream
+from cache import TTLCache, TwoTierCache, build_shared_tier
+from debounce import Debouncer, coalesce_text_bursts
+from event_queue import EventQueue, LambdaAsyncEventQueue, LocalEventQueue, SqsEventQueue
+from idempotency import IdempotencyStore
+from image_cache import ImageAnalysisCache, fingerprint
+from image_preprocess import build_vision_body, preprocess_image
+from image_set import IMAGE_SET_TYPE, coalesce_image_sets
+from intent_router import IntentRouter, Route
+from line_client import CONTENT_TIMEOUT, REPLY_TIMEOUT, build_api_client
+from memory_cache import LongTermMemoryCache
+from memory_search import fan_out, merge_records
+from memory_writer import ConversationTurn, MemoryWriter
+from pipeline import Stage, StagePipeline, get_executor
+from prompt_builder import assemble_prompt
+from response_cache import ResponseCache
+from session_manager import SessionManager
+from webhook_batch import BatchReport, process_events
+from webhook_ingest import (
+    WEBHOOK_MAX_BODY_BYTES, BodyTooLarge, InvalidBody, SignatureVerifier, parse_json, read_body,
 )
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
 
 
 # 環境変数
@@ -28,36 +44,221 @@ LINE_CHANNEL_ACCESS_TOKEN = os.environ["LINE_CHANNEL_ACCESS_TOKEN"]
 LINE_CHANNEL_SECRET = os.environ["LINE_CHANNEL_SECRET"]
 AGENT_RUNTIME_ARN = os.environ["AGENT_RUNTIME_ARN"]
 SESSION_TABLE_NAME = os.environ.get("SESSION_TABLE_NAME", "LineAgentSessions")
-AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "us-west-2")
 MEMORY_ID = os.environ.get("MEMORY_ID", "")
 LINE_SYSTEM_PROMPT = os.environ.get("LINE_SYSTEM_PROMPT", "")
+# Webhook単位のバッチ処理（セッション一括取得＋セッション間の並列処理）
+WEBHOOK_BATCH_MODE = os.environ.get("WEBHOOK_BATCH_MODE", "true").lower() == "true"
+# 長期記憶の検索（名前空間ごとの件数・全体の締め切り・統合後の件数）
+LTM_TOP_K = int(os.environ.get("LTM_TOP_K", "3"))
+LTM_DEADLINE_MS = int(os.environ.get("LTM_DEADLINE_MS", "1500"))
+LTM_TOP_N = int(os.environ.get("LTM_TOP_N", "5"))
+# 長期記憶の検索結果キャッシュ（CACHE_TABLE_NAMEを設定するとDynamoDBの共有層も使う、"local"はプロセス内代替）
+LTM_CACHE_ENABLED = os.environ.get("LTM_CACHE_ENABLED", "true").lower() == "true"
+LTM_CACHE_SIZE = int(os.environ.get("LTM_CACHE_SIZE", "512"))
+LTM_CACHE_TTL_SECONDS = int(os.environ.get("LTM_CACHE_TTL_SECONDS", "300"))
+CACHE_TABLE_NAME = os.environ.get("CACHE_TABLE_NAME", "")
+# 画像分析前の前処理（長辺の上限・JPEG品質・入力サイズの上限）
+IMAGE_MAX_LONG_EDGE = int(os.environ.get("IMAGE_MAX_LONG_EDGE", "1568"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MAX_INPUT_BYTES = int(os.environ.get("IMAGE_MAX_INPUT_BYTES", "20000000"))
+# 画像分析結果のキャッシュ（画像のSHA-256がキー、共有層はCACHE_TABLE_NAME）
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "256"))
+IMAGE_CACHE_TTL_SECONDS = int(os.environ.get("IMAGE_CACHE_TTL_SECONDS", "86400"))
+VISION_MODEL_ID = "us.anthropic.claude-sonnet-4-6"
+VISION_PROMPT = "この画像について日本語で説明してください。"
+VISION_PROMPT_MULTI = "これらの画像について、まとめて日本語で説明してください。"
+# エージェントの応答を取得できなかった場合の返信
+AGENT_NO_RESPONSE = "応答を取得できませんでした"
+AGENT_ERROR_PREFIX = "エラーが発生しました: "
+# 挨拶・お礼など履歴に依存しないメッセージへの応答のキャッシュ（システムプロンプトを変えたら版も変える）
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "21600"))
+SYSTEM_PROMPT_VERSION = os.environ.get("SYSTEM_PROMPT_VERSION", "")
+# エージェントに渡すプロンプトのトークン予算（ユーザーのメッセージ→会話履歴→長期記憶の順に割り当て）
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "4000"))
+# メッセージのルーティング（単純な意図はエージェントを呼ばずに応答する。ルートの定義はJSONファイル）
+ROUTER_ENABLED = os.environ.get("ROUTER_ENABLED", "true").lower() == "true"
+ROUTES_PATH = os.environ.get(
+    "ROUTES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes.json")
+)
+# エージェントにストリーミング応答を要求する
+AGENT_STREAMING = os.environ.get("AGENT_STREAMING", "true").lower() == "true"
+# sync: 受信したLambdaで処理してから200を返す / async: キューに積んで即座に200を返す
+PROCESSING_MODE = os.environ.get("PROCESSING_MODE", "sync").lower()
+EVENT_QUEUE_URL = os.environ.get("EVENT_QUEUE_URL", "")
+WORKER_FUNCTION_NAME = os.environ.get("WORKER_FUNCTION_NAME", "")
+# 非同期呼び出しのワーカーで失敗したイベントを送り直す上限（最初の処理を含む回数）
+WORKER_MAX_ATTEMPTS = int(os.environ.get("WORKER_MAX_ATTEMPTS", "3"))
+# 再送されたWebhookイベント（同じwebhookEventId）の重複排除（テーブル未設定ならコンテナ内のみ）
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TABLE_NAME = os.environ.get("IDEMPOTENCY_TABLE_NAME", "")
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "300"))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "4096"))
+# 同じチャットに続けて送られたテキストのまとめ（同じWebhook・バッチ内で、この間隔以内に続いたものを1回で応答）
+MESSAGE_COALESCE_WINDOW_MS = int(os.environ.get("MESSAGE_COALESCE_WINDOW_MS", "3000"))
+# syncモードで、この時間だけ後続のメッセージを待ってからまとめて応答する（0で無効）
+DEBOUNCE_WINDOW_MS = int(os.environ.get("DEBOUNCE_WINDOW_MS", "0"))
+DEBOUNCE_LOCK_SECONDS = int(os.environ.get("DEBOUNCE_LOCK_SECONDS", "30"))
+DEBOUNCE_LOCK_WAIT_SECONDS = float(os.environ.get("DEBOUNCE_LOCK_WAIT_SECONDS", "10"))
+# 返信後の会話保存（再試行の回数、Lambdaのタイムアウトまでこの秒数を切ったら書き込まずにキューへ退避）
+MEMORY_WRITE_MAX_ATTEMPTS = int(os.environ.get("MEMORY_WRITE_MAX_ATTEMPTS", "4"))
+MEMORY_WRITE_SPILL_MARGIN_SECONDS = float(os.environ.get("MEMORY_WRITE_SPILL_MARGIN_SECONDS", "2"))
+# 直近の会話をセッション行に圧縮して持ち、短期記憶の取得でlist_eventsを呼ばない（往復数、ローカルの写しを使う秒数）
+SHORT_TERM_BUFFER_ENABLED = os.environ.get("SHORT_TERM_BUFFER_ENABLED", "true").lower() == "true"
+SHORT_TERM_BUFFER_TURNS = int(os.environ.get("SHORT_TERM_BUFFER_TURNS", "10"))
+SHORT_TERM_BUFFER_MAX_AGE_SECONDS = float(os.environ.get("SHORT_TERM_BUFFER_MAX_AGE_SECONDS", "1"))
+# 初期化中にAWSの各エンドポイントへ接続しておく（最初のリクエストでTLSの確立を待たない）
+PREWARM_CONNECTIONS = os.environ.get("PREWARM_CONNECTIONS", "false").lower() == "true"
 
 # LINE Bot SDK設定
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+# linebot.v3.messaging の読み込みは重いため、返信・画像ダウンロードを行う関数の中で読み込む
+# コネクションプールを持つApiClientはコンテナ内で1つだけ生成し、keep-alive接続を使い回す
+_line_api_client: Any = None
+_line_lock = threading.Lock()
+
+# AWSクライアント（プロセス全体で共有、サービスごとにタイムアウト・リトライ・コネクションプールを設定）
+# 生成は初回利用時（PREWARM_CONNECTIONSが有効なら初期化中）に行う
+bedrock_client = aws_clients.lazy_client("bedrock-agentcore")
+dynamodb = aws_clients.lazy_resource("dynamodb")
+
+# 長期記憶の検索結果キャッシュ（ローカルLRU＋任意の共有層）
+ltm_cache = LongTermMemoryCache(
+    TwoTierCache(
+        TTLCache(capacity=LTM_CACHE_SIZE, ttl_seconds=LTM_CACHE_TTL_SECONDS),
+        build_shared_tier(dynamodb, CACHE_TABLE_NAME),
+    )
+)
+
+# 画像分析結果のキャッシュ（結果に影響する設定が変わると別のキーになる）
+image_cache = ImageAnalysisCache(
+    TwoTierCache(
+        TTLCache(capacity=IMAGE_CACHE_SIZE, ttl_seconds=IMAGE_CACHE_TTL_SECONDS),
+        build_shared_tier(dynamodb, CACHE_TABLE_NAME),
+    ),
+    fingerprint(
+        VISION_MODEL_ID, VISION_PROMPT, VISION_PROMPT_MULTI, LINE_SYSTEM_PROMPT,
+        IMAGE_MAX_LONG_EDGE, IMAGE_JPEG_QUALITY,
+    ),
+)
+
+# 履歴に依存しないメッセージへの応答のキャッシュ（コンテナ内のTTL付きLRU）
+response_cache = ResponseCache(
+    TTLCache(capacity=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS),
+    fingerprint(AGENT_RUNTIME_ARN, LINE_SYSTEM_PROMPT, SYSTEM_PROMPT_VERSION, PROMPT_TOKEN_BUDGET),
+)
+
+
+def load_router() -> IntentRouter:
+    """ルート定義を読み込む（読めなければ既定のルートだけで動かす）"""
+    if ROUTER_ENABLED:
+        try:
+            return IntentRouter.from_file(ROUTES_PATH)
+        except Exception as e:
+            log.warning("Failed to load routes", path=ROUTES_PATH, error=str(e))
+    return IntentRouter([])
+
+
+intent_router = load_router()
+
+# webhookEventIdの確保（コンテナ内のTTLキャッシュ＋DynamoDBの条件付き書き込み）
+idempotency_store = IdempotencyStore(
+    dynamodb,
+    IDEMPOTENCY_TABLE_NAME,
+    TTLCache(capacity=IDEMPOTENCY_CACHE_SIZE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS),
+    ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+    lease_seconds=IDEMPOTENCY_LEASE_SECONDS,
+)
+
+# 呼び出しをまたぐメッセージのまとめ（保留リストとロックはセッションテーブルの別の行に置く）
+debouncer = Debouncer(
+    dynamodb,
+    SESSION_TABLE_NAME,
+    DEBOUNCE_WINDOW_MS / 1000,
+    lock_seconds=DEBOUNCE_LOCK_SECONDS,
+    lock_wait_seconds=DEBOUNCE_LOCK_WAIT_SECONDS,
+)
+
+# 返信後にまとめて行う会話の保存（書き込みと退避の関数はモジュールの後半で定義）
+memory_writer = MemoryWriter(
+    lambda *args: write_conversation_turns(*args),
+    lambda turns: spill_memory_writes(turns),
+    max_attempts=MEMORY_WRITE_MAX_ATTEMPTS,
+    spill_margin_seconds=MEMORY_WRITE_SPILL_MARGIN_SECONDS,
+)
+# キューに退避した会話の保存を表すイベントの種類（ワーカーが書き込み直す）
+MEMORY_WRITE_TYPE = "memory_write"
+
+# 署名検証（チャネルシークレットから作ったHMACの鍵を使い回す）
+signature_verifier = SignatureVerifier(LINE_CHANNEL_SECRET)
+
+# 非同期処理用のイベントキュー（初回利用時に生成）
+_event_queue: Optional[EventQueue] = None
+
+# セッション管理（ウォームコンテナ内のLRUキャッシュを含む）
+session_manager = SessionManager(
+    dynamodb,
+    SESSION_TABLE_NAME,
+    capacity=int(os.environ.get("SESSION_CACHE_SIZE", "1024")),
+    ttl_seconds=int(os.environ.get("SESSION_TTL_SECONDS", "86400")),
+    refresh_after_seconds=int(os.environ.get("SESSION_TTL_REFRESH_SECONDS", "3600")),
+)
 
-# AWSクライアント
-bedrock_client = boto3.client("bedrock-agentcore", region_name=AWS_REGION)
-dynamodb = boto3.resource("dynamodb", region_name=AWS_REGION)
-session_table = dynamodb.Table(SESSION_TABLE_NAME)
+
+def get_line_api_client() -> Any:
+    """コンテナ内で共有するLINE APIのクライアントを返す（初回のみ生成）"""
+    global _line_api_client
+    if _line_api_client is None:
+        with _line_lock:
+            if _line_api_client is None:
+                _line_api_client = build_api_client(LINE_CHANNEL_ACCESS_TOKEN)
+    return _line_api_client
 
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Lambda関数のエントリーポイント"""
-    
-    print(f"Received event: {json.dumps(event)}")
-    
-    # Lambda Function URLからのリクエスト処理
+    with (
+        log.request_context(getattr(context, "aws_request_id", None), handler="webhook"),
+        metrics.invocation(),
+    ):
+        return _handle_webhook(event, invocation_deadline(context))
+
+
+def invocation_deadline(context: Any) -> Optional[float]:
+    """Lambdaのタイムアウト時刻（time.monotonic() 基準、コンテキストがなければ None）"""
+    remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining() / 1000
+
+
+def _handle_webhook(event: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Lambda Function URLからのリクエスト処理"""
     try:
-        # 署名検証
         signature = event["headers"].get("x-line-signature", "")
-        body = event.get("body", "")
-        
-        print(f"Signature present: {bool(signature)}")
-        print(f"Body length: {len(body)}")
-        
+        # ボディはバイト列で1度だけデコードし、署名検証と解析に使い回す（上限超過は何もせず拒否）
+        try:
+            body = read_body(event)
+        except BodyTooLarge:
+            log.warning("Body too large", limit=WEBHOOK_MAX_BODY_BYTES)
+            return {
+                "statusCode": 413,
+                "body": json.dumps({"error": "Payload too large"})
+            }
+        except InvalidBody as e:
+            log.warning("Invalid body", error=str(e))
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "Invalid body"})
+            }
+
+        # リクエスト全体（メッセージ本文を含む）は出力しない
+        log.info("Received webhook", signature_present=bool(signature), body_length=len(body))
+
         if not signature:
-            print("Missing signature")
+            log.warning("Missing signature")
             return {
                 "statusCode": 401,
                 "body": json.dumps({"error": "Missing signature"})
@@ -65,53 +266,212 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # 署名検証
         if not verify_signature(body, signature):
-            print("Invalid signature")
+            log.warning("Invalid signature")
             return {
                 "statusCode": 401,
                 "body": json.dumps({"error": "Invalid signature"})
             }
         
-        print("Signature verified successfully")
-        
+        log.debug("Signature verified successfully")
+
         # Webhookイベント処理
-        webhook_body = json.loads(body)
+        try:
+            webhook_body = parse_json(body)
+        except InvalidBody as e:
+            log.warning("Invalid body", error=str(e))
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "Invalid body"})
+            }
         events = webhook_body.get("events", [])
-        print(f"Processing {len(events)} events")
-        
-        for webhook_event in events:
-            print(f"Event type: {webhook_event.get('type')}")
-            handle_event(webhook_event)
-        
+
+        if PROCESSING_MODE == "async":
+            # 署名検証済みのイベントをワーカーに渡し、LINEには即座に応答する
+            queued = get_event_queue().send(events, get_session_key)
+            log.info("Enqueued events", queued=queued)
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Accepted", "queued": queued})
+            }
+
+        # 後続のメッセージを待てるのは、受信したLambdaで処理するsyncモードだけ
+        report = process_webhook_events(events, debounce=DEBOUNCE_WINDOW_MS > 0, deadline=deadline)
+        if report.errors:
+            # イベント単位の失敗は記録済み。500を返すとLINEが再送し、成功したイベントまで重複して届くため200を返す
+            log.warning("Some events failed", failed=report.failed)
+
         return {
             "statusCode": 200,
-            "body": json.dumps({"message": "OK"})
+            "body": json.dumps({"message": "OK", "processed": report.processed, "failed": report.failed})
         }
         
     except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        log.exception("Webhook processing failed", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
         }
 
 
-def verify_signature(body: str, signature: str) -> bool:
-    """LINE署名を検証"""
-    hash_value = hmac.new(
-        LINE_CHANNEL_SECRET.encode("utf-8"),
-        body.encode("utf-8"),
-        hashlib.sha256
-    ).digest()
-    expected_signature = base64.b64encode(hash_value).decode("utf-8")
-    return hmac.compare_digest(signature, expected_signature)
+def worker_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """非同期ワーカーのエントリーポイント
+
+    SQSイベントソース（Records）とLambda非同期呼び出し（events）の両方を受け付ける
+    """
+    with (
+        log.request_context(getattr(context, "aws_request_id", None), handler="worker"),
+        metrics.invocation(),
+    ):
+        return _handle_worker(event, invocation_deadline(context))
+
+
+def _handle_worker(event: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+    if "Records" in event:
+        records = event["Records"]
+        events = [json.loads(r["body"])["event"] for r in records]
+        report = process_webhook_events(events, deadline=deadline)
+
+        # 失敗したメッセージと、同じメッセージグループでそれより後のメッセージを再試行させる
+        failed_groups = set()
+        failures = []
+        for record, event_report in zip(records, report.events):
+            group_id = record.get("attributes", {}).get("MessageGroupId")
+            if not event_report.ok or (group_id and group_id in failed_groups):
+                failures.append({"itemIdentifier": record["messageId"]})
+                if group_id:
+                    failed_groups.add(group_id)
+        return {"batchItemFailures": failures}
+
+    events = event.get("events", [])
+    report = process_webhook_events(events, deadline=deadline)
+    if report.errors:
+        # ペイロード全体をLambdaに再試行させると、成功したイベントの返信や会話の保存もやり直すことになる
+        retry_failed_events(events, report)
+    return report.to_dict()
+
+
+def retry_failed_events(events: List[Dict[str, Any]], report: BatchReport) -> None:
+    """失敗したイベントと、同じセッションでそれより後のイベントだけをワーカーに送り直す
+
+    送り直した回数はイベントの workerAttempt に数え、WORKER_MAX_ATTEMPTS を超えるものはログに残して捨てる
+    """
+    failed_sessions = set()
+    retry = []
+    for original, event_report in zip(events, report.events):
+        if not event_report.ok or event_report.session_key in failed_sessions:
+            failed_sessions.add(event_report.session_key)
+            retry.append(original)
+    resend = [
+        {**e, "workerAttempt": e.get("workerAttempt", 1) + 1}
+        for e in retry
+        if e.get("workerAttempt", 1) < WORKER_MAX_ATTEMPTS
+    ]
+    if len(resend) < len(retry):
+        log.error("Dropped failed events", events=len(retry) - len(resend), attempts=WORKER_MAX_ATTEMPTS)
+    if resend:
+        get_event_queue().send(resend, get_session_key)
+        log.warning("Requeued failed events", events=len(resend))
+
+
+def process_webhook_events(
+    events: List[Dict[str, Any]],
+    debounce: bool = False,
+    deadline: Optional[float] = None,
+) -> BatchReport:
+    """Webhookイベント群を処理し、イベントごとの処理結果を返す
+
+    debounce が真なら、テキストメッセージは後続のメッセージを待ってからまとめて応答する。
+    会話の保存はすべての返信のあとにまとめて行う（deadline までに書き込めない分はキューへ退避）
+    """
+    log.info("Processing events", events=len(events), batch_mode=WEBHOOK_BATCH_MODE)
+    # 同時に送信された複数枚の画像は1回の分析・1回の応答にまとめる
+    events = coalesce_image_sets(events)
+    # 同じチャットに続けて送られたテキストは1回のエージェント呼び出し・1回の応答にまとめる
+    events = coalesce_text_bursts(events, get_session_key, MESSAGE_COALESCE_WINDOW_MS)
+
+    session_keys = [
+        get_session_key(e) for e in events if e.get("type") == "message" and "source" in e
+    ]
+    # 1件だけならget_itemと変わらないため、複数件のときだけ一括で先読みする
+    if WEBHOOK_BATCH_MODE and len(session_keys) > 1:
+        prefetch_sessions(session_keys)
+    report = process_events(
+        events,
+        functools.partial(handle_event_once, debounce=True) if debounce else handle_event_once,
+        get_session_key,
+        concurrent=WEBHOOK_BATCH_MODE,
+    )
+
+    log.info("Processed events", **report.to_dict())
+    flush_memory_writes(deadline)
+    caches = {"session": session_manager.stats()}
+    if LTM_CACHE_ENABLED:
+        caches["long_term_memory"] = ltm_cache.stats()
+    if IMAGE_CACHE_ENABLED:
+        caches["image_analysis"] = image_cache.stats()
+    if RESPONSE_CACHE_ENABLED:
+        caches["response"] = response_cache.stats()
+    log.info("Cache stats", **caches)
+    if IDEMPOTENCY_ENABLED:
+        log.info("Idempotency stats", **idempotency_store.stats())
+    if debounce:
+        log.info("Debounce stats", **debouncer.stats())
+    if MEMORY_ID:
+        log.info("Memory write stats", **memory_writer.stats())
+    log.info("Route stats", **intent_router.stats())
+    return report
+
+
+def get_event_queue() -> EventQueue:
+    """設定に応じたイベントキューを返す
+
+    EVENT_QUEUE_URL → SQS、WORKER_FUNCTION_NAME → Lambda非同期呼び出し、
+    どちらもなければバックグラウンドスレッドで処理するプロセス内キュー（ローカル実行用）
+    """
+    global _event_queue
+    if _event_queue is None:
+        if EVENT_QUEUE_URL:
+            _event_queue = SqsEventQueue(EVENT_QUEUE_URL, aws_clients.client("sqs"))
+        elif WORKER_FUNCTION_NAME:
+            _event_queue = LambdaAsyncEventQueue(WORKER_FUNCTION_NAME, aws_clients.client("lambda"))
+        else:
+            local_queue = LocalEventQueue()
+            local_queue.start(worker_handler)
+            _event_queue = local_queue
+    return _event_queue
+
+
+def prewarm_connections() -> Dict[str, bool]:
+    """この関数が処理で使うAWSエンドポイントへ接続しておく
+
+    asyncモードの受信Lambdaはキューだけ、それ以外（同期処理・ワーカー）はDynamoDBとAgentCoreに接続する
+    """
+    if PROCESSING_MODE == "async":
+        if EVENT_QUEUE_URL:
+            clients = [aws_clients.client("sqs")]
+        elif WORKER_FUNCTION_NAME:
+            clients = [aws_clients.client("lambda")]
+        else:
+            clients = []
+    else:
+        clients = [dynamodb.meta.client, bedrock_client]
+    result = aws_clients.prewarm(clients)
+    log.info("Connection prewarm", result=result)
+    return result
+
+
+def verify_signature(body: Union[bytes, str], signature: str) -> bool:
+    """LINE署名を検証（生のバイト列に対してHMACを計算）"""
+    return signature_verifier.verify(body, signature)
 
 
 def get_session_key(event: Dict[str, Any]) -> str:
     """会話のコンテキストに応じたセッションキーを返す"""
+    if event.get("type") == MEMORY_WRITE_TYPE:
+        # 退避した会話の保存はアクター（＝セッションキー）ごとに順番に処理する
+        return event["turns"][0]["actor_id"]
     source = event["source"]
-    source_type = source["type"]
+    source_type = source.get("type")
 
     if source_type == "group":
         return source["groupId"]
@@ -121,8 +481,59 @@ def get_session_key(event: Dict[str, Any]) -> str:
         return source["userId"]
 
 
-def handle_event(event: Dict[str, Any]) -> None:
-    """Webhookイベントを処理"""
+def handle_event_once(event: Dict[str, Any], debounce: bool = False) -> None:
+    """webhookEventIdを確保できたイベントだけ処理する（再送・再配信された重複は捨てる）"""
+    handle = functools.partial(handle_event, debounce=True) if debounce else handle_event
+    event_id = event.get("webhookEventId")
+    if not IDEMPOTENCY_ENABLED or not event_id or event.get("type") != "message":
+        handle(event)
+        return
+    if event.get("deliveryContext", {}).get("isRedelivery"):
+        idempotency_store.record_redelivery()
+    if not idempotency_store.claim(event_id):
+        idempotency_store.record_avoided(avoided_calls(event))
+        log.info("Duplicate event dropped", webhook_event_id=event_id)
+        return
+    try:
+        handle(event)
+    except Exception:
+        # 再送・再配信で処理し直せるように確保を解除する
+        idempotency_store.release(event_id)
+        raise
+    idempotency_store.complete(event_id)
+
+
+def avoided_calls(event: Dict[str, Any]) -> Dict[str, int]:
+    """イベントを処理した場合に行う外部呼び出し（重複を捨てて省略できた件数の集計用）"""
+    message_type = event.get("message", {}).get("type")
+    if message_type == "text":
+        calls = {"agent_invocations": 1, "memory_reads": 3}
+    elif message_type == "image":
+        calls = {"vision_calls": 1, "image_downloads": 1}
+    elif message_type == IMAGE_SET_TYPE:
+        calls = {"vision_calls": 1, "image_downloads": len(event["message"].get("imageIds", []))}
+    else:
+        return {}
+    calls.update({"memory_writes": 1 if MEMORY_ID else 0, "replies": 1})
+    return calls
+
+
+def handle_event(event: Dict[str, Any], debounce: bool = False) -> None:
+    """Webhookイベントを処理
+
+    debounce が真なら、テキストメッセージは DEBOUNCE_WINDOW_MS だけ後続のメッセージを待ってからまとめて応答する。
+    ログのコンテキストに加えたセッション・ルートなどの値は、このイベントの処理の間だけ有効
+    """
+    with log.scope():
+        _handle_event(event, debounce)
+
+
+def _handle_event(event: Dict[str, Any], debounce: bool = False) -> None:
+    if event["type"] == MEMORY_WRITE_TYPE:
+        # キューに退避された会話の保存（失敗したらキューの再試行に任せる）
+        turns = [ConversationTurn.from_dict(t) for t in event["turns"]]
+        write_conversation_turns(turns[0].actor_id, turns[0].session_id, turns)
+        return
 
     if event["type"] != "message":
         return
@@ -132,232 +543,524 @@ def handle_event(event: Dict[str, Any]) -> None:
     session_key = get_session_key(event)
     reply_token = event["replyToken"]
 
-    print(f"source_type={event['source']['type']}, session_key={session_key}, user_id={user_id}")
+    # ユーザー・グループIDはハッシュにしてコンテキストに残す
+    log.bind(
+        session_key=session_key,
+        source_type=event["source"]["type"],
+        user=log.hash_key(user_id),
+        message_type=message_type,
+    )
 
-    if message_type == "text":
-        user_message = event["message"]["text"]
-        print(f"Received text message: {user_message}")
+    # ステージごとの所要時間をイベント単位のEMFメトリクスとして出力する
+    with metrics.event_metrics(message_type, event["source"]["type"]):
+        if message_type in ("image", IMAGE_SET_TYPE):
+            collect_images(event, session_key, reply_token, debounce)
 
-        session_id = get_or_create_session(session_key)
+        else:
+            route_message(event, session_key, reply_token, debounce)
 
-        # 短期記憶（現セッションの会話履歴）を取得
-        short_term_context = get_short_term_memory(session_key, session_id)
 
-        # 長期記憶（過去セッションの知識）をセマンティック検索
-        long_term_context = get_long_term_memory(session_key, user_message)
+def collect_images(event: Dict[str, Any], session_key: str, reply_token: str, debounce: bool = False) -> None:
+    """画像（同じWebhookでまとめた imageSet を含む）に応答する
+
+    debounce が真なら、別のWebhookで届いた同じ imageSet の画像を DEBOUNCE_WINDOW_MS だけ待ってまとめ、
+    最後に届いた画像の呼び出しが1回だけ応答する
+    """
+    message = event["message"]
+    message_ids = message.get("imageIds") or [message["id"]]
+    set_id = (message.get("imageSet") or {}).get("id")
+    if not (debounce and DEBOUNCE_WINDOW_MS > 0 and set_id):
+        respond_to_images(session_key, message_ids, reply_token)
+        return
 
-        agent_response = invoke_agent(session_id, user_message, short_term_context, long_term_context)
+    # 保留リストにはこのイベントのメッセージIDを改行でつないで入れ、まとめた本文を分けて取り出す
+    with debouncer.turn(f"{IMAGE_SET_TYPE}|{session_key}|{set_id}", "\n".join(message_ids), reply_token) as turn:
+        if turn is None:
+            log.info("Image merged into a later turn")
+            return
+        respond_to_images(session_key, turn.text.split("\n"), turn.reply_token, push_fallback=True)
 
-        # 会話を短期記憶に記録
-        save_conversation(session_key, session_id, user_message, agent_response)
 
-        reply_message(reply_token, agent_response)
+def respond_to_images(
+    session_key: str,
+    message_ids: List[str],
+    reply_token: str,
+    push_fallback: bool = False,
+) -> None:
+    """画像を1回のvisionリクエストで分析して応答し、短期記憶に記録する"""
+    if len(message_ids) == 1:
+        log.info("Received image message", message_id=message_ids[0])
+        image_response = analyze_image(message_ids[0])
+        user_message = "[画像を送信]"
+    else:
+        log.info("Received image set", images=len(message_ids))
+        image_response = analyze_images(message_ids)
+        user_message = f"[画像を{len(message_ids)}枚送信]"
 
-    elif message_type == "image":
-        message_id = event["message"]["id"]
-        print(f"Received image message, message_id: {message_id}")
+    # 待っている間に応答トークンが失効していれば、プッシュメッセージで送る
+    if not reply_message(reply_token, image_response) and push_fallback:
+        push_message(session_key, image_response)
 
-        image_response = analyze_image(message_id)
-        session_id = get_or_create_session(session_key)
+    # 画像分析結果も短期記憶に記録
+    session_id = get_or_create_session(session_key)
+    save_conversation(session_key, session_id, user_message, image_response)
 
-        # 画像分析結果も短期記憶に記録
-        save_conversation(session_key, session_id, "[画像を送信]", image_response)
 
-        reply_message(reply_token, image_response)
+def route_message(event: Dict[str, Any], session_key: str, reply_token: str, debounce: bool = False) -> None:
+    """画像以外のメッセージをルートに従って処理し、ルートごとの件数と処理時間を記録する"""
+    message_type = event["message"]["type"]
+    user_message = event["message"].get("text", "") if message_type == "text" else ""
+    # まとめたメッセージは本文が定型の命令ではないため、ルートの判定はテキスト全般のルートに任せる
+    coalesced = event.get("coalescedCount", 1)
+    route = intent_router.route(message_type, user_message if coalesced == 1 else "")
+    log.bind(route=route.name)
+    started = time.perf_counter()
+    try:
+        if route.action == "agent" and message_type == "text":
+            log.info("Received text message", text=log.redact(user_message))
+            if debounce and DEBOUNCE_WINDOW_MS > 0:
+                # 待っている間に届いた同じチャットのメッセージとまとめ、最新のメッセージの呼び出しが1回だけ応答する
+                with debouncer.turn(session_key, user_message, reply_token) as turn:
+                    if turn is None:
+                        log.info("Message merged into a later turn")
+                        return
+                    # 後続とまとめた場合は定型の命令ではないため、記憶はすべて使う
+                    respond_to_text(
+                        session_key, turn.text, turn.reply_token, turn.count, push_fallback=True,
+                        route=route if turn.count == 1 else None,
+                    )
+            else:
+                respond_to_text(session_key, user_message, reply_token, coalesced, route=route)
 
-    else:
-        print(f"Unsupported message type: {message_type}")
+        elif route.action == "reply":
+            reply_message(reply_token, route.reply)
+
+        elif route.action == "reset_session":
+            try:
+                session_manager.reset(session_key)
+            except Exception as e:
+                # リセットできなかったことを伝え、完了の返信はしない
+                log.exception("Error resetting session", e)
+                reply_message(reply_token, f"{AGENT_ERROR_PREFIX}{str(e)}")
+            else:
+                reply_message(reply_token, route.reply)
+
+        else:
+            if route.action == "agent":
+                log.warning("Agent route for non-text message")
+            log.info("Unsupported message type")
+    finally:
+        intent_router.record(route.name, (time.perf_counter() - started) * 1000)
+
+
+def respond_to_text(
+    session_key: str,
+    user_message: str,
+    reply_token: str,
+    coalesced: int = 1,
+    push_fallback: bool = False,
+    route: Optional[Route] = None,
+) -> None:
+    """テキストメッセージ（続けて送られた複数のメッセージをまとめたものを含む）にエージェントで応答する
+
+    route で不要とされた短期記憶・長期記憶は取得しない
+    """
+    metrics.put("CoalescedMessages", coalesced, unit="Count")
+    if coalesced > 1:
+        log.info("Coalesced messages", messages=coalesced)
+
+    # 挨拶・お礼など履歴に依存しないメッセージは、キャッシュ済みの応答を返す（なければ履歴なしで生成してキャッシュ）
+    cache_key = response_cache.key(user_message) if RESPONSE_CACHE_ENABLED and coalesced == 1 else None
+    if cache_key is not None:
+        agent_response = response_cache.get(cache_key)
+        metrics.put("ResponseCacheHit", 0 if agent_response is None else 1, unit="Count")
+        if agent_response is None:
+            session_id = get_or_create_session(session_key)
+            agent_response = invoke_agent(session_id, user_message)
+            # エラー時の応答はキャッシュしない
+            if is_agent_answer(agent_response):
+                response_cache.put(cache_key, agent_response)
+        else:
+            log.info("Response cache hit")
+        if not reply_message(reply_token, agent_response) and push_fallback:
+            push_message(session_key, agent_response)
+        save_conversation(session_key, get_or_create_session(session_key), user_message, agent_response)
+        return
+
+    use_short_term = route is None or route.short_term_memory
+    use_long_term = route is None or route.long_term_memory
+
+    # セッション→短期記憶の経路と長期記憶の検索は独立しているため並列に実行する
+    stage_list = [Stage("session", lambda deps: get_or_create_session(session_key))]
+    if use_short_term:
+        # 短期記憶（現セッションの会話履歴）を取得
+        stage_list.append(Stage(
+            "short_term",
+            lambda deps: get_short_term_memory(session_key, deps["session"]),
+            depends_on=("session",),
+        ))
+    if use_long_term:
+        # 長期記憶（過去セッションの知識）をセマンティック検索
+        stage_list.append(Stage("long_term", lambda deps: get_long_term_memory(session_key, user_message)))
+    stages = StagePipeline(stage_list).run()
+    log.info("Pre-agent stages", stages=stages.summary())
+
+    session_id = stages["session"]
+    short_term_context = stages["short_term"] if use_short_term else ""
+    long_term_context = stages["long_term"] if use_long_term else ""
+
+    agent_response = invoke_agent(session_id, user_message, short_term_context, long_term_context)
+
+    # 待っている間に応答トークンが失効していれば、プッシュメッセージで送る
+    if not reply_message(reply_token, agent_response) and push_fallback:
+        push_message(session_key, agent_response)
+
+    # 会話を短期記憶に記録（返信後にまとめて書き込む）
+    save_conversation(session_key, session_id, user_message, agent_response)
 
 
 def analyze_image(message_id: str) -> str:
     """LINE画像をダウンロードしてClaude visionで分析"""
+    return analyze_images([message_id])
+
+
+@metrics.timed("ImageDownload")
+def download_image(message_id: str) -> bytes:
+    """LINE APIから画像をダウンロード"""
+    from linebot.v3.messaging import MessagingApiBlob
+
+    blob_api = MessagingApiBlob(get_line_api_client())
+    return blob_api.get_message_content(message_id=message_id, _request_timeout=CONTENT_TIMEOUT)
+
+
+@metrics.timed("ImageAnalysis")
+def analyze_images(message_ids: List[str]) -> str:
+    """LINE画像（1枚または同時に送信された複数枚）をダウンロードし、1回のClaude visionの呼び出しで分析"""
 
     try:
-        # LINE APIから画像をダウンロード
-        with ApiClient(configuration) as api_client:
-            blob_api = MessagingApiBlob(api_client)
-            image_content = blob_api.get_message_content(message_id=message_id)
+        # 複数枚は並列にダウンロードする（イベント処理のスレッドから投入するため、ステージ用のプールを使う）
+        if len(message_ids) == 1:
+            contents = [download_image(message_ids[0])]
+        else:
+            futures = [log.submit_with_context(get_executor(), download_image, m) for m in message_ids]
+            contents = [f.result() for f in futures]
 
-        image_base64 = base64.b64encode(image_content).decode("utf-8")
-        print(f"Downloaded image, size: {len(image_content)} bytes")
+        log.info("Downloaded images", images=len(contents), bytes=sum(len(c) for c in contents))
+
+        # 転送された同じ画像は前処理とvisionの呼び出しを省略する
+        cache_key = image_cache.key(*contents) if IMAGE_CACHE_ENABLED else None
+        if cache_key is not None:
+            cached = image_cache.get(cache_key)
+            metrics.put("ImageCacheHit", 0 if cached is None else 1, unit="Count")
+            if cached is not None:
+                log.info("Image analysis cache hit")
+                return cached
+
+        # 実際のメディアタイプを判定し、縮小・再エンコード（メタデータ除去）してから送る
+        prepared_images = []
+        while contents:
+            # 元画像は前処理したものから手放し、ボディ組み立て中のピークメモリを抑える
+            with metrics.timer("ImagePreprocess"):
+                prepared = preprocess_image(
+                    contents.pop(0),
+                    max_long_edge=IMAGE_MAX_LONG_EDGE,
+                    quality=IMAGE_JPEG_QUALITY,
+                    max_input_bytes=IMAGE_MAX_INPUT_BYTES,
+                )
+            log.debug(
+                "Prepared image",
+                media_type=prepared.media_type,
+                width=prepared.width,
+                height=prepared.height,
+                original_bytes=prepared.original_bytes,
+                bytes=len(prepared.data),
+            )
+            prepared_images.append(prepared)
 
         # Bedrock Claude visionで分析
-        bedrock_runtime = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1024,
-            "system": LINE_SYSTEM_PROMPT,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": "この画像について日本語で説明してください。",
-                        },
-                    ],
-                }
-            ],
-        }
+        bedrock_runtime = aws_clients.client("bedrock-runtime")
+        prompt = VISION_PROMPT if len(prepared_images) == 1 else VISION_PROMPT_MULTI
+        body = build_vision_body(prepared_images, prompt, system=LINE_SYSTEM_PROMPT)
+        del prepared_images
 
-        response = bedrock_runtime.invoke_model(
-            modelId="us.anthropic.claude-sonnet-4-6",
-            body=json.dumps(body),
-        )
-        result = json.loads(response["body"].read())
-        return result["content"][0]["text"]
+        with metrics.timer("Vision"):
+            response = bedrock_runtime.invoke_model(
+                modelId=VISION_MODEL_ID,
+                body=body,
+            )
+            result = json.loads(response["body"].read())
+        analysis = result["content"][0]["text"]
+        # エラー時の応答はキャッシュしない
+        if cache_key is not None:
+            image_cache.put(cache_key, analysis)
+        return analysis
 
     except Exception as e:
-        print(f"Error analyzing image: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        log.exception("Error analyzing image", e)
         return f"画像の分析中にエラーが発生しました: {str(e)}"
 
 
+@metrics.timed("ShortTermMemory")
 def get_short_term_memory(actor_id: str, session_id: str) -> str:
-    """短期記憶（Events）から現セッションの会話履歴を取得"""
+    """短期記憶から現セッションの会話履歴を取得
+
+    セッション行のリングバッファを優先し、ない（または別のセッションのもの）ときだけ
+    Events（list_events）から取得してバッファを作り直す
+    """
     if not MEMORY_ID:
         return ""
-    try:
-        resp = bedrock_client.list_events(
-            memoryId=MEMORY_ID,
-            actorId=actor_id,
-            sessionId=session_id,
-            maxResults=10,
-        )
-        lines = []
+    messages = get_recent_turns(actor_id, session_id) if SHORT_TERM_BUFFER_ENABLED else None
+    source = "buffer"
+    if messages is None and SHORT_TERM_BUFFER_ENABLED and get_or_create_session(actor_id) != session_id:
+        # 他のコンテナでリセットされた古いセッション。その会話履歴は使わない（次のメッセージから新しいセッション）
+        log.info("Session was replaced", session_id=session_id)
+        messages = []
+        source = "replaced"
+    if messages is None:
+        source = "events"
+        try:
+            resp = bedrock_client.list_events(
+                memoryId=MEMORY_ID,
+                actorId=actor_id,
+                sessionId=session_id,
+                maxResults=10,
+            )
+        except Exception as e:
+            log.warning("list_events error", error=str(e))
+            return ""
+        messages = []
         for ev in resp.get("events", []):
             for item in ev.get("payload", []):
                 conv = item.get("conversational", {})
                 role = conv.get("role", "USER")
                 text = conv.get("content", {}).get("text", "")
                 if text:
-                    lines.append(f"{role}: {text}")
-        print(f"Short-term memory: {len(lines)} turns retrieved")
-        return "\n".join(lines)
+                    messages.append((role, text))
+        if SHORT_TERM_BUFFER_ENABLED:
+            seed_recent_turns(actor_id, session_id, messages)
+    # 同じバッチで先に返信した、まだ書き込んでいない会話
+    for turn in memory_writer.pending_for(actor_id, session_id):
+        messages.append(("USER", turn.user_msg))
+        messages.append(("ASSISTANT", turn.assistant_msg))
+    log.info("Short-term memory retrieved", turns=len(messages), source=source)
+    return turn_buffer.format_history(messages)
+
+
+def get_recent_turns(actor_id: str, session_id: str) -> Optional[List[turn_buffer.Message]]:
+    """セッション行のリングバッファから直近の会話を取得（使えなければ None）"""
+    try:
+        return session_manager.recent_history(actor_id, session_id, SHORT_TERM_BUFFER_MAX_AGE_SECONDS)
     except Exception as e:
-        print(f"list_events error: {e}")
-        return ""
+        log.warning("Recent turns read error", error=str(e))
+        return None
 
 
+def seed_recent_turns(actor_id: str, session_id: str, messages: List[turn_buffer.Message]) -> None:
+    """list_eventsで取得した会話からリングバッファを作る（失敗しても次の読み込みでやり直す）"""
+    try:
+        session_manager.seed_history(actor_id, session_id, messages, SHORT_TERM_BUFFER_TURNS * 2)
+    except Exception as e:
+        log.warning("Recent turns seed error", error=str(e))
+
+
+def append_recent_turns(actor_id: str, session_id: str, turns: List[ConversationTurn]) -> None:
+    """保存した会話をリングバッファにも書き込む（失敗してもEventsへの保存は成功として扱う）"""
+    messages = []
+    for turn in turns:
+        messages.append(("USER", turn.user_msg))
+        messages.append(("ASSISTANT", turn.assistant_msg))
+    try:
+        session_manager.append_history(actor_id, session_id, messages, SHORT_TERM_BUFFER_TURNS * 2)
+    except Exception as e:
+        log.warning("Recent turns write error", error=str(e))
+
+
+@metrics.timed("LongTermMemory")
 def get_long_term_memory(actor_id: str, query: str) -> str:
-    """長期記憶から関連情報をセマンティック検索"""
+    """長期記憶から関連情報をセマンティック検索
+
+    名前空間ごとの検索を共通の締め切り内で並列に行い、スコア順に統合・重複除去して上位N件を返す
+    """
     if not MEMORY_ID:
         return ""
     namespaces = [
         f"/family/{actor_id}/facts/",
         f"/family/{actor_id}/preferences/",
     ]
-    results = []
-    for ns in namespaces:
-        try:
-            resp = bedrock_client.retrieve_memory_records(
-                memoryId=MEMORY_ID,
-                namespace=ns,
-                searchCriteria={"searchQuery": query, "topK": 3}
-            )
-            for r in resp.get("memoryRecordSummaries", []):
-                results.append(r["content"]["text"])
-        except Exception as e:
-            print(f"retrieve_memory_records error ({ns}): {e}")
-    return "\n".join(results)
+
+    # 同じ（または表記ゆれのみ異なる）質問はセマンティック検索を省略する
+    # 全名前空間のキャッシュを1回で引く（共有層への読み込みで並列検索の開始を遅らせない）
+    cached = ltm_cache.get_many(actor_id, namespaces, query) if LTM_CACHE_ENABLED else {}
+    record_lists = list(cached.values())
+    misses = [ns for ns in namespaces if ns not in cached]
+    if LTM_CACHE_ENABLED:
+        # すべての名前空間をキャッシュから返せた（セマンティック検索を省略できた）なら1
+        metrics.put("LongTermMemoryCacheHit", 0 if misses else 1, unit="Count")
+
+    def retrieve(ns: str) -> List[Dict[str, Any]]:
+        resp = bedrock_client.retrieve_memory_records(
+            memoryId=MEMORY_ID,
+            namespace=ns,
+            searchCriteria={"searchQuery": query, "topK": LTM_TOP_K}
+        )
+        records = [
+            {"text": r["content"]["text"], "score": r.get("score")}
+            for r in resp.get("memoryRecordSummaries", [])
+        ]
+        if LTM_CACHE_ENABLED:
+            ltm_cache.put(actor_id, ns, query, records)
+        return records
+
+    if misses:
+        record_lists.extend(fan_out(misses, retrieve, LTM_DEADLINE_MS / 1000).values())
+
+    return "\n".join(r["text"] for r in merge_records(record_lists, LTM_TOP_N))
 
 
 def save_conversation(actor_id: str, session_id: str, user_msg: str, assistant_msg: str) -> None:
-    """会話をAgentCore Memoryの短期記憶（Events）に記録"""
+    """会話を短期記憶（Events）への保存待ちに積む（書き込みは返信後の flush_memory_writes で行う）"""
     if not MEMORY_ID:
         return
+    memory_writer.add(ConversationTurn(actor_id, session_id, user_msg, assistant_msg, time.time()))
+
+
+def flush_memory_writes(deadline: Optional[float] = None) -> None:
+    """保存待ちの会話を書き込む（イベントとは別のEMFドキュメントで書き込みの状況を出力する）"""
+    if not memory_writer.pending():
+        return
+    with metrics.event_metrics(MEMORY_WRITE_TYPE, "post_reply"):
+        result = memory_writer.flush(deadline)
+        metrics.put("MemoryWriteTurns", result["written"], unit="Count")
+        metrics.put("MemoryWriteRetries", result["retries"], unit="Count")
+        metrics.put("MemoryWriteSpilled", result["spilled"], unit="Count")
+        metrics.put("MemoryWriteDropped", result["dropped"], unit="Count")
+    log.info("Flushed memory writes", **result)
+
+
+@metrics.timed("SaveConversation")
+def write_conversation_turns(actor_id: str, session_id: str, turns: List[ConversationTurn]) -> None:
+    """同じアクター・セッションの会話を1回の create_event で短期記憶に記録（失敗時は例外）"""
     from datetime import datetime, timezone
+    payload = []
+    for turn in turns:
+        payload.append({"conversational": {"content": {"text": turn.user_msg}, "role": "USER"}})
+        payload.append({"conversational": {"content": {"text": turn.assistant_msg}, "role": "ASSISTANT"}})
+    bedrock_client.create_event(
+        memoryId=MEMORY_ID,
+        actorId=actor_id,
+        sessionId=session_id,
+        eventTimestamp=datetime.fromtimestamp(turns[-1].timestamp, timezone.utc),
+        payload=payload,
+    )
+    log.info("Saved conversation event", session_id=session_id, turns=len(turns))
+    if SHORT_TERM_BUFFER_ENABLED:
+        append_recent_turns(actor_id, session_id, turns)
+    # 長期記憶はAgentCoreが会話から非同期に抽出するため、保存直後に検索結果キャッシュを捨てても
+    # 新しい事実は得られない（キャッシュはTTLで入れ替える）
+
+
+def spill_memory_writes(turns: List[ConversationTurn]) -> None:
+    """書き込みきれなかった会話を、アクター・セッションごとにイベントキューへ退避する
+
+    プロセス内キュー（LocalEventQueue）のスレッドは呼び出しの終了とともに止まるため退避先にしない。
+    SQS・ワーカーLambdaがなければ会話をログに残して例外にする（書き込み側で破棄として数える）
+    """
+    if not (EVENT_QUEUE_URL or WORKER_FUNCTION_NAME):
+        log.error("No durable queue for memory writes", turns=[
+            {
+                "actor": log.hash_key(t.actor_id),
+                "session_id": t.session_id,
+                "timestamp": t.timestamp,
+                "user_msg": log.redact(t.user_msg),
+                "assistant_msg": log.redact(t.assistant_msg),
+            }
+            for t in turns
+        ])
+        raise RuntimeError("No durable event queue for memory writes")
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for turn in turns:
+        groups.setdefault((turn.actor_id, turn.session_id), []).append(turn.to_dict())
+    events = [{"type": MEMORY_WRITE_TYPE, "turns": group} for group in groups.values()]
+    get_event_queue().send(events, get_session_key)
+
+
+def prefetch_sessions(session_keys: List[str]) -> None:
+    """Webhook内の全セッション行をBatchGetItemで一括取得"""
     try:
-        bedrock_client.create_event(
-            memoryId=MEMORY_ID,
-            actorId=actor_id,
-            sessionId=session_id,
-            eventTimestamp=datetime.now(timezone.utc),
-            payload=[
-                {"conversational": {"content": {"text": user_msg}, "role": "USER"}},
-                {"conversational": {"content": {"text": assistant_msg}, "role": "ASSISTANT"}},
-            ]
-        )
-        print(f"Saved conversation event for actor={actor_id}, session={session_id}")
+        session_manager.prefetch(session_keys)
     except Exception as e:
-        print(f"create_event error: {e}")
+        # 先読みに失敗しても個別のget_itemで処理を継続できる
+        log.warning("batch_get_item error", error=str(e))
 
 
+@metrics.timed("Session")
 def get_or_create_session(user_id: str) -> str:
-    """DynamoDBからセッションIDを取得、なければ新規作成"""
+    """セッションIDを取得、なければ新規作成（LRUキャッシュ・条件付き作成・TTL延長の間引き）"""
     
     try:
-        # 既存セッションを取得
-        response = session_table.get_item(Key={"user_id": user_id})
-        
-        if "Item" in response:
-            session_id = response["Item"]["session_id"]
-            print(f"Using existing session: {session_id}")
-            
-            # TTLを更新（24時間後）
-            import time
-            ttl = int(time.time()) + 86400  # 24時間
-            session_table.update_item(
-                Key={"user_id": user_id},
-                UpdateExpression="SET #ttl = :ttl",
-                ExpressionAttributeNames={"#ttl": "ttl"},
-                ExpressionAttributeValues={":ttl": ttl}
-            )
-            
-            return session_id
-        
-        # 新規セッション作成
-        import uuid
-        session_id = str(uuid.uuid4())
-        
-        import time
-        ttl = int(time.time()) + 86400  # 24時間
-        
-        session_table.put_item(
-            Item={
-                "user_id": user_id,
-                "session_id": session_id,
-                "ttl": ttl
-            }
-        )
-        
-        print(f"Created new session: {session_id}")
-        return session_id
+        return session_manager.get_or_create(user_id)
         
     except Exception as e:
-        print(f"Error managing session: {str(e)}")
+        log.exception("Error managing session", e)
         # エラー時は一時的なセッションIDを使用
         import uuid
         return str(uuid.uuid4())
 
 
-def invoke_agent(session_id: str, user_message: str, short_term_context: str = "", long_term_context: str = "") -> str:
-    """AgentCore Runtimeを呼び出し"""
+def is_agent_answer(text: str) -> bool:
+    """invoke_agent の戻り値がエージェントの応答か（エラー・応答なしの定型文でないか）"""
+    return text != AGENT_NO_RESPONSE and not text.startswith(AGENT_ERROR_PREFIX)
+
+
+@metrics.timed("Agent")
+def invoke_agent(
+    session_id: str,
+    user_message: str,
+    short_term_context: str = "",
+    long_term_context: str = "",
+) -> str:
+    """AgentCore Runtimeを呼び出し
+
+    ストリーミング応答の場合は逐次解析し、最初の文が完成するまでの時間を AgentFirstSegment として記録する。
+    LINEの応答トークンは1回しか使えないため、返信には応答全体を使う
+    """
 
     try:
-        sections = []
-        if long_term_context:
-            sections.append(f"[過去の長期記憶]\n{long_term_context}")
-        if short_term_context:
-            sections.append(f"[今セッションの会話履歴]\n{short_term_context}")
-        sections.append(f"[ユーザーのメッセージ]\n{user_message}")
-        prompt = "\n\n".join(sections)
-        payload = {"prompt": prompt}
-        
+        # 履歴が伸びてもプロンプトサイズが一定に収まるよう、トークン予算内で組み立てる
+        assembled = assemble_prompt(
+            user_message, short_term_context, long_term_context, PROMPT_TOKEN_BUDGET
+        )
+        log.info(
+            "Prompt tokens",
+            usage=assembled.usage,
+            total=assembled.total_tokens,
+            budget=PROMPT_TOKEN_BUDGET,
+            truncated=assembled.truncated,
+        )
+        payload = {"prompt": assembled.prompt}
+        if AGENT_STREAMING:
+            payload["stream"] = True
+
+        # 最初の文までの時間はAgentCoreの処理時間を含むよう、リクエストの送信から計る
+        started = time.perf_counter()
         response = bedrock_client.invoke_agent_runtime(
             agentRuntimeArn=AGENT_RUNTIME_ARN,
             payload=json.dumps(payload).encode("utf-8"),
             runtimeSessionId=session_id
         )
+
+        if response.get("contentType", "").startswith("text/event-stream"):
+            # ストリーミング応答を逐次解析
+            stream = consume_agent_stream(response["response"].iter_lines(), started=started)
+            if stream.first_segment_ms is not None:
+                metrics.put("AgentFirstSegment", stream.first_segment_ms)
+            log.info(
+                "Agent stream",
+                chunks=stream.chunks,
+                first_segment_ms=stream.first_segment_ms,
+                total_ms=round(stream.total_ms),
+            )
+            return stream.text or AGENT_NO_RESPONSE
         
         # レスポンスを解析
         result = json.loads(response["response"].read())
@@ -366,28 +1069,61 @@ def invoke_agent(session_id: str, user_message: str, short_term_context: str = "
         if "result" in result and "content" in result["result"]:
             content = result["result"]["content"]
             if isinstance(content, list) and len(content) > 0:
-                return content[0].get("text", "応答を取得できませんでした")
+                return content[0].get("text", AGENT_NO_RESPONSE)
         
-        return "応答を取得できませんでした"
+        return AGENT_NO_RESPONSE
         
     except Exception as e:
-        print(f"Error invoking agent: {str(e)}")
-        return f"エラーが発生しました: {str(e)}"
+        log.exception("Error invoking agent", e)
+        return f"{AGENT_ERROR_PREFIX}{str(e)}"
 
 
-def reply_message(reply_token: str, message_text: str) -> None:
-    """LINE Reply APIでメッセージを返信"""
+@metrics.timed("Reply")
+def reply_message(reply_token: str, message_text: str) -> bool:
+    """LINE Reply APIでメッセージを返信（返信できたらTrue）"""
     
     try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[TextMessage(text=message_text)]
-                )
-            )
-        print(f"Replied: {message_text}")
+        from linebot.v3.messaging import MessagingApi, ReplyMessageRequest, TextMessage
+
+        line_bot_api = MessagingApi(get_line_api_client())
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[TextMessage(text=message_text)]
+            ),
+            _request_timeout=REPLY_TIMEOUT,
+        )
+        log.info("Replied", text=log.redact(message_text))
+        return True
         
     except Exception as e:
-        print(f"Error replying message: {str(e)}")
+        log.exception("Error replying message", e)
+        return False
+
+
+@metrics.timed("Push")
+def push_message(to: str, message_text: str) -> bool:
+    """LINE Push APIでメッセージを送信（応答トークンが失効した場合の代替）"""
+
+    try:
+        from linebot.v3.messaging import MessagingApi, PushMessageRequest, TextMessage
+
+        line_bot_api = MessagingApi(get_line_api_client())
+        line_bot_api.push_message(
+            PushMessageRequest(
+                to=to,
+                messages=[TextMessage(text=message_text)]
+            ),
+            _request_timeout=REPLY_TIMEOUT,
+        )
+        log.info("Pushed", text=log.redact(message_text))
+        return True
+
+    except Exception as e:
+        log.exception("Error pushing message", e)
+        return False
+
+
+# Lambdaの初期化フェーズで接続を確立しておく
+if PREWARM_CONNECTIONS:
+    prewarm_connections()
@@ -0,0 +1,88 @@
+"""
+コンテナ内で共有するLINE Messaging APIのクライアント
+
+ApiClient（urllib3のコネクションプール）を1度だけ生成し、api.line.me・api-data.line.me への
+keep-alive接続をウォームコンテナ内の応答・画像ダウンロードで使い回す。
+
+- コネクションプールの大きさを明示（イベントを並列処理するスレッド数に合わせる）
+- TCP keepaliveを有効化し、アイドル中に切られた接続を早めに検出する
+- SDKの既定ではタイムアウトがないため、呼び出しごとに接続・読み込みのタイムアウトを渡す
+- 再試行は、リクエストが送られていない接続エラーと、冪等なGET（画像ダウンロード）に限る。
+  返信（POST）は応答トークンが1回限りのため、読み込み中の失敗やサーバーエラーでは再送しない
+
+LINE SDK（linebot.v3.messaging）は読み込みに1秒以上かかるため、import時ではなく生成時に読み込む
+"""
+import os
+import socket
+from typing import Any, Optional, Tuple
+
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+
+LINE_MAX_POOL_CONNECTIONS = int(os.environ.get("LINE_MAX_POOL_CONNECTIONS", "10"))
+LINE_CONNECT_TIMEOUT = float(os.environ.get("LINE_CONNECT_TIMEOUT", "3"))
+LINE_READ_TIMEOUT = float(os.environ.get("LINE_READ_TIMEOUT", "10"))
+# 画像などのコンテンツ取得は本文が大きいため、読み込みタイムアウトを長めにする
+LINE_CONTENT_READ_TIMEOUT = float(os.environ.get("LINE_CONTENT_READ_TIMEOUT", "30"))
+
+REPLY_TIMEOUT: Tuple[float, float] = (LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT)
+CONTENT_TIMEOUT: Tuple[float, float] = (LINE_CONNECT_TIMEOUT, LINE_CONTENT_READ_TIMEOUT)
+
+
+def build_retry() -> Retry:
+    """安全な場合だけ再試行するurllib3のRetry"""
+    return Retry(
+        total=3,
+        # 接続の確立に失敗した場合はリクエストが送られていないため、メソッドを問わず再試行する
+        connect=2,
+        # 読み込み中の失敗・ステータスによる再試行は allowed_methods（GET）に限られる
+        read=2,
+        status=2,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        status_forcelist=(429, 500, 502, 503, 504),
+        backoff_factor=0.2,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def keepalive_socket_options() -> list:
+    """TCP keepaliveを有効にしたソケットオプション"""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Linuxでは60秒のアイドル後から10秒間隔で確認する
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10))
+    return options
+
+
+def build_configuration(
+    access_token: str,
+    pool_maxsize: int = LINE_MAX_POOL_CONNECTIONS,
+    host: Optional[str] = None,
+) -> Any:
+    """コネクションプール・再試行・ソケットオプションを設定したLINE SDKの設定"""
+    from linebot.v3.messaging import Configuration
+
+    configuration = Configuration(access_token=access_token, host=host)
+    configuration.connection_pool_maxsize = pool_maxsize
+    configuration.retries = build_retry()
+    configuration.socket_options = keepalive_socket_options()
+    return configuration
+
+
+def build_api_client(
+    access_token: str,
+    pool_maxsize: int = LINE_MAX_POOL_CONNECTIONS,
+    host: Optional[str] = None,
+) -> Any:
+    """コンテナ内で使い回すApiClientを生成
+
+    MessagingApi・MessagingApiBlob は状態を持たない薄いラッパーのため、呼び出しごとに
+    このApiClientから生成してよい（コネクションプールは共有される）
+    """
+    from linebot.v3.messaging import ApiClient
+
+    return ApiClient(build_configuration(access_token, pool_maxsize, host))
@@ -0,0 +1,181 @@
+"""
+構造化ログ（1行1JSON）
+
+- レベル（LOG_LEVEL、デフォルト: INFO）
+- リクエスト単位のコンテキスト（Lambdaのリクエストid、セッションキーのハッシュ）
+- 長い値の切り詰め（LOG_MAX_FIELD_CHARS）
+- DEBUGのサンプリング（LOG_DEBUG_SAMPLE_RATE の割合のリクエストだけ、DEBUG行もすべて出力する）
+- メッセージ本文は既定で出力しない（LOG_MESSAGE_BODIES=true のときだけ redact() が本文を返す）
+
+コンテキストはcontextvarsで持つため、スレッドプールへ投入する処理は submit_with_context() を使うと引き継がれる
+"""
+import contextvars
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0"))
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "512"))
+LOG_MESSAGE_BODIES = os.environ.get("LOG_MESSAGE_BODIES", "false").lower() == "true"
+
+_threshold = LEVELS.get(LOG_LEVEL, LEVELS["INFO"])
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+_write_lock = threading.Lock()
+# テストで出力先を差し替えられるようにする
+_sink: Callable[[str], None] = lambda line: sys.stdout.write(line + "\n")
+
+
+def hash_key(key: str) -> str:
+    """セッションキー（LINEのユーザー・グループID）をログに残すためのハッシュ"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def truncate(value: Any, limit: Optional[int] = None) -> Any:
+    """文字列を上限の長さで切り詰める（辞書・リストの中も対象）"""
+    limit = LOG_MAX_FIELD_CHARS if limit is None else limit
+    if isinstance(value, str):
+        if len(value) > limit:
+            return f"{value[:limit]}…(+{len(value) - limit} chars)"
+        return value
+    if isinstance(value, dict):
+        return {k: truncate(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(v, limit) for v in value]
+    return value
+
+
+def redact(text: Optional[str]) -> Any:
+    """メッセージ本文。既定では長さだけを返す"""
+    if text is None:
+        return None
+    if LOG_MESSAGE_BODIES:
+        return text
+    return {"chars": len(text)}
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None, **fields: Any) -> Iterator[None]:
+    """リクエスト単位のコンテキスト（DEBUGを出力するかどうかもここで決める）"""
+    context = {k: v for k, v in fields.items() if v is not None}
+    if request_id:
+        context["request_id"] = request_id
+    if LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE:
+        context["debug_sampled"] = True
+    token = _context.set(context)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**fields: Any) -> None:
+    """現在のコンテキストに値を追加する（session_key はハッシュにして残す）"""
+    context = dict(_context.get())
+    session_key = fields.pop("session_key", None)
+    if session_key:
+        context["session"] = hash_key(session_key)
+    context.update({k: v for k, v in fields.items() if v is not None})
+    _context.set(context)
+
+
+@contextmanager
+def scope() -> Iterator[None]:
+    """ブロック内の bind() をブロックを抜けるときに取り消す（イベントごとの値を後続に持ち越さない）"""
+    token = _context.set(_context.get())
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def submit_with_context(executor: Any, fn: Callable, *args: Any) -> Any:
+    """コンテキストを引き継いでスレッドプールへ投入する"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def enabled(level: str) -> bool:
+    if LEVELS[level] >= _threshold:
+        return True
+    return level == "DEBUG" and bool(_context.get().get("debug_sampled"))
+
+
+def _emit(level: str, message: str, fields: Dict[str, Any]) -> None:
+    if not enabled(level):
+        return
+    record: Dict[str, Any] = {
+        "level": level,
+        "ts": round(time.time() * 1000),
+        "msg": message,
+    }
+    context = _context.get()
+    record.update({k: v for k, v in context.items() if k != "debug_sampled"})
+    record.update(truncate(fields))
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        _sink(line)
+
+
+def debug(message: str, **fields: Any) -> None:
+    _emit("DEBUG", message, fields)
+
+
+def info(message: str, **fields: Any) -> None:
+    _emit("INFO", message, fields)
+
+
+def warning(message: str, **fields: Any) -> None:
+    _emit("WARNING", message, fields)
+
+
+def error(message: str, **fields: Any) -> None:
+    _emit("ERROR", message, fields)
+
+
+def exception(message: str, error: BaseException, **fields: Any) -> None:
+    """例外の種類・内容・トレースバックを付けてERRORを出力"""
+    trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    # トレースバックは末尾（例外の発生箇所）を残して切り詰める
+    if len(trace) > LOG_MAX_FIELD_CHARS:
+        trace = "…" + trace[-(LOG_MAX_FIELD_CHARS - 1):]
+    fields.update({
+        "error_type": type(error).__name__,
+        "error": str(error),
+        "traceback": trace,
+    })
+    _emit("ERROR", message, fields)
+
+
+def set_sink(sink: Callable[[str], None]) -> Callable[[str], None]:
+    """出力先を差し替え、元の出力先を返す（テスト用）"""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def configure(
+    level: Optional[str] = None,
+    debug_sample_rate: Optional[float] = None,
+    max_field_chars: Optional[int] = None,
+    message_bodies: Optional[bool] = None,
+) -> None:
+    """設定を変更する（テスト用。通常は環境変数で設定する）"""
+    global _threshold, LOG_DEBUG_SAMPLE_RATE, LOG_MAX_FIELD_CHARS, LOG_MESSAGE_BODIES
+    if level is not None:
+        _threshold = LEVELS[level.upper()]
+    if debug_sample_rate is not None:
+        LOG_DEBUG_SAMPLE_RATE = debug_sample_rate
+    if max_field_chars is not None:
+        LOG_MAX_FIELD_CHARS = max_field_chars
+    if message_bodies is not None:
+        LOG_MESSAGE_BODIES = message_bodies
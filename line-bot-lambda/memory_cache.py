@@ -0,0 +1,97 @@
+"""
+長期記憶の検索結果キャッシュ
+
+アクター・名前空間・正規化したクエリをキーに、retrieve_memory_recordsの結果をキャッシュする。
+長期記憶は会話からAgentCoreが非同期に抽出するため、会話の保存ごとには無効化せずTTLで入れ替える。
+明示的に捨てる場合は invalidate を使う（共有層には無効化時刻のマーカーを書く）
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+import log
+from cache import TwoTierCache
+
+
+# 末尾の句読点・記号は質問の意味を変えないため正規化で取り除く
+_TRAILING_PUNCTUATION = re.compile(r"[\s。、．，！？!?.,…〜~ー]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """クエリを正規化
+
+    - NFKC（半角カナ→全角カナ、全角英数字・全角スペース→半角）
+    - 英字の大文字・小文字を区別しない
+    - 連続する空白を1つにまとめ、前後と末尾の句読点を除く
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class LongTermMemoryCache:
+    """長期記憶の検索結果キャッシュ"""
+
+    KEY_PREFIX = "ltm"
+    INVALIDATION_PREFIX = "ltm-inv"
+
+    def __init__(self, cache: TwoTierCache):
+        self.cache = cache
+        # アクター → 最後に無効化した時刻
+        self._invalidated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.stale = 0
+
+    def key(self, actor_id: str, namespace: str, query: str) -> str:
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()[:32]
+        return f"{self.KEY_PREFIX}|{actor_id}|{namespace}|{digest}"
+
+    def get(self, actor_id: str, namespace: str, query: str) -> Optional[List[Dict[str, Any]]]:
+        """キャッシュ済みの検索結果を返す。なければNone"""
+        return self.get_many(actor_id, [namespace], query).get(namespace)
+
+    def get_many(self, actor_id: str, namespaces: List[str], query: str) -> Dict[str, List[Dict[str, Any]]]:
+        """名前空間 → キャッシュ済みの検索結果を返す（共有層の読み込みは全名前空間で1回）"""
+        marker_key = f"{self.INVALIDATION_PREFIX}|{actor_id}"
+        keys = {ns: self.key(actor_id, ns, query) for ns in namespaces}
+        entries, extra = self.cache.get_entries(keys.values(), [marker_key])
+        invalidated_at = self._invalidated_at.get(actor_id, 0.0)
+        if marker_key in extra:
+            # 別のコンテナでの無効化も反映する
+            invalidated_at = max(invalidated_at, extra[marker_key][1])
+        found = {}
+        for ns, key in keys.items():
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            if entry.stored_at <= invalidated_at:
+                self.stale += 1
+                self.cache.local.delete(key)
+                continue
+            found[ns] = entry.value
+        return found
+
+    def put(self, actor_id: str, namespace: str, query: str, records: List[Dict[str, Any]]) -> None:
+        self.cache.put(self.key(actor_id, namespace, query), records)
+
+    def invalidate(self, actor_id: str) -> None:
+        """アクターのキャッシュを無効化（長期記憶を消した・書き換えたときなどに呼ぶ）"""
+        now = self.cache.local.clock()
+        with self._lock:
+            self._invalidated_at[actor_id] = now
+        self.cache.local.delete_prefix(f"{self.KEY_PREFIX}|{actor_id}|")
+        if self.cache.shared is not None:
+            try:
+                self.cache.shared.put(
+                    f"{self.INVALIDATION_PREFIX}|{actor_id}", True, self.cache.ttl_seconds, now
+                )
+            except Exception as e:
+                log.warning("Shared cache invalidation error", error=str(e))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        stats["stale"] = self.stale
+        return stats
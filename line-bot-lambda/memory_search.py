@@ -0,0 +1,94 @@
+"""
+長期記憶の名前空間横断検索
+
+複数の名前空間を共通の締め切り内で並列に検索し、スコア順に統合・重複除去して上位N件に絞る
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import log
+from memory_cache import normalize_query
+
+
+MEMORY_SEARCH_MAX_WORKERS = int(os.environ.get("MEMORY_SEARCH_MAX_WORKERS", "8"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """名前空間の並列検索用スレッドプールを返す
+
+    ステージパイプラインのステージ内から投入するため、パイプライン用のプールとは分ける
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=MEMORY_SEARCH_MAX_WORKERS,
+                    thread_name_prefix="memory-search",
+                )
+    return _executor
+
+
+def fan_out(
+    namespaces: Sequence[str],
+    fetch: Callable[[str], List[Dict[str, Any]]],
+    deadline_seconds: float,
+    executor: Optional[ThreadPoolExecutor] = None,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """名前空間ごとの検索を並列に実行し、締め切りまでに得られた結果を返す
+
+    締め切りに間に合わなかった名前空間と失敗した名前空間は結果に含めない
+    """
+    if not namespaces:
+        return {}
+    pool = executor or get_executor()
+    started = time.perf_counter()
+    futures = {log.submit_with_context(pool, fetch, ns): ns for ns in namespaces}
+    done, not_done = wait(futures, timeout=deadline_seconds)
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    for future in done:
+        ns = futures[future]
+        try:
+            results[ns] = future.result()
+        except Exception as e:
+            log.warning("retrieve_memory_records error", namespace=ns, error=str(e))
+    for future in not_done:
+        # 実行中の検索は止められないため、結果を待たずに切り捨てる
+        future.cancel()
+        log.warning("retrieve_memory_records deadline exceeded", namespace=futures[future])
+    log.info(
+        "Long-term memory fan-out",
+        namespaces=len(namespaces),
+        succeeded=len(results),
+        elapsed_ms=round((time.perf_counter() - started) * 1000),
+    )
+    return results
+
+
+def merge_records(record_lists: Sequence[List[Dict[str, Any]]], top_n: int) -> List[Dict[str, Any]]:
+    """検索結果をスコアの高い順に統合し、重複を除いて上位 top_n 件を返す
+
+    表記ゆれのみ異なる記録は正規化したテキストのハッシュで同一とみなし、スコアの高い方を残す
+    """
+    records = [r for records in record_lists for r in records if r.get("text")]
+    records.sort(key=lambda r: r.get("score") or 0.0, reverse=True)
+
+    merged = []
+    seen = set()
+    for record in records:
+        digest = hashlib.sha256(normalize_query(record["text"]).encode("utf-8")).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        merged.append(record)
+        if len(merged) >= top_n:
+            break
+    return merged
@@ -0,0 +1,172 @@
+"""
+返信後の会話の保存（短期記憶への書き込みを返信のクリティカルパスから外す）
+
+イベントの処理中は会話を add() で積むだけにし、返信をすべて送ったあとに flush() でまとめて書き込む。
+
+- 同じアクター・セッションの会話は1回の書き込み（create_event の payload に複数ターン）にまとめる
+- 書き込みの失敗は指数バックオフ（ジッターあり）で再試行する
+- Lambdaのタイムアウトが近い、または再試行を使い切った会話は、spill で永続キューに退避する
+  （キューのワーカーが書き込み直す。退避にも失敗した会話は破棄して件数を記録する）
+- 書き込み前の会話は pending_for() で参照できる（同じバッチの後続のイベントが短期記憶として使う）
+"""
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import log
+
+
+@dataclass
+class ConversationTurn:
+    """保存待ちの1往復の会話"""
+    actor_id: str
+    session_id: str
+    user_msg: str
+    assistant_msg: str
+    # 会話の時刻（UNIX秒）
+    timestamp: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationTurn":
+        return cls(**data)
+
+
+WriteFunc = Callable[[str, str, List[ConversationTurn]], None]
+SpillFunc = Callable[[List[ConversationTurn]], None]
+
+
+class MemoryWriter:
+    """会話の保存をまとめ、返信後に書き込む"""
+
+    def __init__(
+        self,
+        write: WriteFunc,
+        spill: Optional[SpillFunc] = None,
+        max_attempts: int = 4,
+        base_delay: float = 0.1,
+        max_delay: float = 2.0,
+        spill_margin_seconds: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.write = write
+        self.spill = spill
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.spill_margin_seconds = spill_margin_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._pending: List[ConversationTurn] = []
+        self.written_turns = 0
+        self.write_calls = 0
+        self.retries = 0
+        self.spilled_turns = 0
+        self.dropped_turns = 0
+
+    def add(self, turn: ConversationTurn) -> None:
+        with self._lock:
+            self._pending.append(turn)
+
+    def pending_for(self, actor_id: str, session_id: str) -> List[ConversationTurn]:
+        """まだ書き込んでいない、このアクター・セッションの会話（古い順）"""
+        with self._lock:
+            return [t for t in self._pending if t.actor_id == actor_id and t.session_id == session_id]
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, deadline: Optional[float] = None) -> Dict[str, int]:
+        """積まれた会話をアクター・セッションごとに書き込み、今回の件数を返す
+
+        deadline（clock と同じ基準の時刻）までに書き込みきれない会話は spill で退避する
+        """
+        with self._lock:
+            turns, self._pending = self._pending, []
+        result = {"turns": len(turns), "written": 0, "calls": 0, "retries": 0, "spilled": 0, "dropped": 0}
+        if not turns:
+            return result
+
+        groups: Dict[Tuple[str, str], List[ConversationTurn]] = {}
+        for turn in turns:
+            groups.setdefault((turn.actor_id, turn.session_id), []).append(turn)
+
+        # グループごとに書き込む（失敗したグループと、時間切れで試せなかったグループだけを退避する）
+        leftover: List[ConversationTurn] = []
+        for (actor_id, session_id), group in groups.items():
+            if self._has_time(deadline) and self._write_with_retry(actor_id, session_id, group, deadline, result):
+                result["written"] += len(group)
+            else:
+                leftover.extend(group)
+
+        if leftover:
+            self._spill(leftover, result)
+        with self._lock:
+            self.written_turns += result["written"]
+            self.write_calls += result["calls"]
+            self.retries += result["retries"]
+            self.spilled_turns += result["spilled"]
+            self.dropped_turns += result["dropped"]
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "written_turns": self.written_turns,
+                "write_calls": self.write_calls,
+                "retries": self.retries,
+                "spilled_turns": self.spilled_turns,
+                "dropped_turns": self.dropped_turns,
+            }
+
+    def _has_time(self, deadline: Optional[float], seconds: float = 0.0) -> bool:
+        return deadline is None or self.clock() + seconds + self.spill_margin_seconds < deadline
+
+    def _write_with_retry(
+        self,
+        actor_id: str,
+        session_id: str,
+        turns: List[ConversationTurn],
+        deadline: Optional[float],
+        result: Dict[str, int],
+    ) -> bool:
+        """書き込めたらTrue（時間切れ・再試行の上限ならFalse）"""
+        for attempt in range(self.max_attempts):
+            if not self._has_time(deadline):
+                log.warning("Memory write deadline reached", turns=len(turns))
+                return False
+            try:
+                result["calls"] += 1
+                self.write(actor_id, session_id, turns)
+                return True
+            except Exception as e:
+                log.warning("Memory write error", attempt=attempt + 1, error=str(e))
+            if attempt + 1 == self.max_attempts:
+                break
+            # フルジッター付きの指数バックオフ
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            if not self._has_time(deadline, delay):
+                return False
+            result["retries"] += 1
+            self.sleep(delay)
+        return False
+
+    def _spill(self, turns: List[ConversationTurn], result: Dict[str, int]) -> None:
+        if self.spill is not None:
+            try:
+                self.spill(turns)
+                result["spilled"] += len(turns)
+                log.info("Spilled memory writes", turns=len(turns))
+                return
+            except Exception as e:
+                log.exception("Memory write spill failed", e)
+        result["dropped"] += len(turns)
+        log.error("Dropped memory writes", turns=len(turns))
@@ -0,0 +1,156 @@
+"""
+CloudWatch Embedded Metric Format（EMF）によるステージごとのレイテンシ計測
+
+イベント1件ごとに、計測したステージの所要時間（ミリ秒）を1つのEMFドキュメントとしてstdoutへ出力する。
+CloudWatch Logsが自動でメトリクスに変換するため、PutMetricDataの呼び出し（とIAM権限）は不要。
+
+- ディメンション: MessageType（text/image/image_set）× SourceType（user/group/room）
+  （返信後の会話の保存は MessageType=memory_write、SourceType=post_reply の別ドキュメントで出力する）
+- ColdStart: コンテナの最初の呼び出しで処理したイベントは1（ログにも値が残るため、Logs Insightsで絞り込める）
+- Errors: イベントの処理が例外で終わった場合は1
+- ResponseCacheHit・ImageCacheHit・LongTermMemoryCacheHit: キャッシュを引いたイベントで、ヒットなら1・ミスなら0
+  （平均がヒット率になる）
+
+コンテキストはcontextvarsで持つため、log.submit_with_context() で投入したステージの計測も同じイベントに集計される。
+テストでは capture() で出力をリストに受け取れる
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "FamilyInfoHub/LineBot")
+DIMENSIONS = ("MessageType", "SourceType")
+
+_cold_start = True
+_cold_start_lock = threading.Lock()
+_invocation_cold: contextvars.ContextVar[bool] = contextvars.ContextVar("metrics_cold_start", default=False)
+_current: contextvars.ContextVar[Optional["EventMetrics"]] = contextvars.ContextVar("metrics_event", default=None)
+_write_lock = threading.Lock()
+_sink: Callable[[str], None] = lambda line: sys.stdout.write(line + "\n")
+
+
+class EventMetrics:
+    """イベント1件分の計測値（ステージのスレッドから同時に追加される）"""
+
+    def __init__(self, dimensions: Dict[str, str], cold_start: bool):
+        self.dimensions = dimensions
+        self.cold_start = cold_start
+        self.values: Dict[str, List[float]] = {}
+        self.units: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        with self._lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def to_emf(self, timestamp_ms: int) -> Dict[str, Any]:
+        """EMFドキュメント（同じメトリクスの複数の値は配列で出力する）"""
+        with self._lock:
+            values = {k: list(v) for k, v in self.values.items()}
+        document: Dict[str, Any] = {
+            "_aws": {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(DIMENSIONS)],
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in values],
+                }],
+            },
+        }
+        document.update(self.dimensions)
+        for name, items in values.items():
+            document[name] = items[0] if len(items) == 1 else items
+        return document
+
+
+@contextmanager
+def invocation() -> Iterator[None]:
+    """Lambdaの呼び出し単位のスコープ（コンテナの最初の呼び出しをコールドスタートとする）"""
+    global _cold_start
+    with _cold_start_lock:
+        cold, _cold_start = _cold_start, False
+    token = _invocation_cold.set(cold)
+    try:
+        yield
+    finally:
+        _invocation_cold.reset(token)
+
+
+@contextmanager
+def event_metrics(message_type: str, source_type: str) -> Iterator[Optional[EventMetrics]]:
+    """イベント1件の計測スコープ（終了時にEMFドキュメントを1つ出力）"""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    recorder = EventMetrics(
+        {"MessageType": message_type, "SourceType": source_type}, _invocation_cold.get()
+    )
+    recorder.put("ColdStart", 1 if recorder.cold_start else 0, unit="Count")
+    token = _current.set(recorder)
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield recorder
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        recorder.put("EventLatency", (time.perf_counter() - started) * 1000)
+        recorder.put("Errors", 1 if failed else 0, unit="Count")
+        _current.reset(token)
+        flush(recorder)
+
+
+def put(name: str, value: float, unit: str = "Milliseconds") -> None:
+    """現在のイベントに値を追加（計測スコープ外では何もしない）"""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.put(name, value, unit)
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    """ブロックの所要時間を `name` として記録（例外で抜けた場合も記録する）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        put(name, (time.perf_counter() - started) * 1000)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """関数の所要時間を `name` として記録するデコレーター"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush(recorder: EventMetrics) -> None:
+    line = json.dumps(recorder.to_emf(round(time.time() * 1000)), ensure_ascii=False)
+    with _write_lock:
+        _sink(line)
+
+
+@contextmanager
+def capture() -> Iterator[List[Dict[str, Any]]]:
+    """出力されたEMFドキュメントをリストに受け取る（テスト用）"""
+    global _sink
+    documents: List[Dict[str, Any]] = []
+    previous, _sink = _sink, lambda line: documents.append(json.loads(line))
+    try:
+        yield documents
+    finally:
+        _sink = previous
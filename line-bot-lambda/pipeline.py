@@ -0,0 +1,145 @@
+"""
+イベント処理用のステージパイプライン
+
+依存関係のないステージを有界スレッドプールで並列実行し、ステージごとのタイムラインを記録する
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import log
+
+
+PIPELINE_MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "4"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """コンテナ内で共有する有界スレッドプールを返す"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=PIPELINE_MAX_WORKERS,
+                    thread_name_prefix="stage",
+                )
+    return _executor
+
+
+@dataclass
+class Stage:
+    """パイプラインの1ステージ
+
+    func は依存ステージの結果を格納した辞書を受け取り、このステージの結果を返す
+    """
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    depends_on: Sequence[str] = ()
+
+
+@dataclass
+class StageTiming:
+    """ステージの実行区間（パイプライン開始からのミリ秒）"""
+    name: str
+    start_ms: float
+    end_ms: float
+    ok: bool = True
+
+    @property
+    def duration_ms(self) -> float:
+        return self.end_ms - self.start_ms
+
+
+@dataclass
+class PipelineResult:
+    """ステージ結果とタイムライン"""
+    results: Dict[str, Any] = field(default_factory=dict)
+    timeline: List[StageTiming] = field(default_factory=list)
+    total_ms: float = 0.0
+
+    def __getitem__(self, name: str) -> Any:
+        return self.results[name]
+
+    def summary(self) -> str:
+        """ログ出力用のタイムライン表記"""
+        parts = [
+            f"{t.name}={t.start_ms:.0f}-{t.end_ms:.0f}ms" + ("" if t.ok else "(error)")
+            for t in sorted(self.timeline, key=lambda t: t.start_ms)
+        ]
+        return f"total={self.total_ms:.0f}ms " + " ".join(parts)
+
+
+class StagePipeline:
+    """依存関係に従ってステージを並列実行するパイプライン"""
+
+    def __init__(self, stages: Sequence[Stage], executor: Optional[ThreadPoolExecutor] = None):
+        names = [s.name for s in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names: {names}")
+        for stage in stages:
+            unknown = [d for d in stage.depends_on if d not in names]
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {unknown}")
+        self.stages = list(stages)
+        self.executor = executor
+
+    def run(self) -> PipelineResult:
+        """全ステージを実行し、結果とタイムラインを返す
+
+        いずれかのステージが例外を送出した場合は、実行中のステージの完了を待ってから再送出する
+        """
+        executor = self.executor or get_executor()
+        result = PipelineResult()
+        started = time.perf_counter()
+        pending = {s.name: s for s in self.stages}
+        running: Dict[Future, str] = {}
+        error: Optional[BaseException] = None
+
+        def elapsed_ms() -> float:
+            return (time.perf_counter() - started) * 1000
+
+        def run_stage(stage: Stage, deps: Dict[str, Any]) -> Any:
+            start_ms = elapsed_ms()
+            try:
+                value = stage.func(deps)
+            except BaseException:
+                result.timeline.append(StageTiming(stage.name, start_ms, elapsed_ms(), ok=False))
+                raise
+            result.timeline.append(StageTiming(stage.name, start_ms, elapsed_ms()))
+            return value
+
+        while pending or running:
+            if error is None:
+                ready = [
+                    s for s in pending.values()
+                    if all(d in result.results for d in s.depends_on)
+                ]
+                for stage in ready:
+                    del pending[stage.name]
+                    deps = {d: result.results[d] for d in stage.depends_on}
+                    running[log.submit_with_context(executor, run_stage, stage, deps)] = stage.name
+
+            if not running:
+                if error is None and pending:
+                    raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result.results[name] = future.result()
+                except BaseException as e:
+                    if error is None:
+                        error = e
+
+        result.total_ms = elapsed_ms()
+        if error is not None:
+            raise error
+        return result
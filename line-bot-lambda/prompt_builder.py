@@ -0,0 +1,124 @@
+"""
+トークン予算付きのプロンプト組み立て
+
+ユーザーのメッセージ → 直近の会話履歴 → 長期記憶 の優先順で予算を割り当て、
+予算を超えるセクションは文（会話履歴は発言）の区切りで切り詰める
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+
+LONG_TERM_HEADER = "[過去の長期記憶]"
+SHORT_TERM_HEADER = "[今セッションの会話履歴]"
+USER_MESSAGE_HEADER = "[ユーザーのメッセージ]"
+SECTION_SEPARATOR = "\n\n"
+
+# 文・行の区切り（区切り文字は前の文に含める）
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？!?\n])")
+_LINE_BOUNDARY = re.compile(r"(?<=\n)")
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の簡易見積もり
+
+    日本語（かな・漢字・全角記号）は1文字≒1トークン、ASCIIは4文字≒1トークンとして数える。
+    文字種ごとのループを避け、ASCIIへのエンコード結果の長さで数える
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def split_sentences(text: str, unit: str = "sentence") -> List[str]:
+    """文末記号または改行で区切る（unit="line" は改行だけで区切る）"""
+    boundary = _LINE_BOUNDARY if unit == "line" else _SENTENCE_BOUNDARY
+    return [s for s in boundary.split(text) if s]
+
+
+def truncate_to_budget(text: str, budget: int, keep: str = "head", unit: str = "sentence") -> str:
+    """予算内に収まるように文単位で切り詰める
+
+    keep="head" は先頭から、keep="tail" は末尾（最新）から文を残す。
+    最初の1文だけで予算を超える場合は、その文を文字単位で切り詰める
+    """
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    sentences = split_sentences(text, unit)
+    if keep == "tail":
+        sentences.reverse()
+
+    kept: List[str] = []
+    used = 0
+    for sentence in sentences:
+        cost = estimate_tokens(sentence)
+        if used + cost > budget:
+            if not kept:
+                kept.append(_cut_chars(sentence, budget, keep))
+            break
+        kept.append(sentence)
+        used += cost
+
+    if keep == "tail":
+        kept.reverse()
+    return "".join(kept).strip()
+
+
+def _cut_chars(text: str, budget: int, keep: str) -> str:
+    """文字単位で予算内に切り詰める（最悪でも1文字1トークンなので budget 文字から縮める）"""
+    cut = text[:budget] if keep == "head" else text[-budget:]
+    while cut and estimate_tokens(cut) > budget:
+        cut = cut[:-1] if keep == "head" else cut[1:]
+    return cut
+
+
+@dataclass
+class AssembledPrompt:
+    """組み立てたプロンプトとセクションごとのトークン数"""
+    prompt: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    truncated: List[str] = field(default_factory=list)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.usage.values())
+
+
+def assemble_prompt(
+    user_message: str,
+    short_term_context: str = "",
+    long_term_context: str = "",
+    budget: int = 4000,
+) -> AssembledPrompt:
+    """トークン予算内でプロンプトを組み立てる"""
+    result = AssembledPrompt(prompt="")
+    remaining = budget
+
+    def allocate(name: str, header: str, text: str, keep: str, unit: str = "sentence") -> str:
+        nonlocal remaining
+        if not text:
+            return ""
+        overhead = estimate_tokens(header + SECTION_SEPARATOR) + 1
+        body = truncate_to_budget(text, remaining - overhead, keep, unit)
+        if body != text:
+            result.truncated.append(name)
+        if not body:
+            return ""
+        used = overhead + estimate_tokens(body)
+        result.usage[name] = used
+        remaining -= used
+        return f"{header}\n{body}"
+
+    # 優先度の高い順に予算を割り当て、プロンプト上の並びは従来どおりにする
+    user_section = allocate("user_message", USER_MESSAGE_HEADER, user_message, "head")
+    # 会話履歴は発言（行）単位で新しいものから残す
+    short_section = allocate("short_term", SHORT_TERM_HEADER, short_term_context, "tail", "line")
+    long_section = allocate("long_term", LONG_TERM_HEADER, long_term_context, "head")
+
+    result.prompt = SECTION_SEPARATOR.join(
+        s for s in (long_section, short_section, user_section) if s
+    )
+    return result
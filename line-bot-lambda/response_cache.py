@@ -0,0 +1,98 @@
+"""
+履歴に依存しないメッセージへの応答のキャッシュ
+
+「おはよう」「ありがとう」のような挨拶・お礼・相づちは、会話履歴や長期記憶に関係なく同じように答えられる。
+分類器で履歴に依存しない（context-free）と判定したメッセージだけを、正規化した本文と
+システムプロンプトの版をキーにコンテナ内のTTL付きLRUにキャッシュし、2回目以降はエージェントを呼ばずに応答する。
+
+キャッシュする応答は会話履歴・長期記憶を渡さずに生成したものに限る（他のチャットに個人の情報が混ざらない）
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Optional
+
+from cache import TTLCache
+from memory_cache import normalize_query
+
+
+# 前後の絵文字・記号は挨拶の意味を変えないため除く（正規化後に比較する）
+_SURROUNDING_SYMBOLS = re.compile(r"^[\W_]+|[\W_]+$")
+
+_PHRASES = (
+    "おはよう", "おはようございます", "こんにちは", "こんばんは", "おやすみ", "おやすみなさい",
+    "ありがとう", "ありがとうございます", "ありがと", "どうもありがとう", "サンキュー",
+    "了解", "了解です", "りょうかい", "わかりました", "承知しました", "ok", "おっけー",
+    "よろしく", "よろしくお願いします", "よろしくね",
+    "お疲れさま", "お疲れ様", "おつかれさま", "お疲れさまです", "お疲れ様です",
+    "ただいま", "おかえり", "おかえりなさい", "いってきます", "いってらっしゃい",
+    "hello", "hi", "thanks", "thank you", "good morning", "good night",
+)
+
+
+def normalize_message(text: str) -> str:
+    """メッセージを正規化（クエリの正規化に加え、前後の絵文字・記号を除く）"""
+    normalized = normalize_query(text)
+    stripped = "".join(c for c in normalized if unicodedata.category(c) != "So")
+    return _SURROUNDING_SYMBOLS.sub("", stripped).strip()
+
+
+# 比較は正規化後の表記で行う（「おっけー」の末尾の長音なども同じように除かれる）
+CONTEXT_FREE_PHRASES = frozenset(normalize_message(p) for p in _PHRASES)
+
+
+def is_context_free(text: str) -> bool:
+    """会話履歴・長期記憶に関係なく答えられるメッセージか（挨拶・お礼・相づち）"""
+    return normalize_message(text) in CONTEXT_FREE_PHRASES
+
+
+class ResponseCache:
+    """履歴に依存しないメッセージへの応答のキャッシュ"""
+
+    KEY_PREFIX = "resp"
+
+    def __init__(
+        self,
+        cache: TTLCache,
+        prompt_fingerprint: str = "",
+        classifier: Callable[[str], bool] = is_context_free,
+    ):
+        self.cache = cache
+        self.prompt_fingerprint = prompt_fingerprint
+        self.classifier = classifier
+        self._lock = threading.Lock()
+        self.eligible = 0
+        self.ineligible = 0
+
+    def key(self, message: str) -> Optional[str]:
+        """キャッシュの対象ならキーを返す（対象外なら None）"""
+        if not self.classifier(message):
+            self._count("ineligible")
+            return None
+        self._count("eligible")
+        digest = hashlib.sha256(normalize_message(message).encode("utf-8")).hexdigest()[:32]
+        return f"{self.KEY_PREFIX}|{self.prompt_fingerprint}|{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの応答を返す。なければNone"""
+        return self.cache.get(key)
+
+    def put(self, key: str, response: str) -> None:
+        self.cache.put(key, response)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        with self._lock:
+            messages = self.eligible + self.ineligible
+            stats.update({
+                "eligible": self.eligible,
+                "ineligible": self.ineligible,
+                # 全テキストメッセージのうちエージェントを呼ばずに応答できた割合
+                "message_hit_rate": round(stats["hits"] / messages, 3) if messages else 0.0,
+            })
+        return stats
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
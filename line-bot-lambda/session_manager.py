@@ -0,0 +1,392 @@
+"""
+セッション管理
+
+セッションキー（ユーザー・グループ・ルームID）→ AgentCoreセッションIDの対応をDynamoDBで管理する
+- ウォームコンテナ内の有界LRUキャッシュで、同じチャットの2通目以降はDynamoDBを読まない
+- 新規作成は条件付き書き込み1回で行い、同時作成による上書きを防ぐ
+- TTLの延長は、保存済みのTTLが設定から一定時間以上経過したときだけ行う
+- セッション行には直近の会話のリングバッファ（turn_buffer）も持ち、セッションIDと同じ読み込みで履歴を返す。
+  バッファは版番号（recent_turns_seq）による条件付き書き込みで更新し、競合で会話が欠けそうなら削除する
+  （呼び出し側は list_events の結果で作り直す）
+- 履歴の読み込みで行のセッションがキャッシュと違えば（他のコンテナでのリセットなど）、行のセッションに切り替える
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from botocore.exceptions import ClientError
+
+import log
+import turn_buffer
+from turn_buffer import Message
+
+
+@dataclass
+class CachedSession:
+    """キャッシュ中のセッション"""
+    session_id: str
+    ttl: int
+    # 直近の会話のリングバッファ（圧縮済み、このセッションのものがなければ None）とその版番号
+    turns: Optional[bytes] = None
+    turns_seq: int = 0
+    # セッション行を読み書きした時刻（バッファの鮮度の判定に使う）
+    synced_at: float = 0.0
+
+
+class SessionManager:
+    """LRUキャッシュ付きのセッションマネージャー"""
+
+    # BatchGetItemの1リクエストあたりのキー上限
+    BATCH_GET_LIMIT = 100
+
+    def __init__(
+        self,
+        dynamodb: Any,
+        table_name: str,
+        capacity: int = 1024,
+        ttl_seconds: int = 86400,
+        refresh_after_seconds: int = 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self._table: Any = None
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.refresh_after_seconds = refresh_after_seconds
+        self.clock = clock
+        self._cache: "OrderedDict[str, CachedSession]" = OrderedDict()
+        # 先読みで行が存在しないと分かったキー（get_itemを省略して作成に進む）
+        self._absent: Set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.creates = 0
+        self.ttl_refreshes = 0
+        self.create_conflicts = 0
+        self.history_hits = 0
+        self.history_misses = 0
+        self.history_reads = 0
+        self.history_conflicts = 0
+
+    @property
+    def table(self) -> Any:
+        """DynamoDBのTableは初回利用時に生成する（コールドスタートでリソースを作らない）"""
+        if self._table is None:
+            self._table = self.dynamodb.Table(self.table_name)
+        return self._table
+
+    def get_or_create(self, session_key: str) -> str:
+        """セッションIDを返す。なければ作成する"""
+        now = int(self.clock())
+        cached = self._get_cached(session_key, now)
+        if cached is not None:
+            self._count("hits")
+            self._refresh_if_needed(session_key, cached, now)
+            return cached.session_id
+
+        self._count("misses")
+        with self._lock:
+            known_absent = session_key in self._absent
+            self._absent.discard(session_key)
+        if not known_absent:
+            item = self.table.get_item(Key={"user_id": session_key}).get("Item")
+            if item and int(item.get("ttl", 0)) > now:
+                cached = self._remember(session_key, item)
+                self._refresh_if_needed(session_key, cached, now)
+                return cached.session_id
+
+        return self._create(session_key, now)
+
+    def prefetch(self, session_keys: Iterable[str]) -> None:
+        """複数のセッション行をBatchGetItemでまとめて読み込み、キャッシュに載せる"""
+        now = int(self.clock())
+        keys = [k for k in dict.fromkeys(session_keys) if self._get_cached(k, now) is None]
+        for i in range(0, len(keys), self.BATCH_GET_LIMIT):
+            chunk = keys[i:i + self.BATCH_GET_LIMIT]
+            request = {self.table_name: {"Keys": [{"user_id": k} for k in chunk]}}
+            found: Dict[str, Dict[str, Any]] = {}
+            # 未処理キーは数回だけ再試行し、残りは通常の読み込みに任せる
+            for _ in range(3):
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get("Responses", {}).get(self.table_name, []):
+                    found[item["user_id"]] = item
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+            unprocessed = {
+                k["user_id"] for k in (request or {}).get(self.table_name, {}).get("Keys", [])
+            }
+            for key in chunk:
+                item = found.get(key)
+                if item and int(item.get("ttl", 0)) > now:
+                    self._remember(key, item)
+                elif key not in unprocessed:
+                    with self._lock:
+                        self._absent.add(key)
+
+    def recent_history(
+        self, session_key: str, session_id: str, max_age_seconds: float = 0.0
+    ) -> Optional[List[Message]]:
+        """セッション行のリングバッファから直近の会話を返す（バッファがない・別のセッションのものなら None）
+
+        キャッシュのバッファは max_age_seconds 以内に読み書きしたものだけ使い、それより古ければ読み直す。
+        読み直した行が別のセッション（他のコンテナでのリセットなど）なら、以降はそのセッションを使う
+        """
+        with self._lock:
+            cached = self._cache.get(session_key)
+        if cached is None or cached.session_id != session_id or self.clock() - cached.synced_at > max_age_seconds:
+            self._count("history_reads")
+            item = self.table.get_item(Key={"user_id": session_key}).get("Item")
+            if not item or item.get("session_id") != session_id:
+                self._count("history_misses")
+                self._adopt(session_key, item)
+                return None
+            cached = self._remember(session_key, item)
+        if cached.turns is None:
+            self._count("history_misses")
+            return None
+        self._count("history_hits")
+        return turn_buffer.decode(cached.turns)
+
+    def append_history(
+        self, session_key: str, session_id: str, messages: List[Message], max_messages: int
+    ) -> bool:
+        """リングバッファに発言を追加する（バッファがなければ何もしない）"""
+        for attempt in range(2):
+            with self._lock:
+                cached = self._cache.get(session_key)
+            if attempt > 0 or cached is None or cached.session_id != session_id:
+                item = self.table.get_item(Key={"user_id": session_key}, ConsistentRead=True).get("Item")
+                if not item or item.get("session_id") != session_id:
+                    return False
+                cached = self._remember(session_key, item)
+            if cached.turns is None:
+                # 古い会話が欠けたバッファは作らない（次の読み込みで list_events の結果から作り直す）
+                return False
+            blob = turn_buffer.encode(
+                turn_buffer.append(turn_buffer.decode(cached.turns), messages, max_messages)
+            )
+            try:
+                self.table.update_item(
+                    Key={"user_id": session_key},
+                    UpdateExpression="SET recent_turns = :turns, recent_turns_seq = :seq",
+                    ConditionExpression=(
+                        "session_id = :sid AND recent_turns_session = :sid AND recent_turns_seq = :expected"
+                    ),
+                    ExpressionAttributeValues={
+                        ":turns": blob,
+                        ":seq": cached.turns_seq + 1,
+                        ":sid": session_id,
+                        ":expected": cached.turns_seq,
+                    },
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                # 他のコンテナが先に書き込んだ。読み直して1度だけやり直す
+                self._count("history_conflicts")
+                continue
+            with self._lock:
+                cached.turns, cached.turns_seq, cached.synced_at = blob, cached.turns_seq + 1, self.clock()
+            return True
+        self.drop_history(session_key, session_id)
+        return False
+
+    def seed_history(
+        self, session_key: str, session_id: str, messages: List[Message], max_messages: int
+    ) -> bool:
+        """バッファがないセッション行に、別の経路（list_events）で取得した会話からバッファを作る"""
+        blob = turn_buffer.encode(turn_buffer.append([], messages, max_messages))
+        try:
+            response = self.table.update_item(
+                Key={"user_id": session_key},
+                UpdateExpression=(
+                    "SET recent_turns = :turns, recent_turns_session = :sid, "
+                    "recent_turns_seq = if_not_exists(recent_turns_seq, :zero) + :one"
+                ),
+                ConditionExpression=(
+                    "session_id = :sid AND "
+                    "(attribute_not_exists(recent_turns_session) OR recent_turns_session <> :sid)"
+                ),
+                ExpressionAttributeValues={":turns": blob, ":sid": session_id, ":zero": 0, ":one": 1},
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+        seq = int(response["Attributes"]["recent_turns_seq"])
+        with self._lock:
+            cached = self._cache.get(session_key)
+            if cached is not None and cached.session_id == session_id:
+                cached.turns, cached.turns_seq, cached.synced_at = blob, seq, self.clock()
+        return True
+
+    def drop_history(self, session_key: str, session_id: str) -> None:
+        """会話が欠けた可能性のあるバッファを削除する（版番号は残し、作り直した後も増え続けるようにする）"""
+        try:
+            self.table.update_item(
+                Key={"user_id": session_key},
+                UpdateExpression="REMOVE recent_turns, recent_turns_session",
+                ConditionExpression="session_id = :sid",
+                ExpressionAttributeValues={":sid": session_id},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        with self._lock:
+            cached = self._cache.get(session_key)
+            if cached is not None and cached.session_id == session_id:
+                cached.turns = None
+
+    def reset(self, session_key: str) -> str:
+        """新しいセッションに置き換える（会話の流れをリセットする。古いセッションへの書き込みは条件で弾かれる）"""
+        item = self._new_item(session_key, int(self.clock()))
+        self.table.put_item(Item=item)
+        with self._lock:
+            self._absent.discard(session_key)
+        self._count("creates")
+        log.info("Reset session", session_id=item["session_id"])
+        return self._remember(session_key, item).session_id
+
+    def _adopt(self, session_key: str, item: Optional[Dict[str, Any]]) -> None:
+        """保存済みのセッションがキャッシュと違えば、保存済みのほうに置き換える（期限切れ・なしなら捨てる）"""
+        with self._lock:
+            cached = self._cache.get(session_key)
+        if cached is None or (item and item.get("session_id") == cached.session_id):
+            return
+        if item and int(item.get("ttl", 0)) > int(self.clock()):
+            log.info("Adopted replaced session", session_id=item["session_id"])
+            self._remember(session_key, item)
+        else:
+            self.forget(session_key)
+
+    def forget(self, session_key: str) -> None:
+        """キャッシュからセッションを取り除く"""
+        with self._lock:
+            self._cache.pop(session_key, None)
+            self._absent.discard(session_key)
+
+    def clear(self) -> None:
+        """キャッシュとカウンターを初期化"""
+        with self._lock:
+            self._cache.clear()
+            self._absent.clear()
+            self.hits = self.misses = self.creates = 0
+            self.ttl_refreshes = self.create_conflicts = 0
+            self.history_hits = self.history_misses = self.history_reads = self.history_conflicts = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット・ミスなどのカウンター"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "creates": self.creates,
+                "create_conflicts": self.create_conflicts,
+                "ttl_refreshes": self.ttl_refreshes,
+                "history_hits": self.history_hits,
+                "history_misses": self.history_misses,
+                "history_reads": self.history_reads,
+                "history_conflicts": self.history_conflicts,
+                "size": len(self._cache),
+            }
+
+    def _get_cached(self, session_key: str, now: int) -> Optional[CachedSession]:
+        with self._lock:
+            cached = self._cache.get(session_key)
+            if cached is None:
+                return None
+            if cached.ttl <= now:
+                # DynamoDB側でも期限切れなので使わない
+                del self._cache[session_key]
+                return None
+            self._cache.move_to_end(session_key)
+            return cached
+
+    def _remember(self, session_key: str, item: Dict[str, Any]) -> CachedSession:
+        cached = CachedSession(
+            session_id=item["session_id"], ttl=int(item.get("ttl", 0)), synced_at=self.clock()
+        )
+        # 別のセッションのバッファ（期限切れで作り直す前のもの）は使わない
+        if "recent_turns" in item and item.get("recent_turns_session") == item["session_id"]:
+            blob = item["recent_turns"]
+            cached.turns = bytes(blob.value if hasattr(blob, "value") else blob)
+            cached.turns_seq = int(item.get("recent_turns_seq", 0))
+        with self._lock:
+            self._cache[session_key] = cached
+            self._cache.move_to_end(session_key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return cached
+
+    def _refresh_if_needed(self, session_key: str, cached: CachedSession, now: int) -> None:
+        """保存済みTTLの設定時刻から refresh_after_seconds 以上経っていればTTLを延長"""
+        set_at = cached.ttl - self.ttl_seconds
+        if now - set_at < self.refresh_after_seconds:
+            return
+        ttl = now + self.ttl_seconds
+        try:
+            self.table.update_item(
+                Key={"user_id": session_key},
+                UpdateExpression="SET #ttl = :ttl",
+                # 別のセッションに置き換わっていたら延長しない
+                ConditionExpression="session_id = :sid",
+                ExpressionAttributeNames={"#ttl": "ttl"},
+                ExpressionAttributeValues={":ttl": ttl, ":sid": cached.session_id},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            self.forget(session_key)
+            return
+        self._count("ttl_refreshes")
+        with self._lock:
+            cached.ttl = ttl
+
+    def _new_item(self, session_key: str, now: int) -> Dict[str, Any]:
+        session_id = str(uuid.uuid4())
+        return {
+            "user_id": session_key,
+            "session_id": session_id,
+            "ttl": now + self.ttl_seconds,
+            # 新しいセッションの会話は空（list_eventsを呼ばずに済む）
+            "recent_turns": turn_buffer.encode([]),
+            "recent_turns_session": session_id,
+            "recent_turns_seq": 0,
+        }
+
+    def _create(self, session_key: str, now: int) -> str:
+        """条件付き書き込みでセッションを作成し、競合した場合は相手のセッションを使う"""
+        item = self._new_item(session_key, now)
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression="attribute_not_exists(user_id) OR #ttl <= :now",
+                ExpressionAttributeNames={"#ttl": "ttl"},
+                ExpressionAttributeValues={":now": now},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # 同時に作成されたセッションを読み直す
+            self._count("create_conflicts")
+            existing = self.table.get_item(
+                Key={"user_id": session_key}, ConsistentRead=True
+            ).get("Item")
+            if existing:
+                return self._remember(session_key, existing).session_id
+            raise
+        self._count("creates")
+        log.info("Created new session", session_id=item["session_id"])
+        return self._remember(session_key, item).session_id
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
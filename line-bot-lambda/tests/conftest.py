@@ -0,0 +1,44 @@
+"""
+テストの共通フィクスチャ
+
+- clock: 時刻を進められる時計（tests.fakes.FakeClock）
+- dynamodb: motoのDynamoDBリソース
+- make_table: dynamodb にテーブルを作る関数（make_table(テーブル名, パーティションキー名="user_id")）
+"""
+import os
+from typing import Any, Callable, Iterator
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from tests.fakes import FakeClock
+
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def dynamodb() -> Iterator[Any]:
+    with mock_aws():
+        yield boto3.resource("dynamodb", region_name="us-west-2")
+
+
+@pytest.fixture
+def make_table(dynamodb) -> Callable[..., Any]:
+    def make(table_name: str, hash_key: str = "user_id") -> Any:
+        """文字列のパーティションキーだけを持つオンデマンドのテーブルを作る"""
+        return dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[{"AttributeName": hash_key, "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": hash_key, "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    return make
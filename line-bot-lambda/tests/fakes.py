@@ -0,0 +1,16 @@
+"""
+テスト用の擬似実装
+"""
+
+
+class FakeClock:
+    """呼び出すと now を返す時計（sleep は待たずに now を進める）"""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
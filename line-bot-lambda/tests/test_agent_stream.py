@@ -0,0 +1,93 @@
+"""
+エージェントのストリーミング応答パーサーのテスト
+"""
+import json
+import time
+
+import pytest
+
+from agent_stream import SentenceSegmenter, consume_agent_stream, iter_sse_data
+
+
+def sse(*events) -> list:
+    """SSE形式の行リストを生成"""
+    lines = []
+    for event in events:
+        lines.append(f"data: {json.dumps(event, ensure_ascii=False)}".encode("utf-8"))
+        lines.append(b"")
+    return lines
+
+
+def test_iter_sse_data_parses_json_events():
+    """data行のJSONが順に取り出されることを確認"""
+    lines = [b": keep-alive", b"", *sse({"delta": "a"}, {"delta": "b"})]
+
+    assert list(iter_sse_data(lines)) == [{"delta": "a"}, {"delta": "b"}]
+
+
+def test_iter_sse_data_joins_multiline_data():
+    """複数行のdataが連結されることを確認"""
+    lines = [b'data: {"delta":', b'data: "x"}', b""]
+
+    assert list(iter_sse_data(lines)) == [{"delta": "x"}]
+
+
+def test_segmenter_splits_japanese_sentences():
+    """日本語の文末で文が切り出されることを確認"""
+    segmenter = SentenceSegmenter()
+
+    assert segmenter.feed("おはよう") == []
+    assert segmenter.feed("さん。今日は") == ["おはようさん。"]
+    assert segmenter.feed("ええ天気やな！？ほんま") == ["今日はええ天気やな！？"]
+    assert segmenter.flush() == ["ほんま"]
+
+
+def test_segmenter_paragraph_mode():
+    """段落モードでは空行で区切られることを確認"""
+    segmenter = SentenceSegmenter("paragraph")
+
+    assert segmenter.feed("1行目。\n2行目。") == []
+    assert segmenter.feed("\n\n次の段落") == ["1行目。\n2行目。"]
+    assert segmenter.flush() == ["次の段落"]
+
+
+def test_consume_agent_stream_splits_sentences():
+    """文が完成するたびにセグメントになり、全文が返されることを確認"""
+    lines = sse(
+        {"delta": "こんにちは"},
+        {"delta": "。元気"},
+        {"delta": "やで。"},
+        {"result": {"role": "assistant", "content": [{"text": "こんにちは。元気やで。"}]}},
+    )
+
+    result = consume_agent_stream(lines)
+
+    assert result.segments == ["こんにちは。", "元気やで。"]
+    assert result.text == "こんにちは。元気やで。"
+    assert result.chunks == 4
+    assert result.first_segment_ms is not None
+
+
+def test_consume_agent_stream_falls_back_to_final_message():
+    """差分がない場合は最終メッセージの本文を返すことを確認"""
+    lines = sse({"result": {"role": "assistant", "content": [{"text": "完成した応答"}]}})
+
+    assert consume_agent_stream(lines).text == "完成した応答"
+
+
+def test_consume_agent_stream_raises_on_error_event():
+    """エラーイベントで例外が送出されることを確認"""
+    lines = sse({"delta": "途中"}, {"error": "boom", "error_type": "RuntimeError"})
+
+    with pytest.raises(RuntimeError, match="boom"):
+        consume_agent_stream(lines)
+
+
+def test_first_segment_is_timed_from_request_start():
+    """最初の文までの時間がリクエストの送信時刻から計られることを確認"""
+    started = time.perf_counter() - 0.5
+
+    result = consume_agent_stream(sse({"delta": "はい。"}), started=started)
+
+    assert result.first_segment_ms >= 500
+    assert result.total_ms >= result.first_segment_ms
@@ -0,0 +1,74 @@
+"""
+AWSクライアントのレジストリのテスト
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+import aws_clients
+
+
+def test_clients_are_shared_and_configured():
+    """同じサービスのクライアントが1度だけ生成され、明示した設定を持つことを確認"""
+    aws_clients.clear()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: aws_clients.client("dynamodb"), range(16)))
+
+    assert all(c is clients[0] for c in clients)
+    config = clients[0].meta.config
+    assert config.max_pool_connections == aws_clients.AWS_MAX_POOL_CONNECTIONS
+    assert config.connect_timeout == 2
+    assert config.read_timeout == 5
+    assert config.retries["mode"] == "adaptive"
+    assert config.tcp_keepalive is True
+    assert aws_clients.resource("dynamodb") is aws_clients.resource("dynamodb")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_HEAD(self):
+        _Handler.requests.append(self.command)
+        self.send_response(403)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_prewarm_opens_connection_without_signing():
+    """prewarmが署名なしのHEADでエンドポイントに接続し、応答の内容を問わないことを確認"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        aws_clients.clear()
+        session = aws_clients._get_session()
+        sqs = session.client(
+            "sqs",
+            endpoint_url=f"http://127.0.0.1:{server.server_port}",
+            config=aws_clients.build_config("sqs"),
+        )
+
+        assert aws_clients.prewarm([sqs]) == {"sqs": True}
+        assert _Handler.requests == ["HEAD"]
+    finally:
+        server.shutdown()
+
+
+def test_prewarm_failure_is_not_raised():
+    """接続に失敗してもprewarmが例外を投げないことを確認"""
+    aws_clients.clear()
+    sqs = aws_clients._get_session().client(
+        "sqs", endpoint_url="http://127.0.0.1:9", config=aws_clients.build_config("sqs")
+    )
+
+    with patch("log._sink"):
+        assert aws_clients.prewarm([sqs]) == {"sqs": False}
@@ -0,0 +1,44 @@
+"""
+ホットパスのベンチマーク（benchmarks/bench_hot_path.py）が現在のコードで動くことのテスト
+
+擬似バックエンドの待ち時間を0にし、新しいプロセスで少ない回数だけ実行する
+"""
+import json
+import os
+import subprocess
+import sys
+
+
+BENCH_PATH = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "bench_hot_path.py")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "baseline.json")
+
+
+def run_bench(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, BENCH_PATH, *args],
+        capture_output=True, text=True, timeout=120,
+    )
+
+
+def test_suite_runs_against_fakes():
+    """すべての項目がエラーなく計測されることを確認"""
+    result = run_bench("--iterations", "2", "--latency-scale", "0", "--json")
+
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert set(report["results"]) == {
+        "lambda_handler", "verify_signature", "get_short_term_memory",
+        "get_long_term_memory", "invoke_agent", "analyze_image",
+    }
+    assert all(r["p99_ms"] >= r["p50_ms"] for r in report["results"].values())
+
+
+def test_baseline_covers_every_function():
+    """基準ファイルにすべての項目が記録されていることを確認"""
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    assert set(baseline["results"]) == {
+        "lambda_handler", "verify_signature", "get_short_term_memory",
+        "get_long_term_memory", "invoke_agent", "analyze_image",
+    }
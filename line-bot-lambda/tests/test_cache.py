@@ -0,0 +1,102 @@
+"""
+2層キャッシュのテスト
+"""
+from cache import DynamoDBCacheTier, LocalCacheTier, TTLCache, TwoTierCache, build_shared_tier
+
+
+def test_ttl_cache_expires_entries(clock):
+    """TTLを過ぎたエントリが返されないことを確認"""
+    cache = TTLCache(capacity=10, ttl_seconds=60, clock=clock)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    clock.now += 61
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    """容量を超えると最も古く使われたエントリが外れることを確認"""
+    cache = TTLCache(capacity=2, ttl_seconds=60, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_delete_prefix(clock):
+    """プレフィックス指定で削除できることを確認"""
+    cache = TTLCache(clock=clock)
+    cache.put("x|1", 1)
+    cache.put("x|2", 2)
+    cache.put("y|1", 3)
+
+    assert cache.delete_prefix("x|") == 2
+    assert cache.get("y|1") == 3
+
+
+def test_two_tier_cache_reads_through_shared_tier(clock):
+    """ローカル層にない値を共有層から読み、ローカル層に載せることを確認"""
+    shared = LocalCacheTier(clock=clock)
+    writer = TwoTierCache(TTLCache(clock=clock, ttl_seconds=60), shared)
+    reader = TwoTierCache(TTLCache(clock=clock, ttl_seconds=60), shared)
+
+    writer.put("k", {"v": 1})
+    assert reader.get("k") == {"v": 1}
+    assert reader.shared_hits == 1
+
+    # 2回目はローカル層から返す
+    reads = shared.reads
+    assert reader.get("k") == {"v": 1}
+    assert shared.reads == reads
+
+
+def test_two_tier_cache_keeps_shared_expiry(clock):
+    """共有層から読んだ値は元の期限で失効することを確認"""
+    shared = LocalCacheTier(clock=clock)
+    TwoTierCache(TTLCache(clock=clock, ttl_seconds=60), shared).put("k", 1)
+    clock.now += 50
+    reader = TwoTierCache(TTLCache(clock=clock, ttl_seconds=60), shared)
+
+    assert reader.get("k") == 1
+    clock.now += 11
+    assert reader.get("k") is None
+
+
+def test_two_tier_cache_tolerates_shared_errors(clock):
+    """共有層の障害をキャッシュミスとして扱うことを確認"""
+    class BrokenTier(LocalCacheTier):
+        def get_many(self, keys):
+            raise RuntimeError("down")
+
+        def put(self, key, value, ttl_seconds, stored_at):
+            raise RuntimeError("down")
+
+    cache = TwoTierCache(TTLCache(clock=clock), BrokenTier(clock=clock))
+    cache.put("k", 1)
+    cache.local.clear()
+
+    assert cache.get("k") is None
+    assert cache.stats()["shared_errors"] == 2
+
+
+def test_dynamodb_cache_tier_round_trip(dynamodb, make_table, clock):
+    """DynamoDBの共有層に保存した値が読めることを確認"""
+    make_table("TestCache", "cache_key")
+    tier = DynamoDBCacheTier(dynamodb, "TestCache", clock=clock)
+    tier.put("k", [{"text": "記憶", "score": 0.5}], 60, clock.now)
+
+    assert tier.get_many(["k", "missing"]) == {"k": ([{"text": "記憶", "score": 0.5}], clock.now)}
+    clock.now += 61
+    assert tier.get_many(["k"]) == {}
+
+
+def test_build_shared_tier():
+    """設定値に応じた共有層が生成されることを確認"""
+    assert build_shared_tier(None, "") is None
+    assert isinstance(build_shared_tier(None, "local"), LocalCacheTier)
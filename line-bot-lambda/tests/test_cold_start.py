@@ -0,0 +1,20 @@
+"""
+コールドスタートのテスト（新しいプロセスでimportし、重いモジュールが読み込まれないことを確認）
+
+所要時間・RSSは実行環境で揺れるため、予算の確認は benchmarks/bench_cold_start.py で行う
+"""
+import importlib.util
+import os
+
+
+_spec = importlib.util.spec_from_file_location(
+    "bench_cold_start",
+    os.path.join(os.path.dirname(__file__), "..", "benchmarks", "bench_cold_start.py"),
+)
+bench_cold_start = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_cold_start)
+
+
+def test_heavy_sdks_are_not_imported_at_cold_start():
+    """LINE SDK・Pillowなどの重いモジュールがimport時に読み込まれないことを確認"""
+    assert bench_cold_start.measure_once()[0]["loaded"] == []
@@ -0,0 +1,166 @@
+"""
+続けて送られたテキストメッセージのまとめ処理のテスト
+"""
+import threading
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from debounce import TEXT_BURST_MEMBER_TYPE, Debouncer, coalesce_text_bursts
+from tests.fakes import FakeClock
+
+
+TABLE_NAME = "TestSessions"
+
+
+@pytest.fixture
+def table(make_table):
+    return make_table(TABLE_NAME)
+
+
+def text_event(text, timestamp, user_id="U1", reply_token=None):
+    return {
+        "type": "message",
+        "timestamp": timestamp,
+        "replyToken": reply_token or f"token-{text}",
+        "source": {"type": "user", "userId": user_id},
+        "message": {"type": "text", "text": text},
+    }
+
+
+def session_key_of(event):
+    return event["source"]["userId"]
+
+
+def test_coalesce_merges_burst_into_first_event_with_latest_token():
+    """間隔内に続いたテキストが最初のイベントにまとまり、最新の応答トークンを使うことを確認"""
+    events = [text_event("明日", 1000), text_event("の予定", 2000), text_event("は？", 3500)]
+
+    coalesced = coalesce_text_bursts(events, session_key_of, window_ms=3000)
+
+    assert len(coalesced) == 3
+    assert coalesced[0]["message"]["text"] == "明日\nの予定\nは？"
+    assert coalesced[0]["replyToken"] == "token-は？"
+    assert coalesced[0]["coalescedCount"] == 3
+    assert [e["type"] for e in coalesced[1:]] == [TEXT_BURST_MEMBER_TYPE] * 2
+    # 元のイベントは変更しない
+    assert events[0]["message"]["text"] == "明日"
+
+
+def test_coalesce_keeps_sessions_gaps_and_other_types_apart():
+    """別のセッション・間隔の空いたメッセージ・テキスト以外を挟むメッセージはまとめないことを確認"""
+    image = {
+        "type": "message", "timestamp": 1500, "replyToken": "t",
+        "source": {"type": "user", "userId": "U1"}, "message": {"type": "image", "id": "m"},
+    }
+    events = [
+        text_event("a", 1000),
+        text_event("b", 1100, user_id="U2"),
+        image,
+        text_event("c", 2000),
+        text_event("d", 9000),
+    ]
+
+    assert coalesce_text_bursts(events, session_key_of, window_ms=3000) == events
+    assert coalesce_text_bursts(events[:2], session_key_of, window_ms=0) == events[:2]
+
+
+def test_coalesce_respects_max_messages():
+    events = [text_event(str(i), 1000 + i) for i in range(5)]
+
+    coalesced = coalesce_text_bursts(events, session_key_of, window_ms=3000, max_messages=2)
+
+    assert [e.get("coalescedCount") for e in coalesced] == [2, None, 2, None, None]
+
+
+def make_debouncer(dynamodb, sleep=lambda seconds: None, **kwargs) -> Debouncer:
+    return Debouncer(dynamodb, TABLE_NAME, 2.0, clock=FakeClock(), sleep=sleep, **kwargs)
+
+
+def test_single_message_is_answered_alone(dynamodb, table):
+    debouncer = make_debouncer(dynamodb)
+
+    with debouncer.turn("U1", "こんにちは", "token1") as turn:
+        assert turn.text == "こんにちは"
+        assert turn.reply_token == "token1"
+        assert turn.count == 1
+
+    row = table.get_item(Key={"user_id": "debounce|U1"})["Item"]
+    assert "pending" not in row
+    assert "lock_owner" not in row
+    assert debouncer.stats()["turns"] == 1
+
+
+@pytest.mark.usefixtures("table")
+def test_message_arriving_during_window_takes_over_the_turn(dynamodb):
+    """待っている間に届いたメッセージの呼び出しが、保留中のメッセージをまとめて1回だけ応答することを確認"""
+    second_appended = threading.Event()
+    first_waiting = threading.Event()
+
+    def first_sleep(seconds):
+        first_waiting.set()
+        second_appended.wait(5)
+
+    first = make_debouncer(dynamodb, sleep=first_sleep)
+    second = make_debouncer(dynamodb)
+    results = {}
+
+    def run_first():
+        with first.turn("U1", "明日の", "token1") as turn:
+            results["first"] = turn
+
+    thread = threading.Thread(target=run_first)
+    thread.start()
+    first_waiting.wait(5)
+    with patch.object(second, "sleep", lambda seconds: second_appended.set()):
+        with second.turn("U1", "予定は？", "token2") as turn:
+            results["second"] = turn
+    thread.join(5)
+
+    assert results["second"].text == "明日の\n予定は？"
+    assert results["second"].reply_token == "token2"
+    assert results["second"].count == 2
+    assert results["first"] is None
+    assert first.stats()["merged_into_later"] == 1
+
+
+def test_lock_orders_turns_and_times_out(dynamodb, table):
+    """前のまとまりがロックを持っている間は待ち、待ちきれなければロックなしで応答することを確認"""
+    table.put_item(Item={
+        "user_id": "debounce|U1", "lock_owner": "other", "lock_expires": 1_700_000_030,
+    })
+    debouncer = make_debouncer(dynamodb, lock_wait_seconds=0)
+
+    with debouncer.turn("U1", "こんにちは", "token1") as turn:
+        assert turn.count == 1
+
+    stats = debouncer.stats()
+    assert stats["lock_waits"] == 1
+    assert stats["lock_timeouts"] == 1
+    # 他の呼び出しのロックは解除しない
+    assert table.get_item(Key={"user_id": "debounce|U1"})["Item"]["lock_owner"] == "other"
+
+
+def test_expired_lock_is_taken_over(dynamodb, table):
+    table.put_item(Item={
+        "user_id": "debounce|U1", "lock_owner": "other", "lock_expires": 1_699_999_999,
+    })
+    debouncer = make_debouncer(dynamodb, lock_wait_seconds=0)
+
+    with debouncer.turn("U1", "こんにちは", "token1") as turn:
+        assert turn.count == 1
+
+    assert debouncer.stats()["lock_waits"] == 0
+
+
+@pytest.mark.usefixtures("table")
+def test_append_error_answers_message_alone(dynamodb):
+    """テーブルが使えない場合は、まとめずにそのメッセージだけ応答することを確認"""
+    debouncer = make_debouncer(dynamodb)
+    error = ClientError({"Error": {"Code": "ResourceNotFoundException", "Message": "x"}}, "UpdateItem")
+
+    with patch.object(debouncer.table, "update_item", side_effect=error):
+        with debouncer.turn("U1", "こんにちは", "token1") as turn:
+            assert turn.text == "こんにちは"
+            assert turn.count == 1
@@ -0,0 +1,108 @@
+"""
+イベントキューのテスト
+"""
+import json
+import os
+from unittest.mock import MagicMock
+
+import boto3
+from moto import mock_aws
+
+from event_queue import LambdaAsyncEventQueue, LocalEventQueue, SqsEventQueue
+
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+def make_event(key: str, event_id: str) -> dict:
+    return {
+        "type": "message",
+        "webhookEventId": event_id,
+        "source": {"type": "user", "userId": key},
+        "message": {"type": "text", "text": event_id},
+    }
+
+
+def session_key_of(event: dict) -> str:
+    return event["source"]["userId"]
+
+
+def test_local_queue_drain_passes_worker_payload():
+    """ローカルキューがワーカーLambdaと同じペイロードを渡すことを確認"""
+    local_queue = LocalEventQueue()
+    received = []
+
+    assert local_queue.send([make_event("a", "1"), make_event("b", "2")], session_key_of) == 2
+    assert local_queue.pending() == 1
+
+    assert local_queue.drain(lambda payload, context: received.append(payload)) == 1
+    assert [e["webhookEventId"] for e in received[0]["events"]] == ["1", "2"]
+    assert local_queue.pending() == 0
+
+
+def test_local_queue_background_worker():
+    """バックグラウンドワーカーが投入されたイベントを処理することを確認"""
+    local_queue = LocalEventQueue()
+    received = []
+    local_queue.start(lambda payload, context: received.extend(payload["events"]))
+    try:
+        local_queue.send([make_event("a", "1")], session_key_of)
+        local_queue.send([make_event("a", "2")], session_key_of)
+        local_queue.join()
+    finally:
+        local_queue.stop()
+
+    assert [e["webhookEventId"] for e in received] == ["1", "2"]
+
+
+def test_local_queue_ignores_empty_send():
+    """空のイベントはキューに積まれないことを確認"""
+    local_queue = LocalEventQueue()
+
+    assert local_queue.send([], session_key_of) == 0
+    assert local_queue.pending() == 0
+
+
+def test_sqs_queue_uses_session_key_as_message_group():
+    """SQS FIFOキューにセッションキーをメッセージグループとして投入することを確認"""
+    with mock_aws():
+        sqs = boto3.client("sqs", region_name="us-west-2")
+        queue_url = sqs.create_queue(
+            QueueName="events.fifo",
+            Attributes={"FifoQueue": "true"},
+        )["QueueUrl"]
+
+        events = [make_event(f"user{i % 2}", str(i)) for i in range(12)]
+        assert SqsEventQueue(queue_url, sqs).send(events, session_key_of) == 12
+
+        messages = []
+        while True:
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=10,
+                AttributeNames=["MessageGroupId", "MessageDeduplicationId"],
+            )
+            if not response.get("Messages"):
+                break
+            messages.extend(response["Messages"])
+            for m in response["Messages"]:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=m["ReceiptHandle"])
+
+    assert len(messages) == 12
+    for m in messages:
+        event = json.loads(m["Body"])["event"]
+        assert m["Attributes"]["MessageGroupId"] == event["source"]["userId"]
+        assert m["Attributes"]["MessageDeduplicationId"] == event["webhookEventId"]
+
+
+def test_lambda_async_queue_invokes_worker():
+    """ワーカーLambdaが非同期呼び出しされることを確認"""
+    lambda_client = MagicMock()
+
+    LambdaAsyncEventQueue("worker", lambda_client).send([make_event("a", "1")], session_key_of)
+
+    kwargs = lambda_client.invoke.call_args.kwargs
+    assert kwargs["FunctionName"] == "worker"
+    assert kwargs["InvocationType"] == "Event"
+    assert json.loads(kwargs["Payload"])["events"][0]["webhookEventId"] == "1"
@@ -0,0 +1,136 @@
+"""
+Webhookイベントの重複排除のテスト
+"""
+import threading
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from cache import TTLCache
+from idempotency import IdempotencyStore
+from tests.fakes import FakeClock
+
+
+TABLE_NAME = "TestIdempotency"
+
+
+@pytest.fixture
+def table(make_table):
+    return make_table(TABLE_NAME, "event_id")
+
+
+def make_store(dynamodb, clock=None, table_name=TABLE_NAME) -> IdempotencyStore:
+    clock = clock or FakeClock()
+    return IdempotencyStore(
+        dynamodb, table_name, TTLCache(capacity=100, ttl_seconds=3600, clock=clock),
+        ttl_seconds=86400, lease_seconds=300, clock=clock,
+    )
+
+
+@pytest.mark.usefixtures("table")
+def test_first_claim_wins_and_duplicate_is_local(dynamodb):
+    """最初の確保だけが成功し、同じコンテナの重複はDynamoDBを読まずに捨てられることを確認"""
+    store = make_store(dynamodb)
+
+    assert store.claim("ev1") is True
+    with patch.object(store.table, "put_item") as mock_put:
+        assert store.claim("ev1") is False
+        mock_put.assert_not_called()
+
+    stats = store.stats()
+    assert stats["claims"] == 1
+    assert stats["duplicates"] == 1
+    assert stats["local_duplicates"] == 1
+
+
+@pytest.mark.usefixtures("table")
+def test_duplicate_from_another_container_is_rejected_by_condition(dynamodb):
+    """別のコンテナ（ローカルキャッシュが空）からの確保は条件付き書き込みで拒否されることを確認"""
+    clock = FakeClock()
+    make_store(dynamodb, clock).claim("ev1")
+    other = make_store(dynamodb, clock)
+
+    assert other.claim("ev1") is False
+    assert other.stats()["duplicates"] == 1
+    assert other.stats()["local_duplicates"] == 0
+    # 以後はこのコンテナでもローカルで捨てる
+    assert other.claim("ev1") is False
+    assert other.stats()["local_duplicates"] == 1
+
+
+def test_completed_event_is_kept_for_ttl(dynamodb, table):
+    """処理済みのイベントは保持期間中は確保できず、期限後は確保できることを確認"""
+    clock = FakeClock()
+    store = make_store(dynamodb, clock)
+    store.claim("ev1")
+    store.complete("ev1")
+
+    item = table.get_item(Key={"event_id": "ev1"})["Item"]
+    assert item["status"] == "done"
+    assert int(item["ttl"]) == clock.now + 86400
+
+    clock.now += 86400 + 1
+    assert make_store(dynamodb, clock).claim("ev1") is True
+
+
+@pytest.mark.usefixtures("table")
+def test_expired_lease_can_be_reclaimed(dynamodb):
+    """処理中のまま終わらなかった（タイムアウトなど）イベントは、リースの期限後に確保し直せることを確認"""
+    clock = FakeClock()
+    make_store(dynamodb, clock).claim("ev1")
+
+    assert make_store(dynamodb, clock).claim("ev1") is False
+    clock.now += 301
+    assert make_store(dynamodb, clock).claim("ev1") is True
+
+
+@pytest.mark.usefixtures("table")
+def test_release_allows_retry(dynamodb):
+    """失敗して解除したイベントは再送で確保し直せることを確認"""
+    store = make_store(dynamodb)
+    store.claim("ev1")
+    store.release("ev1")
+
+    assert store.claim("ev1") is True
+    assert make_store(dynamodb).claim("ev1") is False
+
+
+@pytest.mark.usefixtures("table")
+def test_store_errors_fail_open(dynamodb):
+    """DynamoDBのエラー時は確保できたものとして処理を続けることを確認"""
+    store = make_store(dynamodb)
+    error = ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "PutItem")
+
+    with patch.object(store.table, "put_item", side_effect=error):
+        assert store.claim("ev1") is True
+
+    assert store.stats()["errors"] == 1
+
+
+def test_local_only_store_rejects_concurrent_duplicates():
+    """テーブル未設定でも、同じコンテナに同時に届いた重複は1件だけ処理されることを確認"""
+    store = make_store(None, table_name="")
+    barrier = threading.Barrier(8)
+    results = []
+
+    def claim():
+        barrier.wait()
+        results.append(store.claim("ev1"))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count(True) == 1
+
+
+def test_avoided_calls_are_summed():
+    """省略できた外部呼び出しが種類ごとに加算されることを確認"""
+    store = make_store(None, table_name="")
+    store.record_avoided({"agent_invocations": 1, "replies": 1})
+    store.record_avoided({"vision_calls": 1, "replies": 1})
+
+    assert store.stats()["avoided"] == {"agent_invocations": 1, "vision_calls": 1, "replies": 2}
@@ -0,0 +1,43 @@
+"""
+画像分析結果のキャッシュのテスト
+"""
+from cache import LocalCacheTier, TTLCache, TwoTierCache
+from image_cache import ImageAnalysisCache, fingerprint
+
+
+def make_cache(shared=None, settings=fingerprint("model", "prompt")) -> ImageAnalysisCache:
+    return ImageAnalysisCache(TwoTierCache(TTLCache(ttl_seconds=3600), shared), settings)
+
+
+def test_same_image_bytes_hit_cache():
+    """同じバイト列の画像がヒットし、異なる画像はミスになることを確認"""
+    cache = make_cache()
+    cache.put(cache.key(b"notice"), "学校からのお知らせです")
+
+    assert cache.get(cache.key(b"notice")) == "学校からのお知らせです"
+    assert cache.get(cache.key(b"other")) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_settings_change_uses_different_key():
+    """モデルやプロンプトが変わると古い分析結果を使わないことを確認"""
+    shared = LocalCacheTier()
+    old = make_cache(shared)
+    old.put(old.key(b"notice"), "old")
+
+    new = make_cache(shared, fingerprint("model", "new prompt"))
+
+    assert new.get(new.key(b"notice")) is None
+
+
+def test_shared_tier_serves_other_containers():
+    """別のコンテナで分析した画像が共有層からヒットすることを確認"""
+    shared = LocalCacheTier()
+    first = make_cache(shared)
+    first.put(first.key(b"screenshot"), "スクリーンショットです")
+
+    second = make_cache(shared)
+
+    assert second.get(second.key(b"screenshot")) == "スクリーンショットです"
+    assert second.stats()["shared_hits"] == 1
@@ -0,0 +1,112 @@
+"""
+画像前処理のテスト
+"""
+import base64
+import io
+import json
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import image_preprocess
+from image_preprocess import (
+    ImageTooLargeError,
+    PreparedImage,
+    build_vision_body,
+    preprocess_image,
+    sniff_media_type,
+)
+
+
+def make_image(fmt: str, size=(4032, 3024), mode="RGB", exif_orientation=None) -> bytes:
+    image = Image.new(mode, size, (200, 120, 40) if mode == "RGB" else (200, 120, 40, 128))
+    buffer = io.BytesIO()
+    kwargs = {}
+    if exif_orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = exif_orientation
+        exif[0x010F] = "TestCamera"
+        kwargs["exif"] = exif.tobytes()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def test_sniff_media_type():
+    """先頭バイトから実際のメディアタイプが判定されることを確認"""
+    assert sniff_media_type(make_image("JPEG", (10, 10))) == "image/jpeg"
+    assert sniff_media_type(make_image("PNG", (10, 10))) == "image/png"
+    assert sniff_media_type(make_image("GIF", (10, 10))) == "image/gif"
+    assert sniff_media_type(make_image("WEBP", (10, 10))) == "image/webp"
+    assert sniff_media_type(b"not an image") is None
+
+
+def test_large_photo_is_downscaled():
+    """スマートフォンの写真が長辺の上限まで縮小されることを確認"""
+    prepared = preprocess_image(make_image("JPEG"), max_long_edge=1568)
+
+    assert prepared.media_type == "image/jpeg"
+    assert max(prepared.width, prepared.height) <= 1568
+    with Image.open(io.BytesIO(prepared.data)) as image:
+        assert max(image.size) <= 1568
+
+
+def test_metadata_is_stripped_and_orientation_applied():
+    """EXIFが除去され、向きが画素に反映されることを確認"""
+    # Orientation=6（90度回転）
+    data = make_image("JPEG", (400, 200), exif_orientation=6)
+
+    prepared = preprocess_image(data)
+
+    with Image.open(io.BytesIO(prepared.data)) as image:
+        assert image.size == (200, 400)
+        assert not image.getexif()
+
+
+def test_png_with_transparency_stays_png():
+    """透過のあるPNGがPNGのまま保たれることを確認"""
+    prepared = preprocess_image(make_image("PNG", (300, 200), mode="RGBA"))
+
+    assert prepared.media_type == "image/png"
+
+
+def test_opaque_png_is_labelled_correctly():
+    """透過のない画像はJPEGに再エンコードされ、メディアタイプも一致することを確認"""
+    prepared = preprocess_image(make_image("PNG", (300, 200)))
+
+    assert prepared.media_type == sniff_media_type(prepared.data) == "image/jpeg"
+
+
+def test_input_size_is_capped():
+    """入力サイズの上限を超える画像が拒否されることを確認"""
+    with pytest.raises(ImageTooLargeError):
+        preprocess_image(b"\xff\xd8\xff" + b"\x00" * 100, max_input_bytes=10)
+
+
+def test_without_pillow_passes_through_with_sniffed_type():
+    """Pillowがない場合は判定したメディアタイプでそのまま渡すことを確認"""
+    data = make_image("PNG", (10, 10))
+
+    with patch.object(image_preprocess, "_load_pillow", return_value=None):
+        prepared = preprocess_image(data)
+
+    assert prepared.data == data
+    assert prepared.media_type == "image/png"
+    assert not prepared.reencoded
+
+
+def test_build_vision_body_embeds_base64_images():
+    """組み立てたボディが有効なJSONで、画像がbase64で埋め込まれることを確認"""
+    images = [
+        PreparedImage(data=b"\x01\x02", media_type="image/jpeg", original_bytes=2),
+        PreparedImage(data=b"\x03", media_type="image/png", original_bytes=1),
+    ]
+
+    body = json.loads(build_vision_body(images, "説明して", system="システム"))
+
+    content = body["messages"][0]["content"]
+    assert base64.b64decode(content[0]["source"]["data"]) == b"\x01\x02"
+    assert content[1]["source"]["media_type"] == "image/png"
+    assert base64.b64decode(content[1]["source"]["data"]) == b"\x03"
+    assert content[2] == {"type": "text", "text": "説明して"}
+    assert body["system"] == "システム"
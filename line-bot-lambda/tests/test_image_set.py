@@ -0,0 +1,65 @@
+"""
+複数枚同時に送信された画像のまとめ処理のテスト
+"""
+from image_set import IMAGE_SET_MEMBER_TYPE, IMAGE_SET_TYPE, coalesce_image_sets
+
+
+def image_event(message_id: str, set_id=None, index=None, user_id="user_a", reply_token=None):
+    message = {"type": "image", "id": message_id}
+    if set_id:
+        message["imageSet"] = {"id": set_id, "index": index, "total": 3}
+    return {
+        "type": "message",
+        "replyToken": reply_token or f"token_{message_id}",
+        "source": {"type": "user", "userId": user_id},
+        "message": message,
+    }
+
+
+def test_images_in_same_set_are_coalesced():
+    """同じimageSetの画像がindex順に1つのイベントへまとめられることを確認"""
+    events = [
+        image_event("m2", "set1", 2),
+        image_event("m1", "set1", 1),
+        image_event("m3", "set1", 3),
+    ]
+
+    coalesced = coalesce_image_sets(events)
+
+    assert len(coalesced) == 3
+    assert coalesced[0]["message"]["type"] == IMAGE_SET_TYPE
+    assert coalesced[0]["message"]["imageIds"] == ["m1", "m2", "m3"]
+    assert coalesced[0]["replyToken"] == "token_m2"
+    assert [e["type"] for e in coalesced[1:]] == [IMAGE_SET_MEMBER_TYPE] * 2
+    # 元のイベントは変更しない
+    assert events[0]["message"]["type"] == "image"
+
+
+def test_other_events_are_left_unchanged():
+    """imageSetを持たない画像や単独の画像、他の種類のイベントはそのまま残ることを確認"""
+    text = {"type": "message", "source": {"userId": "user_a"}, "message": {"type": "text", "text": "hi"}}
+    events = [image_event("m1"), image_event("m2", "set1", 1), text]
+
+    assert coalesce_image_sets(events) == events
+
+
+def test_sets_are_not_merged_across_chats():
+    """同じimageSet IDでも送信元が異なれば別々に扱うことを確認"""
+    events = [
+        image_event("m1", "set1", 1, user_id="user_a"),
+        image_event("m2", "set1", 2, user_id="user_b"),
+    ]
+
+    assert coalesce_image_sets(events) == events
+
+
+def test_large_sets_are_split():
+    """上限を超える枚数は複数のまとまりに分けられることを確認"""
+    events = [image_event(f"m{i}", "set1", i) for i in range(1, 6)]
+
+    coalesced = coalesce_image_sets(events, max_images=2)
+
+    leaders = [e["message"]["imageIds"] for e in coalesced if e["message"]["type"] == IMAGE_SET_TYPE]
+    assert leaders == [["m1", "m2"], ["m3", "m4"]]
+    # 余った1枚は通常の画像イベントとして処理する
+    assert coalesced[4] == events[4]
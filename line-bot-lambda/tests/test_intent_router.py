@@ -0,0 +1,72 @@
+"""
+メッセージのルーティングのテスト
+"""
+import json
+import os
+
+import pytest
+
+from intent_router import IntentRouter, Route
+
+
+ROUTES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "routes.json")
+
+
+@pytest.fixture
+def router():
+    return IntentRouter.from_file(ROUTES_PATH)
+
+
+def test_bundled_routes_answer_trivial_intents(router):
+    """同梱のルート定義で、スタンプ・ヘルプ・リセットがエージェントを呼ばないルートになることを確認"""
+    assert router.route("sticker").action == "reply"
+    assert router.route("text", "ヘルプ").name == "help"
+    assert router.route("text", "  Help！ ").name == "help"
+    assert router.route("text", "リセット").action == "reset_session"
+
+
+def test_unmatched_messages_fall_back_to_defaults(router):
+    assert router.route("text", "明日の持ち物は？").name == "text"
+    assert router.route("text", "ヘルプの使い方を教えて").name == "text"
+    assert router.route("location").action == "ignore"
+
+
+def test_follow_up_skips_long_term_memory(router):
+    route = router.route("text", "続けて")
+    assert route.action == "agent"
+    assert route.short_term_memory is True
+    assert route.long_term_memory is False
+
+
+def test_first_matching_route_wins(tmp_path):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"routes": [
+        {"name": "first", "patterns": ["予定"], "action": "reply", "reply": "1"},
+        {"name": "second", "patterns": ["明日"], "action": "reply", "reply": "2"},
+    ]}))
+    router = IntentRouter.from_file(str(path))
+
+    assert router.route("text", "明日の予定").name == "first"
+    # パターンだけのルートはテキスト以外に一致しない
+    assert router.route("sticker").name == "unsupported"
+
+
+@pytest.mark.parametrize("data", [
+    {"name": "bad", "action": "forward"},
+    {"name": "empty", "action": "reply"},
+])
+def test_invalid_route_is_rejected(data):
+    with pytest.raises(ValueError):
+        Route.from_dict(data)
+
+
+def test_stats_are_recorded_per_route():
+    router = IntentRouter([])
+    router.record("text", 120.0)
+    router.record("text", 80.0)
+    router.record("unsupported", 0.5)
+
+    stats = router.stats()
+
+    assert stats["text"] == {"count": 2, "avg_ms": 100.0, "max_ms": 120.0}
+    assert stats["unsupported"]["count"] == 1
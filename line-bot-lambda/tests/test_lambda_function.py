@@ -17,6 +17,10 @@ os.environ["LINE_CHANNEL_ACCESS_TOKEN"] = "test_access_token"
 os.environ["LINE_CHANNEL_SECRET"] = "test_channel_secret"
 os.environ["AGENT_RUNTIME_ARN"] = "arn:aws:bedrock-agentcore:us-west-2:000000000000:runtime/test-agent"
 os.environ["SESSION_TABLE_NAME"] = "TestLineAgentSessions"
+# モジュール読み込み時に生成されるAWSクライアント用のダミー認証情報（motoで使用）
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
 
 # テスト用にモジュールをインポート
 import lambda_function
@@ -34,6 +38,8 @@ def mock_dynamodb():
             AttributeDefinitions=[{"AttributeName": "user_id", "AttributeType": "S"}],
             BillingMode="PAY_PER_REQUEST",
         )
+        # テスト間でウォームコンテナのキャッシュを持ち越さない
+        lambda_function.session_manager.clear()
         yield table
 
 
@@ -190,7 +196,7 @@ def test_invoke_agent_error(mock_bedrock_client):
     assert "エラーが発生しました" in response
 
 
-@patch("lambda_function.MessagingApi")
+@patch("linebot.v3.messaging.MessagingApi")
 def test_reply_message_success(mock_messaging_api):
     """LINE Reply APIが正しく呼び出されることを確認"""
     mock_api_instance = MagicMock()
@@ -245,8 +251,9 @@ def test_handle_event_non_message_event():
     lambda_function.handle_event(event)
 
 
+@patch("lambda_function.prefetch_sessions")
 @patch("lambda_function.handle_event")
-def test_lambda_handler_multiple_events(mock_handle_event):
+def test_lambda_handler_multiple_events(mock_handle_event, mock_prefetch):
     """複数のイベントが処理されることを確認"""
     events = [
         {
@@ -275,3 +282,868 @@ def test_lambda_handler_multiple_events(mock_handle_event):
     
     assert response["statusCode"] == 200
     assert mock_handle_event.call_count == 2
+
+
+@patch("lambda_function.RESPONSE_CACHE_ENABLED", False)
+@patch("lambda_function.reply_message")
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.invoke_agent")
+@patch("lambda_function.get_long_term_memory")
+@patch("lambda_function.get_short_term_memory")
+@patch("lambda_function.get_or_create_session")
+def test_handle_event_fetches_memory_concurrently(
+    mock_get_session, mock_short_term, mock_long_term, mock_invoke, mock_save, mock_reply,
+):
+    """長期記憶の検索がセッション取得と並列に実行されることを確認"""
+    import threading
+
+    event = {
+        "type": "message",
+        "replyToken": "test_reply_token",
+        "source": {"type": "user", "userId": "test_user_id"},
+        "message": {"type": "text", "text": "こんにちは"},
+    }
+
+    long_term_started = threading.Event()
+
+    def get_session(session_key):
+        # 長期記憶の検索が始まるまでセッション取得を終えない
+        assert long_term_started.wait(timeout=2)
+        return "test_session_id"
+
+    def get_long_term(actor_id, query):
+        long_term_started.set()
+        return "長期記憶"
+
+    mock_get_session.side_effect = get_session
+    mock_long_term.side_effect = get_long_term
+    mock_short_term.return_value = "短期記憶"
+    mock_invoke.return_value = "エージェントの応答"
+
+    lambda_function.handle_event(event)
+
+    mock_short_term.assert_called_once_with("test_user_id", "test_session_id")
+    mock_invoke.assert_called_once_with("test_session_id", "こんにちは", "短期記憶", "長期記憶")
+    mock_reply.assert_called_once_with("test_reply_token", "エージェントの応答")
+
+
+def test_prefetch_sessions_skips_get_item(mock_dynamodb):
+    """先読みしたセッションはget_itemなしで利用されることを確認"""
+    import time
+    mock_dynamodb.put_item(
+        Item={"user_id": "user_a", "session_id": "session_a", "ttl": int(time.time()) + 86400}
+    )
+
+    lambda_function.prefetch_sessions(["user_a", "user_b", "user_a"])
+
+    with patch.object(lambda_function.session_manager.table, "get_item") as mock_get_item:
+        assert lambda_function.get_or_create_session("user_a") == "session_a"
+        new_session_id = lambda_function.get_or_create_session("user_b")
+        # 2回目は作成済みのセッションをキャッシュから使う
+        assert lambda_function.get_or_create_session("user_b") == new_session_id
+        assert not mock_get_item.called
+
+
+@patch("lambda_function.prefetch_sessions")
+@patch("lambda_function.handle_event")
+def test_lambda_handler_reports_processed_events(mock_handle_event, mock_prefetch):
+    """処理したイベント数が返され、セッションが一括で先読みされることを確認"""
+    events = [
+        {"type": "message", "message": {"type": "text", "text": "1"},
+         "source": {"type": "group", "groupId": "g1", "userId": "u1"}, "replyToken": "t1"},
+        {"type": "message", "message": {"type": "text", "text": "2"},
+         "source": {"type": "group", "groupId": "g1", "userId": "u2"}, "replyToken": "t2"},
+        {"type": "follow", "source": {"type": "user", "userId": "u3"}, "replyToken": "t3"},
+    ]
+    body = json.dumps({"events": events})
+    event = {"headers": {"x-line-signature": create_signature(body)}, "body": body}
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["processed"] == 3
+    mock_prefetch.assert_called_once_with(["g1", "g1"])
+    assert mock_handle_event.call_count == 3
+
+
+@patch("lambda_function.handle_event")
+def test_async_mode_acknowledges_then_worker_processes(mock_handle_event, lambda_event):
+    """非同期モードでは即座に200を返し、ワーカーがイベントを処理することを確認"""
+    from event_queue import LocalEventQueue
+
+    local_queue = LocalEventQueue()
+    with patch.object(lambda_function, "PROCESSING_MODE", "async"), \
+            patch.object(lambda_function, "_event_queue", local_queue):
+        response = lambda_function.lambda_handler(lambda_event, None)
+
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"])["queued"] == 1
+        assert not mock_handle_event.called
+
+        local_queue.drain(lambda_function.worker_handler)
+
+    mock_handle_event.assert_called_once()
+
+
+@patch("lambda_function.handle_event")
+def test_worker_handler_reports_sqs_failures(mock_handle_event):
+    """失敗したメッセージと同じグループの後続メッセージが再試行対象になることを確認"""
+    def handle(event):
+        if event["message"]["text"] == "fail":
+            raise RuntimeError("boom")
+
+    mock_handle_event.side_effect = handle
+
+    def record(message_id, group_id, text):
+        event = {
+            "type": "message",
+            "message": {"type": "text", "text": text},
+            "source": {"type": "user", "userId": group_id},
+            "replyToken": message_id,
+        }
+        return {
+            "messageId": message_id,
+            "body": json.dumps({"event": event}),
+            "attributes": {"MessageGroupId": group_id},
+        }
+
+    with patch.object(lambda_function, "WEBHOOK_BATCH_MODE", False):
+        result = lambda_function.worker_handler({"Records": [
+            record("m1", "a", "fail"),
+            record("m2", "b", "ok"),
+            record("m3", "a", "ok"),
+        ]}, None)
+
+    assert result["batchItemFailures"] == [{"itemIdentifier": "m1"}, {"itemIdentifier": "m3"}]
+
+
+@patch("lambda_function.handle_event")
+def test_async_worker_requeues_only_failed_events(mock_handle_event):
+    """非同期呼び出しのワーカーは例外で全体を再試行させず、失敗したセッションのイベントだけを送り直すことを確認"""
+    def handle(event):
+        if event["message"]["text"] == "fail":
+            raise RuntimeError("boom")
+
+    mock_handle_event.side_effect = handle
+
+    def make(user, text, **extra):
+        return {
+            "type": "message",
+            "message": {"type": "text", "text": text},
+            "source": {"type": "user", "userId": user},
+            "replyToken": text,
+            **extra,
+        }
+
+    queue = MagicMock()
+    with patch.object(lambda_function, "WEBHOOK_BATCH_MODE", False), \
+            patch.object(lambda_function, "MESSAGE_COALESCE_WINDOW_MS", 0), \
+            patch.object(lambda_function, "_event_queue", queue):
+        result = lambda_function.worker_handler(
+            {"events": [make("a", "fail"), make("b", "ok"), make("a", "later")]}, None
+        )
+        lambda_function.worker_handler(
+            {"events": [make("c", "fail", workerAttempt=lambda_function.WORKER_MAX_ATTEMPTS)]}, None
+        )
+
+    assert result["failed"] == 1
+    queue.send.assert_called_once()
+    resent = queue.send.call_args.args[0]
+    assert [e["message"]["text"] for e in resent] == ["fail", "later"]
+    assert all(e["workerAttempt"] == 2 for e in resent)
+
+
+@patch("lambda_function.bedrock_client")
+def test_invoke_agent_streaming(mock_bedrock_client):
+    """ストリーミング応答が逐次解析されることを確認"""
+    lines = []
+    for delta in ["こんにちは！", "元気ですよ。"]:
+        lines.append(f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}".encode("utf-8"))
+        lines.append(b"")
+    mock_response_body = MagicMock()
+    mock_response_body.iter_lines.return_value = iter(lines)
+    mock_bedrock_client.invoke_agent_runtime.return_value = {
+        "contentType": "text/event-stream",
+        "response": mock_response_body,
+    }
+    import metrics
+
+    with metrics.capture() as documents:
+        with metrics.event_metrics("text", "user"):
+            response = lambda_function.invoke_agent("test_session", "こんにちは")
+
+    assert response == "こんにちは！元気ですよ。"
+    assert documents[0]["AgentFirstSegment"] <= documents[0]["Agent"]
+    payload = json.loads(mock_bedrock_client.invoke_agent_runtime.call_args.kwargs["payload"])
+    assert payload["stream"] is True
+
+
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.SHORT_TERM_BUFFER_ENABLED", False)
+@patch("lambda_function.bedrock_client")
+def test_get_long_term_memory_uses_cache(mock_bedrock_client):
+    """同じ質問の2回目は、間に会話の保存があってもセマンティック検索を省略することを確認"""
+    lambda_function.ltm_cache.cache.local.clear()
+    mock_bedrock_client.retrieve_memory_records.return_value = {
+        "memoryRecordSummaries": [{"content": {"text": "長男はサッカー部"}, "score": 0.9}]
+    }
+
+    import metrics
+
+    with metrics.capture() as documents:
+        with metrics.event_metrics("text", "user"):
+            first = lambda_function.get_long_term_memory("actor_cache", "部活は何？")
+        with metrics.event_metrics("text", "user"):
+            second = lambda_function.get_long_term_memory("actor_cache", "部活は何")
+
+    assert first == second
+    assert "長男はサッカー部" in first
+    # facts/preferencesの2名前空間 × 1回
+    assert mock_bedrock_client.retrieve_memory_records.call_count == 2
+    assert [d["LongTermMemoryCacheHit"] for d in documents] == [0, 1]
+
+    lambda_function.save_conversation("actor_cache", "session", "質問", "回答")
+    lambda_function.flush_memory_writes()
+    lambda_function.get_long_term_memory("actor_cache", "部活は何")
+    assert mock_bedrock_client.retrieve_memory_records.call_count == 2
+
+
+@patch("lambda_function.SHORT_TERM_BUFFER_ENABLED", False)
+@patch("lambda_function.RESPONSE_CACHE_ENABLED", False)
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.invoke_agent", return_value="サッカー部です")
+@patch("lambda_function.get_short_term_memory", return_value="")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+@patch("lambda_function.bedrock_client")
+def test_repeated_question_across_webhooks_uses_ltm_cache(
+    mock_bedrock_client, mock_session, mock_stm, mock_invoke, mock_reply
+):
+    """返信・会話の保存を挟んだ次のWebhookでも、同じ質問はセマンティック検索を省略することを確認"""
+    lambda_function.ltm_cache.cache.local.clear()
+    mock_bedrock_client.retrieve_memory_records.return_value = {
+        "memoryRecordSummaries": [{"content": {"text": "長男はサッカー部"}, "score": 0.9}]
+    }
+    event = {
+        "type": "message",
+        "replyToken": "t",
+        "source": {"type": "user", "userId": "ltm_webhook_user"},
+        "message": {"type": "text", "text": "長男の部活は？"},
+    }
+
+    for _ in range(3):
+        lambda_function.process_webhook_events([dict(event)])
+
+    # facts/preferencesの2名前空間 × 最初の1回だけ
+    assert mock_bedrock_client.retrieve_memory_records.call_count == 2
+    assert mock_bedrock_client.create_event.call_count == 3
+
+
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.bedrock_client")
+def test_get_long_term_memory_merges_namespaces(mock_bedrock_client):
+    """名前空間の結果がスコア順に統合され、重複が除かれることを確認"""
+    lambda_function.ltm_cache.cache.local.clear()
+    responses = {
+        "/family/actor_merge/facts/": [
+            {"content": {"text": "長女はピアノを習っている"}, "score": 0.4},
+            {"content": {"text": "長男はサッカー部"}, "score": 0.9},
+        ],
+        "/family/actor_merge/preferences/": [
+            {"content": {"text": "長男はサッカー部。"}, "score": 0.5},
+            {"content": {"text": "辛い料理が苦手"}, "score": 0.6},
+        ],
+    }
+    mock_bedrock_client.retrieve_memory_records.side_effect = (
+        lambda **kwargs: {"memoryRecordSummaries": responses[kwargs["namespace"]]}
+    )
+
+    result = lambda_function.get_long_term_memory("actor_merge", "家族のこと")
+
+    assert result.split("\n") == ["長男はサッカー部", "辛い料理が苦手", "長女はピアノを習っている"]
+
+
+@patch("lambda_function.aws_clients")
+@patch("linebot.v3.messaging.MessagingApiBlob")
+def test_analyze_image_reuses_cached_analysis(mock_blob_api, mock_aws_clients):
+    """転送された同じ画像はvisionを呼ばずにキャッシュから応答することを確認"""
+    import io
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (10, 20, 30)).save(buffer, format="PNG")
+    mock_blob_api.return_value.get_message_content.return_value = buffer.getvalue()
+    mock_runtime = mock_aws_clients.client.return_value
+    mock_runtime.invoke_model.side_effect = lambda **kwargs: {
+        "body": MagicMock(read=Mock(return_value=json.dumps({"content": [{"text": "お知らせの画像です"}]})))
+    }
+    lambda_function.image_cache.cache.local.clear()
+    import metrics
+
+    with metrics.capture() as documents:
+        for message_id in ("message_1", "message_2"):
+            with metrics.event_metrics("image", "user"):
+                result = lambda_function.analyze_image(message_id)
+            assert result == "お知らせの画像です"
+
+    assert mock_runtime.invoke_model.call_count == 1
+    assert [d["ImageCacheHit"] for d in documents] == [0, 1]
+
+
+@patch("lambda_function.reply_message")
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.get_or_create_session", return_value="session")
+@patch("lambda_function.analyze_images", return_value="3枚の写真です")
+def test_image_set_is_analyzed_once(mock_analyze, mock_session, mock_save, mock_reply):
+    """同時に送信された複数枚の画像が1回の分析と1回の応答にまとめられることを確認"""
+    events = [
+        {
+            "type": "message",
+            "replyToken": f"token_{i}",
+            "source": {"type": "user", "userId": "test_user_id"},
+            "message": {"type": "image", "id": f"m{i}", "imageSet": {"id": "set1", "index": i, "total": 3}},
+        }
+        for i in (1, 2, 3)
+    ]
+
+    report = lambda_function.process_webhook_events(events)
+
+    assert report.processed == 3 and report.failed == 0
+    mock_analyze.assert_called_once_with(["m1", "m2", "m3"])
+    mock_reply.assert_called_once_with("token_1", "3枚の写真です")
+    mock_save.assert_called_once_with("test_user_id", "session", "[画像を3枚送信]", "3枚の写真です")
+
+
+@patch("lambda_function.aws_clients")
+@patch("lambda_function.download_image")
+def test_analyze_images_sends_one_request(mock_download, mock_aws_clients):
+    """複数枚の画像が1回のvisionリクエストにまとめて送られることを確認"""
+    import io
+    from PIL import Image
+
+    def make(color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 32), color).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    images = {"m1": make((255, 0, 0)), "m2": make((0, 255, 0))}
+    mock_download.side_effect = images.get
+    mock_runtime = mock_aws_clients.client.return_value
+    mock_runtime.invoke_model.return_value = {
+        "body": MagicMock(read=Mock(return_value=json.dumps({"content": [{"text": "2枚の画像です"}]})))
+    }
+
+    assert lambda_function.analyze_images(["m1", "m2"]) == "2枚の画像です"
+
+    mock_runtime.invoke_model.assert_called_once()
+    body = json.loads(mock_runtime.invoke_model.call_args.kwargs["body"])
+    assert [c["type"] for c in body["messages"][0]["content"]] == ["image", "image", "text"]
+
+
+@patch("lambda_function.RESPONSE_CACHE_ENABLED", False)
+@patch("lambda_function.reply_message")
+@patch("lambda_function.invoke_agent", return_value="エージェントの応答")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_handle_event_emits_stage_metrics(mock_get_session, mock_invoke, mock_reply):
+    """イベントごとにステージの所要時間がEMFで1件出力されることを確認"""
+    import metrics
+
+    event = {
+        "type": "message",
+        "replyToken": "test_reply_token",
+        "source": {"type": "group", "groupId": "group_1", "userId": "test_user_id"},
+        "message": {"type": "text", "text": "こんにちは"},
+    }
+
+    with metrics.capture() as documents:
+        lambda_function.handle_event(event)
+
+    assert len(documents) == 1
+    document = documents[0]
+    assert document["MessageType"] == "text"
+    assert document["SourceType"] == "group"
+    names = {m["Name"] for m in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+    # ステージのスレッドで計測した値も同じイベントに集計される
+    assert {"ShortTermMemory", "LongTermMemory", "EventLatency"} <= names
+    # 会話の保存は返信後に別のドキュメントで計測する
+    assert "SaveConversation" not in names
+    assert document["Errors"] == 0
+
+
+@patch("lambda_function.handle_event")
+def test_lambda_handler_accepts_base64_body(mock_handle_event, lambda_event):
+    """isBase64Encoded のボディも署名検証・処理されることを確認"""
+    raw = lambda_event["body"].encode("utf-8")
+    event = {
+        "headers": lambda_event["headers"],
+        "body": base64.b64encode(raw).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    mock_handle_event.assert_called_once()
+
+
+@patch("lambda_function.verify_signature")
+def test_lambda_handler_rejects_oversized_body(mock_verify):
+    """上限を超えるボディは署名検証の前に413で拒否されることを確認"""
+    body = json.dumps({"events": [], "padding": "x" * lambda_function.WEBHOOK_MAX_BODY_BYTES})
+
+    response = lambda_function.lambda_handler({"headers": {"x-line-signature": "sig"}, "body": body}, None)
+
+    assert response["statusCode"] == 413
+    mock_verify.assert_not_called()
+
+
+def test_lambda_handler_rejects_invalid_json():
+    """署名が正しくてもJSONとして不正なボディは400になることを確認"""
+    body = "{not json"
+    event = {"headers": {"x-line-signature": create_signature(body)}, "body": body}
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+
+
+@patch("lambda_function.prefetch_sessions")
+@patch("lambda_function.handle_event")
+def test_redelivered_event_is_processed_once(mock_handle_event, mock_prefetch):
+    """同じwebhookEventIdの再送は処理されず、省略できた呼び出しが集計されることを確認"""
+    event = {
+        "type": "message",
+        "webhookEventId": "01REDELIVERYTEST",
+        "message": {"type": "text", "text": "こんにちは"},
+        "source": {"type": "user", "userId": "u1"},
+        "replyToken": "t1",
+    }
+    redelivered = {**event, "deliveryContext": {"isRedelivery": True}}
+    store = lambda_function.idempotency_store
+    before = store.stats()
+
+    lambda_function.process_webhook_events([event])
+    report = lambda_function.process_webhook_events([redelivered])
+
+    assert report.processed == 1
+    assert mock_handle_event.call_count == 1
+    after = store.stats()
+    assert after["duplicates"] == before["duplicates"] + 1
+    assert after["redeliveries"] == before["redeliveries"] + 1
+    assert after["avoided"]["agent_invocations"] == before["avoided"].get("agent_invocations", 0) + 1
+
+
+@patch("lambda_function.handle_event")
+def test_failed_event_returns_200_and_can_be_retried(mock_handle_event):
+    """イベントの処理に失敗しても200を返し、確保が解除されて再送で処理し直せることを確認"""
+    event = {
+        "type": "message",
+        "webhookEventId": "01FAILEDEVENTTEST",
+        "message": {"type": "text", "text": "こんにちは"},
+        "source": {"type": "user", "userId": "u1"},
+        "replyToken": "t1",
+    }
+    body = json.dumps({"events": [event]})
+    request = {"headers": {"x-line-signature": create_signature(body)}, "body": body}
+    mock_handle_event.side_effect = [RuntimeError("boom"), None]
+
+    response = lambda_function.lambda_handler(request, None)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["failed"] == 1
+    lambda_function.lambda_handler(request, None)
+    assert mock_handle_event.call_count == 2
+
+
+@patch("lambda_function.prefetch_sessions")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.invoke_agent", return_value="エージェントの応答")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_text_burst_is_answered_once(mock_session, mock_invoke, mock_save, mock_reply, mock_prefetch):
+    """続けて送られたテキストが1回のエージェント呼び出し・最新の応答トークンでの1回の返信にまとまることを確認"""
+    events = [
+        {
+            "type": "message",
+            "timestamp": 1_700_000_000_000 + i * 500,
+            "message": {"type": "text", "text": text},
+            "source": {"type": "user", "userId": "burst_user"},
+            "replyToken": f"t{i}",
+        }
+        for i, text in enumerate(["明日の", "予定は？"])
+    ]
+
+    report = lambda_function.process_webhook_events(events)
+
+    assert report.processed == 2
+    mock_invoke.assert_called_once()
+    assert mock_invoke.call_args.args[1] == "明日の\n予定は？"
+    mock_reply.assert_called_once_with("t1", "エージェントの応答")
+
+
+@patch("lambda_function.DEBOUNCE_WINDOW_MS", 1000)
+@patch("lambda_function.push_message")
+@patch("lambda_function.reply_message", return_value=False)
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.invoke_agent", return_value="エージェントの応答")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_debounced_turn_falls_back_to_push(mock_session, mock_invoke, mock_save, mock_reply, mock_push):
+    """待ったあとに応答トークンで返信できなければ、プッシュメッセージで送ることを確認"""
+    from debounce import Turn
+
+    event = {
+        "type": "message",
+        "message": {"type": "text", "text": "こんにちは"},
+        "source": {"type": "user", "userId": "debounce_user"},
+        "replyToken": "t1",
+    }
+    turn = Turn(text="こんにちは\n元気？", reply_token="t2", count=2, waited_ms=1000.0)
+
+    with patch.object(lambda_function.debouncer, "turn") as mock_turn:
+        mock_turn.return_value.__enter__.return_value = turn
+        lambda_function.handle_event(event, debounce=True)
+
+    mock_turn.assert_called_once_with("debounce_user", "こんにちは", "t1")
+    assert mock_invoke.call_args.args[1] == "こんにちは\n元気？"
+    mock_reply.assert_called_once_with("t2", "エージェントの応答")
+    mock_push.assert_called_once_with("debounce_user", "エージェントの応答")
+
+
+@patch("lambda_function.DEBOUNCE_WINDOW_MS", 1000)
+@patch("lambda_function.push_message")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.get_or_create_session", return_value="session")
+@patch("lambda_function.analyze_images", return_value="2枚の写真です")
+def test_image_set_across_webhooks_is_collected(mock_analyze, mock_session, mock_save, mock_reply, mock_push):
+    """別のWebhookで届いた同じimageSetの画像を待ってまとめ、1回の分析と1回の応答にすることを確認"""
+    from debounce import Turn
+
+    event = {
+        "type": "message",
+        "replyToken": "t2",
+        "source": {"type": "user", "userId": "image_user"},
+        "message": {"type": "image", "id": "m2", "imageSet": {"id": "set1", "index": 2, "total": 2}},
+    }
+    turn = Turn(text="m1\nm2", reply_token="t2", count=2, waited_ms=1000.0)
+
+    with patch.object(lambda_function.debouncer, "turn") as mock_turn:
+        mock_turn.return_value.__enter__.return_value = turn
+        lambda_function.handle_event(event, debounce=True)
+        mock_turn.return_value.__enter__.return_value = None
+        lambda_function.handle_event({**event, "replyToken": "t1"}, debounce=True)
+
+    mock_turn.assert_any_call("image_set|image_user|set1", "m2", "t2")
+    mock_analyze.assert_called_once_with(["m1", "m2"])
+    mock_reply.assert_called_once_with("t2", "2枚の写真です")
+    mock_push.assert_not_called()
+    mock_save.assert_called_once_with("image_user", "session", "[画像を2枚送信]", "2枚の写真です")
+
+
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.SHORT_TERM_BUFFER_ENABLED", False)
+@patch("lambda_function.prefetch_sessions")
+@patch("lambda_function.bedrock_client")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.invoke_agent", return_value="エージェントの応答")
+@patch("lambda_function.get_long_term_memory", return_value="")
+@patch("lambda_function.get_or_create_session", return_value="persist_session")
+def test_conversation_is_saved_after_reply(
+    mock_session, mock_ltm, mock_invoke, mock_reply, mock_bedrock_client, mock_prefetch
+):
+    """返信を送ってから会話を書き込み、同じバッチの後続のイベントは書き込み前の会話を履歴に含めることを確認"""
+    import metrics
+
+    calls = []
+    mock_reply.side_effect = lambda *args: calls.append("reply") or True
+    mock_bedrock_client.create_event.side_effect = lambda **kwargs: calls.append("create_event")
+    mock_bedrock_client.list_events.return_value = {"events": []}
+    events = [
+        {
+            "type": "message",
+            "message": {"type": "text", "text": text},
+            "source": {"type": "user", "userId": "persist_user"},
+            "replyToken": f"t{i}",
+        }
+        for i, text in enumerate(["最初の質問", "次の質問"])
+    ]
+
+    with metrics.capture() as documents:
+        lambda_function.process_webhook_events(events)
+
+    assert calls == ["reply", "reply", "create_event"]
+    payload = mock_bedrock_client.create_event.call_args.kwargs["payload"]
+    assert [p["conversational"]["content"]["text"] for p in payload[::2]] == ["最初の質問", "次の質問"]
+    assert "USER: 最初の質問" in mock_invoke.call_args_list[1].args[2]
+    flushed = [d for d in documents if d["MessageType"] == "memory_write"]
+    assert flushed[0]["MemoryWriteTurns"] == 2
+
+
+@patch("lambda_function.WORKER_FUNCTION_NAME", "worker")
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.SHORT_TERM_BUFFER_ENABLED", False)
+@patch("lambda_function.bedrock_client")
+def test_memory_writes_are_spilled_near_timeout(mock_bedrock_client):
+    """タイムアウトが近ければ会話をキューへ退避し、ワーカーが書き込み直すことを確認"""
+    import time
+
+    from event_queue import LocalEventQueue
+
+    queue = LocalEventQueue()
+    lambda_function.save_conversation("spill_actor", "spill_session", "質問", "回答")
+
+    with patch.object(lambda_function, "_event_queue", queue):
+        lambda_function.flush_memory_writes(deadline=time.monotonic())
+        mock_bedrock_client.create_event.assert_not_called()
+        assert queue.drain(lambda_function.worker_handler) == 1
+
+    mock_bedrock_client.create_event.assert_called_once()
+    assert mock_bedrock_client.create_event.call_args.kwargs["actorId"] == "spill_actor"
+
+
+@patch("lambda_function.EVENT_QUEUE_URL", "")
+@patch("lambda_function.WORKER_FUNCTION_NAME", "")
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.bedrock_client")
+def test_memory_writes_are_dropped_without_durable_queue(mock_bedrock_client):
+    """SQS・ワーカーLambdaがなければプロセス内キューへ退避せず、破棄としてメトリクスに出すことを確認"""
+    import time
+
+    import metrics
+
+    lambda_function.save_conversation("drop_actor", "drop_session", "質問", "回答")
+
+    with patch("lambda_function.get_event_queue") as mock_queue, metrics.capture() as documents:
+        lambda_function.flush_memory_writes(deadline=time.monotonic())
+
+    mock_queue.assert_not_called()
+    mock_bedrock_client.create_event.assert_not_called()
+    flushed = [d for d in documents if d["MessageType"] == "memory_write"]
+    assert flushed[0]["MemoryWriteDropped"] == 1
+    assert flushed[0]["MemoryWriteSpilled"] == 0
+
+
+def test_spilled_memory_writes_are_grouped_by_actor():
+    """退避した会話はアクターごとのメッセージグループに入る（1つの失敗が他のチャットを止めない）"""
+    from event_queue import SqsEventQueue
+
+    sqs = MagicMock()
+    sqs.send_message_batch.return_value = {}
+    turns = [
+        lambda_function.ConversationTurn("actor_a", "s1", "質問", "回答", 1_700_000_000),
+        lambda_function.ConversationTurn("actor_b", "s2", "質問", "回答", 1_700_000_000),
+    ]
+
+    with patch("lambda_function.EVENT_QUEUE_URL", "https://sqs/queue.fifo"), \
+            patch.object(lambda_function, "_event_queue", SqsEventQueue("https://sqs/queue.fifo", sqs)):
+        lambda_function.spill_memory_writes(turns)
+
+    entries = sqs.send_message_batch.call_args.kwargs["Entries"]
+    assert sorted(e["MessageGroupId"] for e in entries) == ["actor_a", "actor_b"]
+
+
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.bedrock_client")
+def test_short_term_memory_reads_session_buffer(mock_bedrock_client, mock_dynamodb):
+    """短期記憶はセッション行のバッファから読み、バッファがなければlist_eventsの結果で作ることを確認"""
+    from session_manager import SessionManager
+
+    manager = SessionManager(boto3.resource("dynamodb", region_name="us-west-2"), "TestLineAgentSessions")
+    mock_dynamodb.put_item(
+        Item={"user_id": "buffer_user", "session_id": "s1", "ttl": 4_000_000_000}
+    )
+    mock_bedrock_client.list_events.return_value = {"events": [{"payload": [
+        {"conversational": {"role": "USER", "content": {"text": "過去の質問"}}},
+        {"conversational": {"role": "ASSISTANT", "content": {"text": "過去の回答"}}},
+    ]}]}
+
+    with patch.object(lambda_function, "session_manager", manager):
+        first = lambda_function.get_short_term_memory("buffer_user", "s1")
+        lambda_function.write_conversation_turns("buffer_user", "s1", [
+            lambda_function.ConversationTurn("buffer_user", "s1", "新しい質問", "新しい回答", 1_700_000_000),
+        ])
+        second = lambda_function.get_short_term_memory("buffer_user", "s1")
+
+    assert first == "USER: 過去の質問\nASSISTANT: 過去の回答"
+    assert second == first + "\nUSER: 新しい質問\nASSISTANT: 新しい回答"
+    mock_bedrock_client.list_events.assert_called_once()
+
+
+@patch("lambda_function.SHORT_TERM_BUFFER_MAX_AGE_SECONDS", 0)
+@patch("lambda_function.MEMORY_ID", "test_memory")
+@patch("lambda_function.bedrock_client")
+def test_short_term_memory_ignores_session_reset_elsewhere(mock_bedrock_client, mock_dynamodb):
+    """他のコンテナでリセットされた古いセッションの会話履歴をlist_eventsで読まないことを確認"""
+    from session_manager import SessionManager
+
+    manager = SessionManager(boto3.resource("dynamodb", region_name="us-west-2"), "TestLineAgentSessions")
+    old = manager.get_or_create("reset_elsewhere_user")
+    # 別のコンテナのセッションマネージャーでリセットする
+    new = SessionManager(boto3.resource("dynamodb", region_name="us-west-2"), "TestLineAgentSessions").reset(
+        "reset_elsewhere_user"
+    )
+
+    with patch.object(lambda_function, "session_manager", manager):
+        history = lambda_function.get_short_term_memory("reset_elsewhere_user", old)
+        assert lambda_function.get_or_create_session("reset_elsewhere_user") == new
+
+    assert history == ""
+    mock_bedrock_client.list_events.assert_not_called()
+
+
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.get_long_term_memory")
+@patch("lambda_function.get_short_term_memory")
+@patch("lambda_function.invoke_agent", return_value="おはようございます！")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_context_free_message_is_answered_from_cache(
+    mock_session, mock_invoke, mock_stm, mock_ltm, mock_reply, mock_save
+):
+    """挨拶は履歴なしで生成した応答をキャッシュし、2回目以降はエージェントを呼ばずに返すことを確認"""
+    lambda_function.response_cache.cache.clear()
+    events = [
+        {
+            "type": "message",
+            "replyToken": f"t{i}",
+            "source": {"type": "user", "userId": f"greeting_user{i}"},
+            "message": {"type": "text", "text": text},
+        }
+        for i, text in enumerate(["おはよう！", "おはよう"])
+    ]
+
+    for event in events:
+        lambda_function.handle_event(event)
+
+    mock_invoke.assert_called_once_with("test_session_id", "おはよう！")
+    mock_stm.assert_not_called()
+    mock_ltm.assert_not_called()
+    assert mock_reply.call_args_list[1].args == ("t1", "おはようございます！")
+    assert mock_save.call_count == 2
+    assert lambda_function.response_cache.stats()["hits"] == 1
+
+
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.invoke_agent", return_value=lambda_function.AGENT_NO_RESPONSE)
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_failed_agent_response_is_not_cached(mock_session, mock_invoke, mock_reply):
+    lambda_function.response_cache.cache.clear()
+    event = {
+        "type": "message",
+        "replyToken": "t",
+        "source": {"type": "user", "userId": "thanks_user"},
+        "message": {"type": "text", "text": "ありがとう"},
+    }
+
+    lambda_function.handle_event(event)
+    lambda_function.handle_event(event)
+
+    assert mock_invoke.call_count == 2
+
+
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.invoke_agent")
+@patch("lambda_function.get_or_create_session")
+def test_trivial_intents_are_answered_without_agent(mock_session, mock_invoke, mock_reply):
+    """ヘルプ・スタンプにはセッション取得もエージェント呼び出しもせずに返信することを確認"""
+    events = [
+        {
+            "type": "message",
+            "replyToken": "t0",
+            "source": {"type": "user", "userId": "router_user"},
+            "message": {"type": "text", "text": "ヘルプ"},
+        },
+        {
+            "type": "message",
+            "replyToken": "t1",
+            "source": {"type": "user", "userId": "router_user"},
+            "message": {"type": "sticker", "packageId": "1", "stickerId": "1"},
+        },
+    ]
+
+    for event in events:
+        lambda_function.handle_event(event)
+
+    mock_session.assert_not_called()
+    mock_invoke.assert_not_called()
+    assert [c.args[0] for c in mock_reply.call_args_list] == ["t0", "t1"]
+    assert lambda_function.intent_router.stats()["help"]["count"] >= 1
+
+
+@patch("lambda_function.reply_message", return_value=True)
+def test_reset_command_starts_new_session(mock_reply, mock_dynamodb):
+    old_session = lambda_function.session_manager.get_or_create("reset_user")
+    event = {
+        "type": "message",
+        "replyToken": "t",
+        "source": {"type": "user", "userId": "reset_user"},
+        "message": {"type": "text", "text": "リセット"},
+    }
+
+    lambda_function.handle_event(event)
+
+    new_session = lambda_function.session_manager.get_or_create("reset_user")
+    assert new_session != old_session
+    assert mock_dynamodb.get_item(Key={"user_id": "reset_user"})["Item"]["session_id"] == new_session
+    mock_reply.assert_called_once()
+
+
+@patch("lambda_function.reply_message", return_value=True)
+def test_reset_failure_replies_with_error(mock_reply):
+    """セッションを作り直せなかった場合は、完了ではなくエラーを返信することを確認"""
+    event = {
+        "type": "message",
+        "replyToken": "t",
+        "source": {"type": "user", "userId": "reset_user"},
+        "message": {"type": "text", "text": "リセット"},
+    }
+
+    with patch.object(lambda_function.session_manager, "reset", side_effect=RuntimeError("boom")):
+        lambda_function.handle_event(event)
+
+    mock_reply.assert_called_once_with("t", f"{lambda_function.AGENT_ERROR_PREFIX}boom")
+
+
+@patch("lambda_function.RESPONSE_CACHE_ENABLED", False)
+@patch("lambda_function.save_conversation")
+@patch("lambda_function.reply_message", return_value=True)
+@patch("lambda_function.invoke_agent", return_value="続きの回答")
+@patch("lambda_function.get_long_term_memory")
+@patch("lambda_function.get_short_term_memory", return_value="短期記憶")
+@patch("lambda_function.get_or_create_session", return_value="test_session_id")
+def test_follow_up_route_skips_long_term_memory(
+    mock_session, mock_stm, mock_ltm, mock_invoke, mock_reply, mock_save
+):
+    event = {
+        "type": "message",
+        "replyToken": "t",
+        "source": {"type": "user", "userId": "follow_up_user"},
+        "message": {"type": "text", "text": "続けて"},
+    }
+
+    lambda_function.handle_event(event)
+
+    mock_ltm.assert_not_called()
+    mock_invoke.assert_called_once_with("test_session_id", "続けて", "短期記憶", "")
+
+
+@patch("lambda_function.reply_message", return_value=True)
+def test_event_log_fields_do_not_leak_into_later_logs(mock_reply):
+    """イベントごとのセッション・ルートの値が、後続のイベントとWebhook単位のログに残らないことを確認"""
+    import log
+
+    captured = []
+    previous = log.set_sink(lambda line: captured.append(json.loads(line)))
+    try:
+        with log.request_context("req-leak"):
+            lambda_function.process_webhook_events([{
+                "type": "message",
+                "replyToken": "t",
+                "source": {"type": "user", "userId": "leak_user"},
+                "message": {"type": "sticker", "packageId": "1", "stickerId": "1"},
+            }])
+    finally:
+        log.set_sink(previous)
+
+    stats = [line for line in captured if line["msg"] == "Route stats"]
+    assert stats and "session" not in stats[0] and "route" not in stats[0]
@@ -0,0 +1,92 @@
+"""
+LINE Messaging APIクライアントのテスト（ローカルの擬似LINEサーバーを使用）
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from linebot.v3.messaging import MessagingApi, ReplyMessageRequest, TextMessage
+from linebot.v3.messaging.exceptions import ServiceException
+
+from line_client import CONTENT_TIMEOUT, REPLY_TIMEOUT, build_api_client
+
+
+class FakeLineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.log.append(("POST", self.path, self.client_address[1]))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self._send(status, json.dumps({"sentMessages": [{"id": "1", "quoteToken": "q"}]} if status == 200 else {"message": "error"}).encode())
+
+    def do_GET(self):
+        self.server.log.append(("GET", self.path, self.client_address[1]))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self._send(status, b"\xff\xd8\xffimage" if status == 200 else b"{}", "image/jpeg")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_line():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLineHandler)
+    server.log = []
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def reply(api_client, token="token"):
+    MessagingApi(api_client).reply_message(
+        ReplyMessageRequest(reply_token=token, messages=[TextMessage(text="hi")]),
+        _request_timeout=REPLY_TIMEOUT,
+    )
+
+
+def test_replies_reuse_keepalive_connection(fake_line):
+    """共有のApiClientで連続して返信すると、同じ接続が使い回されることを確認"""
+    api_client = build_api_client("token", host=f"http://127.0.0.1:{fake_line.server_port}")
+
+    for i in range(3):
+        reply(api_client, f"token_{i}")
+
+    ports = {port for _, _, port in fake_line.log}
+    assert len(fake_line.log) == 3
+    assert len(ports) == 1
+
+
+def test_reply_is_not_retried_on_server_error(fake_line):
+    """返信（POST）はサーバーエラーで再送されないことを確認"""
+    fake_line.statuses = [500]
+    api_client = build_api_client("token", host=f"http://127.0.0.1:{fake_line.server_port}")
+
+    with pytest.raises(ServiceException):
+        reply(api_client)
+
+    assert [method for method, _, _ in fake_line.log] == ["POST"]
+
+
+def test_content_download_is_retried(fake_line):
+    """画像のダウンロード（GET）は一時的なエラーで再試行されることを確認"""
+    fake_line.statuses = [503]
+    api_client = build_api_client("token", host=f"http://127.0.0.1:{fake_line.server_port}")
+
+    # コンテンツ取得のホスト（api-data.line.me）はSDK内で固定のため、同じコネクションプールに直接リクエストする
+    response = api_client.rest_client.request(
+        "GET", f"http://127.0.0.1:{fake_line.server_port}/v2/bot/message/m1/content",
+        _request_timeout=CONTENT_TIMEOUT,
+    )
+
+    assert response.status == 200
+    assert [method for method, _, _ in fake_line.log] == ["GET", "GET"]
@@ -0,0 +1,130 @@
+"""
+構造化ログのテスト
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import log
+
+
+@pytest.fixture
+def lines():
+    """出力されたログ行（JSONを解析したもの）"""
+    captured = []
+    previous = log.set_sink(lambda line: captured.append(json.loads(line)))
+    log.configure(level="INFO", debug_sample_rate=0, max_field_chars=512, message_bodies=False)
+    yield captured
+    log.set_sink(previous)
+    log.configure(level="INFO", debug_sample_rate=0, max_field_chars=512, message_bodies=False)
+
+
+def test_record_has_level_message_and_fields(lines):
+    """1行1JSONでレベル・メッセージ・フィールドが出力されることを確認"""
+    log.info("Processed events", processed=2)
+
+    assert lines[0]["level"] == "INFO"
+    assert lines[0]["msg"] == "Processed events"
+    assert lines[0]["processed"] == 2
+
+
+def test_debug_is_suppressed_below_level(lines):
+    """LOG_LEVELより低いレベルは出力されないことを確認"""
+    log.debug("hidden")
+    log.warning("shown")
+
+    assert [line["msg"] for line in lines] == ["shown"]
+
+
+def test_debug_sampling_applies_to_whole_request(lines):
+    """サンプリングされたリクエストではDEBUG行もすべて出力されることを確認"""
+    log.configure(debug_sample_rate=1.0)
+    with log.request_context("req-1"):
+        log.debug("first")
+        log.debug("second")
+    log.configure(debug_sample_rate=0)
+    with log.request_context("req-2"):
+        log.debug("third")
+
+    assert [line["msg"] for line in lines] == ["first", "second"]
+    assert "debug_sampled" not in lines[0]
+
+
+def test_request_context_and_session_hash(lines):
+    """リクエストidとセッションキーのハッシュが付与され、キー自体は出力されないことを確認"""
+    with log.request_context("req-1", handler="webhook"):
+        log.bind(session_key="U1234567890")
+        log.info("inside")
+    log.info("outside")
+
+    assert lines[0]["request_id"] == "req-1"
+    assert lines[0]["handler"] == "webhook"
+    assert lines[0]["session"] == log.hash_key("U1234567890")
+    assert "U1234567890" not in json.dumps(lines[0])
+    assert "request_id" not in lines[1]
+
+
+def test_context_is_propagated_to_thread_pool(lines):
+    """submit_with_context で投入した処理にコンテキストが引き継がれることを確認"""
+    with ThreadPoolExecutor(max_workers=2) as pool, log.request_context("req-1"):
+        futures = [
+            log.submit_with_context(pool, lambda key: (log.bind(session_key=key), log.info("event")), key)
+            for key in ("a", "b")
+        ]
+        for future in futures:
+            future.result()
+        log.info("after")
+
+    assert {line.get("session") for line in lines[:2]} == {log.hash_key("a"), log.hash_key("b")}
+    assert all(line["request_id"] == "req-1" for line in lines)
+    # スレッド内でのbindは呼び出し元に影響しない
+    assert "session" not in lines[2]
+
+
+def test_scope_drops_bound_fields_on_exit(lines):
+    """scope 内の bind は、同じスレッドで続けて処理する次のイベントに持ち越されないことを確認"""
+    with log.request_context("req-1"):
+        for key in ("a", "b"):
+            with log.scope():
+                if key == "a":
+                    log.bind(session_key=key, route="help")
+                log.info("event")
+        log.info("after")
+
+    assert lines[0]["route"] == "help"
+    assert "session" not in lines[1] and "route" not in lines[1]
+    assert lines[2]["request_id"] == "req-1" and "session" not in lines[2]
+
+
+def test_long_fields_are_truncated(lines):
+    """長い文字列（ネストした値を含む）が切り詰められることを確認"""
+    log.configure(max_field_chars=10)
+    log.info("long", value="x" * 100, nested={"items": ["y" * 100]})
+
+    assert lines[0]["value"].startswith("x" * 10)
+    assert "+90 chars" in lines[0]["value"]
+    assert "+90 chars" in lines[0]["nested"]["items"][0]
+
+
+def test_message_bodies_are_redacted_by_default(lines):
+    """既定ではメッセージ本文ではなく長さだけが出力されることを確認"""
+    log.info("Received text message", text=log.redact("秘密の話"))
+    log.configure(message_bodies=True)
+    log.info("Received text message", text=log.redact("秘密の話"))
+
+    assert lines[0]["text"] == {"chars": 4}
+    assert lines[1]["text"] == "秘密の話"
+
+
+def test_exception_includes_type_and_traceback(lines):
+    """例外の種類とトレースバックが出力されることを確認"""
+    try:
+        raise ValueError("boom")
+    except ValueError as e:
+        log.exception("failed", e)
+
+    assert lines[0]["level"] == "ERROR"
+    assert lines[0]["error_type"] == "ValueError"
+    assert lines[0]["error"] == "boom"
+    assert "ValueError: boom" in lines[0]["traceback"]
@@ -0,0 +1,89 @@
+"""
+長期記憶の検索結果キャッシュのテスト
+"""
+from cache import LocalCacheTier, TTLCache, TwoTierCache
+from memory_cache import LongTermMemoryCache, normalize_query
+from tests.fakes import FakeClock
+
+
+def make_cache(clock, shared=None) -> LongTermMemoryCache:
+    return LongTermMemoryCache(TwoTierCache(TTLCache(ttl_seconds=300, clock=clock), shared))
+
+
+def test_normalize_query_folds_width_and_whitespace():
+    """全角・半角や空白、末尾の記号の違いが吸収されることを確認"""
+    assert normalize_query("ｶﾞｯｺｳの　行事は？") == normalize_query("ガッコウの 行事は")
+    assert normalize_query("  ＡＢＣ   テスト!! ") == "abc テスト"
+
+
+def test_near_repeated_query_hits_cache():
+    """表記ゆれのみ異なる質問がキャッシュにヒットすることを確認"""
+    clock = FakeClock()
+    cache = make_cache(clock)
+    records = [{"text": "長男はサッカー部", "score": 0.8}]
+
+    cache.put("actor", "/family/actor/facts/", "部活は何？", records)
+
+    assert cache.get("actor", "/family/actor/facts/", "部活は何") == records
+    assert cache.get("actor", "/family/actor/preferences/", "部活は何") is None
+    assert cache.get("other", "/family/actor/facts/", "部活は何") is None
+
+
+def test_entries_expire_after_ttl():
+    """TTLを過ぎたエントリが返されないことを確認"""
+    clock = FakeClock()
+    cache = make_cache(clock)
+    cache.put("actor", "ns", "質問", [])
+
+    clock.now += 301
+    assert cache.get("actor", "ns", "質問") is None
+
+
+def test_invalidate_drops_actor_entries():
+    """無効化したアクターのエントリだけが捨てられることを確認"""
+    clock = FakeClock()
+    cache = make_cache(clock)
+    cache.put("actor", "ns", "質問", [{"text": "a", "score": 1.0}])
+    cache.put("other", "ns", "質問", [{"text": "b", "score": 1.0}])
+
+    clock.now += 1
+    cache.invalidate("actor")
+
+    assert cache.get("actor", "ns", "質問") is None
+    assert cache.get("other", "ns", "質問") is not None
+
+
+def test_invalidation_is_shared_between_containers():
+    """別コンテナでの無効化が共有層経由で反映されることを確認"""
+    clock = FakeClock()
+    shared = LocalCacheTier(clock=clock)
+    container_a = make_cache(clock, shared)
+    container_b = make_cache(clock, shared)
+
+    container_a.put("actor", "ns", "質問", [{"text": "古い記憶", "score": 1.0}])
+    clock.now += 1
+    container_a.invalidate("actor")
+
+    assert container_b.get("actor", "ns", "質問") is None
+    assert container_b.stats()["stale"] == 1
+
+    clock.now += 1
+    container_b.put("actor", "ns", "質問", [{"text": "新しい記憶", "score": 1.0}])
+    container_c = make_cache(clock, shared)
+    assert container_c.get("actor", "ns", "質問") == [{"text": "新しい記憶", "score": 1.0}]
+
+
+def test_namespaces_are_read_from_shared_tier_at_once():
+    """全名前空間のキャッシュを共有層への1回の読み込みで引くことを確認"""
+    from unittest.mock import patch
+
+    clock = FakeClock()
+    shared = LocalCacheTier(clock=clock)
+    make_cache(clock, shared).put("actor", "facts", "質問", [{"text": "a", "score": 1.0}])
+    cold = make_cache(clock, shared)
+
+    with patch.object(shared, "get_many", wraps=shared.get_many) as get_many:
+        found = cold.get_many("actor", ["facts", "preferences"], "質問")
+
+    assert found == {"facts": [{"text": "a", "score": 1.0}]}
+    get_many.assert_called_once()
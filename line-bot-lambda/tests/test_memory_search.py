@@ -0,0 +1,61 @@
+"""
+長期記憶の名前空間横断検索のテスト
+"""
+import threading
+import time
+
+from memory_search import fan_out, merge_records
+
+
+def test_fan_out_runs_namespaces_concurrently():
+    """名前空間の検索が並列に実行されることを確認"""
+    barrier = threading.Barrier(2, timeout=2)
+
+    def fetch(ns):
+        barrier.wait()
+        return [{"text": ns, "score": 1.0}]
+
+    results = fan_out(["facts", "preferences"], fetch, deadline_seconds=2)
+
+    assert set(results) == {"facts", "preferences"}
+
+
+def test_fan_out_drops_late_and_failed_namespaces():
+    """締め切りに遅れた名前空間と失敗した名前空間が除かれることを確認"""
+    release = threading.Event()
+
+    def fetch(ns):
+        if ns == "slow":
+            release.wait(timeout=2)
+        if ns == "broken":
+            raise RuntimeError("boom")
+        return [{"text": ns, "score": 1.0}]
+
+    started = time.perf_counter()
+    try:
+        results = fan_out(["fast", "slow", "broken"], fetch, deadline_seconds=0.1)
+    finally:
+        release.set()
+
+    assert list(results) == ["fast"]
+    assert time.perf_counter() - started < 1
+
+
+def test_merge_records_sorts_by_score_and_limits():
+    """スコア順に統合され、上位N件に絞られることを確認"""
+    merged = merge_records([
+        [{"text": "a", "score": 0.2}, {"text": "b", "score": 0.9}],
+        [{"text": "c", "score": 0.5}, {"text": "d", "score": None}],
+    ], top_n=3)
+
+    assert [r["text"] for r in merged] == ["b", "c", "a"]
+
+
+def test_merge_records_removes_near_duplicates():
+    """表記ゆれのみ異なる記録が除かれ、スコアの高い方が残ることを確認"""
+    merged = merge_records([
+        [{"text": "長男はｻｯｶｰ部。", "score": 0.4}],
+        [{"text": "長男はサッカー部", "score": 0.7}, {"text": "", "score": 1.0}],
+    ], top_n=5)
+
+    assert merged == [{"text": "長男はサッカー部", "score": 0.7}]
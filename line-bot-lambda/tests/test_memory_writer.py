@@ -0,0 +1,132 @@
+"""
+返信後の会話の保存のテスト
+"""
+from typing import List
+
+from memory_writer import ConversationTurn, MemoryWriter
+from tests.fakes import FakeClock
+
+
+def turn(actor_id: str = "actor", session_id: str = "s1", n: int = 0) -> ConversationTurn:
+    return ConversationTurn(actor_id, session_id, f"質問{n}", f"回答{n}", 1_700_000_000 + n)
+
+
+class Recorder:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.writes: List[tuple] = []
+        self.spilled: List[ConversationTurn] = []
+
+    def write(self, actor_id: str, session_id: str, turns: List[ConversationTurn]) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("throttled")
+        self.writes.append((actor_id, session_id, [t.user_msg for t in turns]))
+
+    def spill(self, turns: List[ConversationTurn]) -> None:
+        self.spilled.extend(turns)
+
+
+def make_writer(recorder: Recorder, clock: FakeClock, **kwargs) -> MemoryWriter:
+    return MemoryWriter(recorder.write, recorder.spill, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_flush_batches_turns_per_session():
+    """同じアクター・セッションの会話が1回の書き込みにまとまることを確認"""
+    recorder = Recorder()
+    writer = make_writer(recorder, FakeClock())
+    writer.add(turn(n=0))
+    writer.add(turn(actor_id="other", n=1))
+    writer.add(turn(n=2))
+
+    assert [t.user_msg for t in writer.pending_for("actor", "s1")] == ["質問0", "質問2"]
+    result = writer.flush()
+
+    assert recorder.writes == [("actor", "s1", ["質問0", "質問2"]), ("other", "s1", ["質問1"])]
+    assert result["written"] == 3
+    assert result["calls"] == 2
+    assert writer.pending() == 0
+    assert writer.flush()["turns"] == 0
+
+
+def test_flush_retries_with_backoff():
+    recorder = Recorder(failures=2)
+    clock = FakeClock()
+    started = clock.now
+    writer = make_writer(recorder, clock)
+    writer.add(turn())
+
+    result = writer.flush()
+
+    assert result["written"] == 1
+    assert result["retries"] == 2
+    assert recorder.spilled == []
+    assert clock.now <= started + 0.1 + 0.2
+
+
+def test_exhausted_retries_are_spilled():
+    recorder = Recorder(failures=10)
+    writer = make_writer(recorder, FakeClock(), max_attempts=3)
+    writer.add(turn())
+
+    result = writer.flush()
+
+    assert result["calls"] == 3
+    assert result["spilled"] == 1
+    assert writer.stats()["spilled_turns"] == 1
+
+
+def test_failing_session_does_not_spill_other_sessions():
+    """1つのアクターの書き込みが失敗しても、他のアクターの会話は書き込むことを確認"""
+    recorder = Recorder()
+
+    def write(actor_id, session_id, turns):
+        if actor_id == "broken":
+            raise RuntimeError("validation error")
+        recorder.write(actor_id, session_id, turns)
+
+    clock = FakeClock()
+    writer = MemoryWriter(write, recorder.spill, max_attempts=2, clock=clock, sleep=clock.sleep)
+    writer.add(turn(actor_id="broken", n=0))
+    writer.add(turn(actor_id="other", n=1))
+
+    result = writer.flush(deadline=clock.now + 60)
+
+    assert recorder.writes == [("other", "s1", ["質問1"])]
+    assert [t.user_msg for t in recorder.spilled] == ["質問0"]
+    assert result["written"] == 1
+    assert result["spilled"] == 1
+
+
+def test_near_deadline_turns_are_spilled_without_writing():
+    """タイムアウトが近ければ書き込まずにキューへ退避することを確認"""
+    recorder = Recorder()
+    clock = FakeClock()
+    writer = make_writer(recorder, clock, spill_margin_seconds=2.0)
+    writer.add(turn(n=0))
+    writer.add(turn(actor_id="other", n=1))
+
+    result = writer.flush(deadline=clock.now + 1.0)
+
+    assert recorder.writes == []
+    assert [t.user_msg for t in recorder.spilled] == ["質問0", "質問1"]
+    assert result["spilled"] == 2
+
+
+def test_spill_failure_is_counted_as_dropped():
+    def broken_spill(turns):
+        raise RuntimeError("queue unavailable")
+
+    clock = FakeClock()
+    writer = MemoryWriter(Recorder(failures=10).write, broken_spill, max_attempts=1, clock=clock, sleep=clock.sleep)
+    writer.add(turn())
+
+    result = writer.flush()
+
+    assert result["dropped"] == 1
+    assert writer.stats()["dropped_turns"] == 1
+
+
+def test_turn_round_trips_through_dict():
+    original = turn(n=3)
+    assert ConversationTurn.from_dict(original.to_dict()) == original
@@ -0,0 +1,88 @@
+"""
+EMFメトリクスのテスト
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import log
+import metrics
+
+
+def test_event_metrics_emits_one_emf_document():
+    """イベント1件につき、ディメンションとメトリクス定義を持つEMFドキュメントが1つ出力されることを確認"""
+    with metrics.capture() as documents:
+        with metrics.event_metrics("text", "user"):
+            metrics.put("Agent", 120.0)
+
+    assert len(documents) == 1
+    document = documents[0]
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == metrics.METRICS_NAMESPACE
+    assert directive["Dimensions"] == [["MessageType", "SourceType"]]
+    assert {"Name": "Agent", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert {"Name": "ColdStart", "Unit": "Count"} in directive["Metrics"]
+    assert document["MessageType"] == "text"
+    assert document["SourceType"] == "user"
+    assert document["Agent"] == 120.0
+    assert document["EventLatency"] >= 0
+
+
+def test_timed_records_duration_and_repeated_values():
+    """デコレーターで所要時間が記録され、同じ名前の複数の値は配列になることを確認"""
+    @metrics.timed("ImageDownload")
+    def download(message_id):
+        return message_id
+
+    with metrics.capture() as documents:
+        with metrics.event_metrics("image_set", "room"):
+            download("a")
+            download("b")
+
+    assert len(documents[0]["ImageDownload"]) == 2
+
+
+def test_timer_outside_event_is_ignored():
+    """計測スコープ外の記録は出力されないことを確認"""
+    with metrics.capture() as documents:
+        with metrics.timer("Agent"):
+            pass
+
+    assert documents == []
+
+
+def test_stage_threads_record_into_the_same_event():
+    """submit_with_context で投入したスレッドの計測が同じイベントに集計されることを確認"""
+    with metrics.capture() as documents, ThreadPoolExecutor(max_workers=2) as pool:
+        with metrics.event_metrics("text", "user"):
+            futures = [
+                log.submit_with_context(pool, metrics.put, name, 1.0)
+                for name in ("ShortTermMemory", "LongTermMemory")
+            ]
+            for future in futures:
+                future.result()
+
+    assert documents[0]["ShortTermMemory"] == 1.0
+    assert documents[0]["LongTermMemory"] == 1.0
+
+
+def test_errors_are_counted_and_reraised():
+    """例外で終わったイベントはErrors=1で出力され、例外はそのまま送出されることを確認"""
+    with metrics.capture() as documents:
+        with pytest.raises(ValueError):
+            with metrics.event_metrics("text", "user"):
+                raise ValueError("boom")
+
+    assert documents[0]["Errors"] == 1
+
+
+def test_only_first_invocation_is_cold(monkeypatch):
+    """コンテナの最初の呼び出しのイベントだけColdStart=1になることを確認"""
+    monkeypatch.setattr(metrics, "_cold_start", True)
+
+    with metrics.capture() as documents:
+        for _ in range(2):
+            with metrics.invocation(), metrics.event_metrics("text", "user"):
+                pass
+
+    assert [d["ColdStart"] for d in documents] == [1, 0]
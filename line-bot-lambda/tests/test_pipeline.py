@@ -0,0 +1,99 @@
+"""
+ステージパイプラインのテスト
+"""
+import threading
+import time
+
+import pytest
+
+from pipeline import Stage, StagePipeline
+
+
+def test_stage_results_are_returned():
+    """各ステージの結果が名前で取得できることを確認"""
+    result = StagePipeline([
+        Stage("a", lambda deps: 1),
+        Stage("b", lambda deps: 2),
+    ]).run()
+
+    assert result["a"] == 1
+    assert result["b"] == 2
+
+
+def test_dependent_stage_receives_dependency_results():
+    """依存ステージの結果が渡されることを確認"""
+    result = StagePipeline([
+        Stage("session", lambda deps: "session-1"),
+        Stage("history", lambda deps: f"history-of-{deps['session']}", depends_on=("session",)),
+    ]).run()
+
+    assert result["history"] == "history-of-session-1"
+
+
+def test_independent_stages_run_in_parallel():
+    """独立したステージが並列に実行されることを確認"""
+    barrier = threading.Barrier(2, timeout=2)
+
+    def wait_for_peer(deps):
+        barrier.wait()
+        return True
+
+    result = StagePipeline([
+        Stage("a", wait_for_peer),
+        Stage("b", wait_for_peer),
+    ]).run()
+
+    assert result["a"] and result["b"]
+
+
+def test_timeline_is_recorded():
+    """ステージごとのタイムラインが記録されることを確認"""
+    def slow(deps):
+        time.sleep(0.02)
+        return None
+
+    result = StagePipeline([
+        Stage("first", slow),
+        Stage("second", slow, depends_on=("first",)),
+    ]).run()
+
+    timeline = {t.name: t for t in result.timeline}
+    assert set(timeline) == {"first", "second"}
+    assert timeline["second"].start_ms >= timeline["first"].end_ms
+    assert timeline["first"].duration_ms >= 15
+    assert result.total_ms >= timeline["second"].end_ms
+    assert "first=" in result.summary()
+
+
+def test_stage_error_is_raised():
+    """ステージの例外が呼び出し元に伝播し、後続ステージが実行されないことを確認"""
+    called = []
+
+    def fail(deps):
+        raise RuntimeError("boom")
+
+    pipeline = StagePipeline([
+        Stage("fail", fail),
+        Stage("after", lambda deps: called.append(True), depends_on=("fail",)),
+    ])
+
+    with pytest.raises(RuntimeError, match="boom"):
+        pipeline.run()
+    assert called == []
+
+
+def test_unknown_dependency_is_rejected():
+    """存在しないステージへの依存が拒否されることを確認"""
+    with pytest.raises(ValueError):
+        StagePipeline([Stage("a", lambda deps: None, depends_on=("missing",))])
+
+
+def test_cyclic_dependency_is_rejected():
+    """循環依存が検出されることを確認"""
+    pipeline = StagePipeline([
+        Stage("a", lambda deps: None, depends_on=("b",)),
+        Stage("b", lambda deps: None, depends_on=("a",)),
+    ])
+
+    with pytest.raises(ValueError):
+        pipeline.run()
@@ -0,0 +1,66 @@
+"""
+トークン予算付きプロンプト組み立てのテスト
+"""
+from prompt_builder import assemble_prompt, estimate_tokens, truncate_to_budget
+
+
+def test_estimate_tokens_japanese_and_ascii():
+    """日本語は1文字1トークン、ASCIIは4文字1トークンで見積もることを確認"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("こんにちは") == 5
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("今日はgood") == 4
+
+
+def test_truncate_keeps_head_sentences():
+    """先頭から文単位で残すことを確認"""
+    text = "一文目です。二文目です。三文目です。"
+
+    assert truncate_to_budget(text, 12) == "一文目です。二文目です。"
+
+
+def test_truncate_keeps_latest_lines():
+    """末尾から行単位で残すことを確認"""
+    text = "USER: 古い質問。詳しく。\nASSISTANT: 古い回答\nUSER: 新しい質問"
+
+    assert truncate_to_budget(text, 10, keep="tail", unit="line") == "USER: 新しい質問"
+
+
+def test_truncate_cuts_long_single_sentence():
+    """1文だけで予算を超える場合は文字単位で切り詰めることを確認"""
+    assert truncate_to_budget("あいうえおかきくけこ", 4) == "あいうえ"
+
+
+def test_assemble_prompt_without_truncation():
+    """予算内なら従来と同じプロンプトになることを確認"""
+    assembled = assemble_prompt("質問", "USER: 前の質問", "家族の記憶", budget=1000)
+
+    assert assembled.prompt == (
+        "[過去の長期記憶]\n家族の記憶\n\n"
+        "[今セッションの会話履歴]\nUSER: 前の質問\n\n"
+        "[ユーザーのメッセージ]\n質問"
+    )
+    assert set(assembled.usage) == {"user_message", "short_term", "long_term"}
+    assert assembled.truncated == []
+
+
+def test_assemble_prompt_prioritizes_user_message_and_recent_turns():
+    """予算が足りない場合は長期記憶から削られることを確認"""
+    history = "\n".join(f"USER: 質問{i}です" for i in range(10))
+    memories = "記憶です。" * 50
+
+    assembled = assemble_prompt("今日の予定は？", history, memories, budget=80)
+
+    assert "[ユーザーのメッセージ]\n今日の予定は？" in assembled.prompt
+    assert "USER: 質問9です" in assembled.prompt
+    assert "long_term" in assembled.truncated or "long_term" not in assembled.usage
+    assert assembled.total_tokens <= 80
+
+
+def test_prompt_size_stays_flat_with_history_length():
+    """履歴がどれだけ長くてもプロンプトが予算内に収まることを確認"""
+    for turns in (10, 100, 1000):
+        history = "\n".join(f"USER: メッセージ{i}\nASSISTANT: 返信{i}" for i in range(turns))
+        assembled = assemble_prompt("質問", history, "記憶", budget=500)
+
+        assert estimate_tokens(assembled.prompt) <= 500
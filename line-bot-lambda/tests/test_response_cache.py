@@ -0,0 +1,56 @@
+"""
+履歴に依存しないメッセージへの応答のキャッシュのテスト
+"""
+import pytest
+
+from cache import TTLCache
+from response_cache import ResponseCache, is_context_free, normalize_message
+from tests.fakes import FakeClock
+
+
+@pytest.mark.parametrize("text", ["おはよう", "おはよう！", "おはよう☀️", "ありがとうございます。", "ＯＫ", "おっけー", "Thank you!"])
+def test_greetings_and_thanks_are_context_free(text):
+    assert is_context_free(text)
+
+
+@pytest.mark.parametrize("text", ["明日の予定は？", "おはよう、明日の持ち物は？", "ありがとう、次はいつ？", ""])
+def test_questions_are_not_context_free(text):
+    assert not is_context_free(text)
+
+
+def test_key_normalizes_text_and_includes_prompt_version():
+    """表記ゆれは同じキーになり、システムプロンプトの版が変わると別のキーになることを確認"""
+    cache = ResponseCache(TTLCache(capacity=10, ttl_seconds=60), "v1")
+
+    assert cache.key("おはよう！") == cache.key("おはよう") is not None
+    assert cache.key("明日の予定は？") is None
+    assert ResponseCache(TTLCache(capacity=10, ttl_seconds=60), "v2").key("おはよう") != cache.key("おはよう")
+    assert normalize_message("  ありがとう！！😊 ") == "ありがとう"
+
+
+def test_entries_expire_and_hit_rates_are_reported():
+    clock = FakeClock()
+    cache = ResponseCache(TTLCache(capacity=10, ttl_seconds=60, clock=clock), "v1")
+    key = cache.key("ありがとう")
+
+    assert cache.get(key) is None
+    cache.put(key, "どういたしまして！")
+    assert cache.get(cache.key("ありがとう！")) == "どういたしまして！"
+    cache.key("明日の予定は？")
+    clock.now += 61
+    assert cache.get(key) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["eligible"] == 2
+    assert stats["ineligible"] == 1
+    assert stats["message_hit_rate"] == round(1 / 3, 3)
+
+
+def test_capacity_bounded_eviction():
+    cache = ResponseCache(TTLCache(capacity=1, ttl_seconds=60), "v1")
+    cache.put(cache.key("おはよう"), "おはようございます！")
+    cache.put(cache.key("おやすみ"), "おやすみなさい！")
+
+    assert cache.get(cache.key("おはよう")) is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,209 @@
+"""
+セッションマネージャーのテスト
+"""
+from unittest.mock import patch
+
+import pytest
+
+from session_manager import SessionManager
+
+
+TABLE_NAME = "TestSessions"
+
+
+@pytest.fixture
+def table(make_table):
+    return make_table(TABLE_NAME)
+
+
+@pytest.fixture
+def manager(dynamodb, table, clock):
+    return SessionManager(dynamodb, TABLE_NAME, capacity=2, refresh_after_seconds=3600, clock=clock)
+
+
+def test_create_then_hit_cache(manager):
+    """作成したセッションが2回目以降キャッシュから返されることを確認"""
+    session_id = manager.get_or_create("user1")
+
+    with patch.object(manager.table, "get_item") as mock_get_item:
+        assert manager.get_or_create("user1") == session_id
+        assert not mock_get_item.called
+
+    stats = manager.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["creates"] == 1
+
+
+def test_existing_session_is_loaded(manager, table, clock):
+    """既存のセッションが読み込まれることを確認"""
+    table.put_item(
+        Item={"user_id": "user1", "session_id": "existing", "ttl": int(clock.now) + 86400}
+    )
+
+    assert manager.get_or_create("user1") == "existing"
+    assert manager.stats()["creates"] == 0
+
+
+def test_expired_session_is_replaced(manager, table, clock):
+    """期限切れのセッションは新しいセッションで置き換えられることを確認"""
+    table.put_item(Item={"user_id": "user1", "session_id": "expired", "ttl": int(clock.now) - 1})
+
+    session_id = manager.get_or_create("user1")
+
+    assert session_id != "expired"
+    assert table.get_item(Key={"user_id": "user1"})["Item"]["session_id"] == session_id
+
+
+def test_ttl_refresh_is_throttled(manager, table, clock):
+    """TTLの延長は設定から一定時間経過後にだけ行われることを確認"""
+    manager.get_or_create("user1")
+    initial_ttl = int(table.get_item(Key={"user_id": "user1"})["Item"]["ttl"])
+
+    clock.now += 600
+    manager.get_or_create("user1")
+    assert int(table.get_item(Key={"user_id": "user1"})["Item"]["ttl"]) == initial_ttl
+    assert manager.stats()["ttl_refreshes"] == 0
+
+    clock.now += 3600
+    manager.get_or_create("user1")
+    assert int(table.get_item(Key={"user_id": "user1"})["Item"]["ttl"]) == int(clock.now) + 86400
+    assert manager.stats()["ttl_refreshes"] == 1
+
+
+def test_concurrent_create_uses_existing_session(manager, table, clock):
+    """同時作成で競合した場合は先に作成されたセッションを使うことを確認"""
+    original_get_item = manager.table.get_item
+
+    def get_item_racing(**kwargs):
+        response = original_get_item(**kwargs)
+        if not kwargs.get("ConsistentRead"):
+            # 読み込み直後に別のコンテナがセッションを作成した状況を再現
+            table.put_item(
+                Item={"user_id": "user1", "session_id": "winner", "ttl": int(clock.now) + 86400}
+            )
+        return response
+
+    with patch.object(manager.table, "get_item", side_effect=get_item_racing):
+        assert manager.get_or_create("user1") == "winner"
+
+    assert table.get_item(Key={"user_id": "user1"})["Item"]["session_id"] == "winner"
+    assert manager.stats()["create_conflicts"] == 1
+
+
+def test_lru_evicts_least_recently_used(manager):
+    """容量を超えると最も古いセッションがキャッシュから外れることを確認"""
+    manager.get_or_create("user1")
+    manager.get_or_create("user2")
+    manager.get_or_create("user1")
+    manager.get_or_create("user3")
+
+    assert manager.stats()["size"] == 2
+    with patch.object(manager.table, "get_item", wraps=manager.table.get_item) as mock_get_item:
+        manager.get_or_create("user1")
+        assert not mock_get_item.called
+        manager.get_or_create("user2")
+        assert mock_get_item.called
+
+
+def test_prefetch_warms_cache(manager, table, clock):
+    """先読みしたセッションがキャッシュに載り、存在しない行はget_itemを省略することを確認"""
+    table.put_item(
+        Item={"user_id": "user1", "session_id": "existing", "ttl": int(clock.now) + 86400}
+    )
+
+    manager.prefetch(["user1", "user2"])
+
+    with patch.object(manager.table, "get_item") as mock_get_item:
+        assert manager.get_or_create("user1") == "existing"
+        manager.get_or_create("user2")
+        assert not mock_get_item.called
+
+
+def test_new_session_has_empty_history_without_extra_read(manager):
+    """新しいセッションの会話履歴は空で、作成直後はDynamoDBを読まずに返すことを確認"""
+    session_id = manager.get_or_create("user1")
+
+    with patch.object(manager.table, "get_item") as mock_get_item:
+        assert manager.recent_history("user1", session_id, max_age_seconds=60) == []
+        assert not mock_get_item.called
+
+
+def test_history_is_appended_and_read_from_session_item(manager, dynamodb, clock):
+    """保存した会話がセッション行のバッファに追加され、別のコンテナからも1回の読み込みで取得できることを確認"""
+    session_id = manager.get_or_create("user1")
+
+    assert manager.append_history("user1", session_id, [("USER", "質問1"), ("ASSISTANT", "回答1")], 4)
+    assert manager.append_history("user1", session_id, [("USER", "質問2"), ("ASSISTANT", "回答2")], 3)
+
+    other = SessionManager(dynamodb, TABLE_NAME, clock=clock)
+    assert other.recent_history("user1", session_id) == [
+        ("ASSISTANT", "回答1"), ("USER", "質問2"), ("ASSISTANT", "回答2"),
+    ]
+    assert other.stats()["history_reads"] == 1
+
+
+def test_missing_history_is_seeded_once(manager, table, clock):
+    """バッファのない既存のセッションは None を返し、取得した会話でバッファを作れることを確認"""
+    table.put_item(
+        Item={"user_id": "user1", "session_id": "existing", "ttl": int(clock.now) + 86400}
+    )
+
+    assert manager.recent_history("user1", "existing") is None
+    # バッファがないうちは追加しない（古い会話が欠けた履歴にしない）
+    assert manager.append_history("user1", "existing", [("USER", "新しい質問")], 20) is False
+    assert manager.seed_history("user1", "existing", [("USER", "過去の質問")], 20) is True
+    assert manager.seed_history("user1", "existing", [("USER", "別の結果")], 20) is False
+    assert manager.recent_history("user1", "existing") == [("USER", "過去の質問")]
+
+
+def test_conflicting_history_write_retries_then_drops(manager, dynamodb, clock):
+    """他のコンテナと書き込みが競合したら読み直してやり直し、それでも競合すればバッファを削除することを確認"""
+    session_id = manager.get_or_create("user1")
+    other = SessionManager(dynamodb, TABLE_NAME, clock=clock)
+    other.recent_history("user1", session_id)
+    assert other.append_history("user1", session_id, [("USER", "別のコンテナ")], 20)
+
+    # キャッシュの版番号が古くても、読み直して追加できる
+    assert manager.append_history("user1", session_id, [("USER", "このコンテナ")], 20)
+    assert manager.recent_history("user1", session_id, max_age_seconds=-1) == [
+        ("USER", "別のコンテナ"), ("USER", "このコンテナ"),
+    ]
+    assert manager.stats()["history_conflicts"] == 1
+
+    original_update = manager.table.update_item
+
+    def always_conflicting(**kwargs):
+        if "ConditionExpression" in kwargs and ":expected" in kwargs["ExpressionAttributeValues"]:
+            kwargs["ExpressionAttributeValues"][":expected"] = -1
+        return original_update(**kwargs)
+
+    with patch.object(manager.table, "update_item", side_effect=always_conflicting):
+        assert manager.append_history("user1", session_id, [("USER", "欠けるかもしれない")], 20) is False
+    assert manager.recent_history("user1", session_id, max_age_seconds=-1) is None
+
+
+def test_reset_replaces_session(manager, table):
+    """リセットで新しいセッションに置き換わり、古いセッションのバッファへの書き込みは弾かれることを確認"""
+    old = manager.get_or_create("user1")
+    new = manager.reset("user1")
+
+    assert new != old
+    assert manager.get_or_create("user1") == new
+    assert table.get_item(Key={"user_id": "user1"})["Item"]["session_id"] == new
+    assert manager.append_history("user1", old, [("USER", "古い会話")], 10) is False
+    assert manager.recent_history("user1", new) == []
+
+
+def test_reset_in_another_container_is_adopted(manager, dynamodb, clock):
+    """他のコンテナでのリセット後は、履歴の読み込みで新しいセッションに切り替わることを確認"""
+    other = SessionManager(dynamodb, TABLE_NAME, clock=clock)
+    old = manager.get_or_create("user1")
+    assert other.get_or_create("user1") == old
+
+    new = manager.reset("user1")
+    clock.now += 5
+
+    assert other.recent_history("user1", old, max_age_seconds=1) is None
+    assert other.get_or_create("user1") == new
+    assert other.recent_history("user1", new, max_age_seconds=1) == []
@@ -0,0 +1,36 @@
+"""
+直近の会話のリングバッファのテスト
+"""
+import turn_buffer
+
+
+def test_round_trip_and_format():
+    messages = [("USER", "明日の予定は？"), ("ASSISTANT", "遠足です。"), ("USER", "")]
+
+    blob = turn_buffer.encode(messages)
+
+    assert turn_buffer.decode(blob) == messages
+    assert turn_buffer.format_history(turn_buffer.decode(blob)) == "USER: 明日の予定は？\nASSISTANT: 遠足です。"
+
+
+def test_append_keeps_latest_messages():
+    messages = [("USER", "1"), ("ASSISTANT", "2")]
+
+    assert turn_buffer.append(messages, [("USER", "3"), ("ASSISTANT", "4")], 3) == [
+        ("ASSISTANT", "2"), ("USER", "3"), ("ASSISTANT", "4"),
+    ]
+    assert turn_buffer.append(messages, [("USER", "3")], 0) == []
+
+
+def test_encode_drops_oldest_messages_over_size_limit():
+    """圧縮後の大きさが上限を超えると、古い発言から捨てることを確認"""
+    import os
+
+    messages = [("USER", os.urandom(300).hex()) for _ in range(40)]
+
+    blob = turn_buffer.encode(messages, max_bytes=4096)
+
+    decoded = turn_buffer.decode(blob)
+    assert len(blob) <= 4096
+    assert 0 < len(decoded) < len(messages)
+    assert decoded == messages[-len(decoded):]
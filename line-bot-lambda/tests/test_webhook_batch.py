@@ -0,0 +1,108 @@
+"""
+Webhookバッチ処理のテスト
+"""
+import threading
+import time
+
+from webhook_batch import group_by_session, process_events
+
+
+def make_event(key: str, text: str) -> dict:
+    return {
+        "type": "message",
+        "source": {"type": "user", "userId": key},
+        "message": {"type": "text", "text": text},
+    }
+
+
+def session_key_of(event: dict) -> str:
+    return event["source"]["userId"]
+
+
+def test_group_by_session_keeps_order():
+    """同じセッションのイベントが受信順のままグループ化されることを確認"""
+    events = [make_event("a", "1"), make_event("b", "2"), make_event("a", "3")]
+
+    groups = group_by_session(events, session_key_of)
+
+    assert [i for i, _ in groups["a"]] == [0, 2]
+    assert [i for i, _ in groups["b"]] == [1]
+
+
+def test_group_by_session_without_source():
+    """セッションキーを持たないイベントが単独グループになることを確認"""
+    events = [{"type": "follow"}, {"type": "unfollow"}]
+
+    groups = group_by_session(events, session_key_of)
+
+    assert len(groups) == 2
+
+
+def test_different_sessions_run_concurrently():
+    """異なるセッションのイベントが並列に処理されることを確認"""
+    barrier = threading.Barrier(2, timeout=2)
+
+    def handle(event):
+        barrier.wait()
+
+    report = process_events(
+        [make_event("a", "1"), make_event("b", "2")], handle, session_key_of
+    )
+
+    assert report.processed == 2
+    assert report.failed == 0
+
+
+def test_same_session_runs_in_order():
+    """同じセッションのイベントが順番に処理されることを確認"""
+    handled = []
+    lock = threading.Lock()
+
+    def handle(event):
+        time.sleep(0.01 if event["message"]["text"] == "1" else 0)
+        with lock:
+            handled.append(event["message"]["text"])
+
+    process_events(
+        [make_event("a", "1"), make_event("b", "x"), make_event("a", "2"), make_event("a", "3")],
+        handle,
+        session_key_of,
+    )
+
+    assert [t for t in handled if t != "x"] == ["1", "2", "3"]
+
+
+def test_report_contains_per_event_duration():
+    """イベントごとの所要時間が受信順にレポートされることを確認"""
+    def handle(event):
+        time.sleep(0.02)
+
+    report = process_events(
+        [make_event("a", "1"), make_event("b", "2")], handle, session_key_of
+    )
+
+    data = report.to_dict()
+    assert data["processed"] == 2
+    assert [e["index"] for e in data["events"]] == [0, 1]
+    assert all(e["duration_ms"] >= 15 for e in data["events"])
+
+
+def test_failure_does_not_stop_other_events():
+    """1イベントの失敗が他のイベントの処理を妨げないことを確認"""
+    handled = []
+
+    def handle(event):
+        if event["message"]["text"] == "fail":
+            raise RuntimeError("boom")
+        handled.append(event["message"]["text"])
+
+    report = process_events(
+        [make_event("a", "fail"), make_event("a", "next"), make_event("b", "other")],
+        handle,
+        session_key_of,
+        concurrent=False,
+    )
+
+    assert sorted(handled) == ["next", "other"]
+    assert report.failed == 1
+    assert str(report.errors[0]) == "boom"
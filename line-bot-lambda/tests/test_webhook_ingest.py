@@ -0,0 +1,79 @@
+"""
+Webhookのリクエストボディ読み込みのテスト
+"""
+import base64
+import hashlib
+import hmac
+
+import pytest
+
+import webhook_ingest
+from webhook_ingest import BodyTooLarge, InvalidBody, SignatureVerifier, parse_json, read_body
+
+
+SECRET = "test_channel_secret"
+
+
+def sign(raw: bytes) -> str:
+    return base64.b64encode(hmac.new(SECRET.encode("utf-8"), raw, hashlib.sha256).digest()).decode("ascii")
+
+
+def test_plain_body_is_encoded_once():
+    """文字列のボディがUTF-8のバイト列で返ることを確認"""
+    assert read_body({"body": '{"text":"こんにちは"}'}) == '{"text":"こんにちは"}'.encode("utf-8")
+
+
+def test_base64_body_is_decoded():
+    """isBase64Encoded のボディがデコードされることを確認"""
+    raw = '{"events":[]}'.encode("utf-8")
+    event = {"body": base64.b64encode(raw).decode("ascii"), "isBase64Encoded": True}
+
+    assert read_body(event) == raw
+
+
+def test_invalid_base64_is_rejected():
+    """base64として不正なボディは InvalidBody になることを確認"""
+    with pytest.raises(InvalidBody):
+        read_body({"body": "not base64!", "isBase64Encoded": True})
+
+
+@pytest.mark.parametrize("encoded", [False, True])
+def test_oversized_body_is_rejected(encoded):
+    """上限を超えるボディは（base64でもデコード前に）拒否されることを確認"""
+    raw = b"x" * 101
+    body = base64.b64encode(raw).decode("ascii") if encoded else raw.decode("ascii")
+
+    with pytest.raises(BodyTooLarge):
+        read_body({"body": body, "isBase64Encoded": encoded}, max_bytes=100)
+    assert read_body({"body": body, "isBase64Encoded": encoded}, max_bytes=101) == raw
+
+
+def test_multibyte_body_limit_counts_bytes():
+    """上限は文字数ではなくUTF-8のバイト数で判定されることを確認"""
+    with pytest.raises(BodyTooLarge):
+        read_body({"body": "あ" * 40}, max_bytes=100)
+
+
+def test_signature_verifier_matches_hmac_over_raw_bytes():
+    """事前に用意した鍵で、生のバイト列に対する署名が検証できることを確認"""
+    verifier = SignatureVerifier(SECRET)
+    raw = '{"events":[{"message":{"text":"こんにちは"}}]}'.encode("utf-8")
+
+    assert verifier.verify(raw, sign(raw)) is True
+    assert verifier.verify(raw.decode("utf-8"), sign(raw)) is True
+    # 繰り返し使っても状態が持ち越されない
+    assert verifier.verify(raw, sign(raw)) is True
+    assert verifier.verify(raw + b" ", sign(raw)) is False
+    assert verifier.verify(raw, "署名") is False
+
+
+def test_parse_json_accepts_bytes_and_rejects_invalid():
+    """バイト列のJSONを解析し、不正なJSONは InvalidBody になることを確認"""
+    assert parse_json('{"events": ["あ"]}'.encode("utf-8")) == {"events": ["あ"]}
+    with pytest.raises(InvalidBody):
+        parse_json(b"{")
+
+
+def test_json_backend_is_reported():
+    """使用中のJSONバックエンドが判別できることを確認"""
+    assert webhook_ingest.JSON_BACKEND in ("orjson", "json")
@@ -0,0 +1,48 @@
+"""
+セッション行に保存する直近の会話のリングバッファ
+
+短期記憶（AgentCore MemoryのEvents）のうち直近N往復を、セッション行（LineAgentSessions）の
+バイナリ属性として圧縮して持つ。セッションIDと同じ get_item 1回で会話履歴も読めるため、
+メッセージごとの list_events を省略できる。
+
+- 形式: [[role, text], ...]（古い順）のJSONをzlibで圧縮
+- 会話の保存時に書き込む（write-through）。上限を超えた古い発言から捨てる
+- 圧縮後の大きさが上限を超える場合も古い発言から捨てる（DynamoDBの項目サイズの上限を守る）
+"""
+import json
+import zlib
+from typing import Any, List, Tuple
+
+
+Message = Tuple[str, str]
+
+# 圧縮後の上限（セッション行の他の属性と合わせても項目サイズの上限 400KB に十分収まる大きさ）
+MAX_ENCODED_BYTES = 64 * 1024
+
+
+def encode(messages: List[Message], max_bytes: int = MAX_ENCODED_BYTES) -> bytes:
+    """発言の列を圧縮する（上限を超えれば古い発言から捨てる）"""
+    messages = list(messages)
+    while True:
+        raw = json.dumps([list(m) for m in messages], ensure_ascii=False, separators=(",", ":"))
+        blob = zlib.compress(raw.encode("utf-8"))
+        if len(blob) <= max_bytes or not messages:
+            return blob
+        messages = messages[max(2, len(messages) // 4):]
+
+
+def decode(blob: Any) -> List[Message]:
+    """圧縮された発言の列を戻す（boto3のBinaryにも対応）"""
+    data = blob.value if hasattr(blob, "value") else blob
+    return [(role, text) for role, text in json.loads(zlib.decompress(bytes(data)).decode("utf-8"))]
+
+
+def append(messages: List[Message], new: List[Message], max_messages: int) -> List[Message]:
+    """新しい発言を末尾に加え、直近 max_messages 件だけを残す"""
+    combined = list(messages) + list(new)
+    return combined[-max_messages:] if max_messages > 0 else []
+
+
+def format_history(messages: List[Message]) -> str:
+    """エージェントに渡す会話履歴の形式（"ROLE: text" の行）にする"""
+    return "\n".join(f"{role}: {text}" for role, text in messages if text)
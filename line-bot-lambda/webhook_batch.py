@@ -0,0 +1,151 @@
+"""
+複数イベントを含むWebhookのバッチ処理
+
+セッションキーごとにイベントをまとめ、異なるセッションは並列に、同じセッションは受信順に処理する
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import log
+
+
+EVENT_MAX_WORKERS = int(os.environ.get("EVENT_MAX_WORKERS", "4"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """セッショングループを並列処理するスレッドプールを返す
+
+    ステージパイプライン用のプールとは分けて、グループ内からのステージ投入でデッドロックしないようにする
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=EVENT_MAX_WORKERS,
+                    thread_name_prefix="event",
+                )
+    return _executor
+
+
+@dataclass
+class EventReport:
+    """1イベントの処理結果"""
+    index: int
+    event_type: str
+    session_key: str
+    duration_ms: float
+    ok: bool = True
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "index": self.index,
+            "type": self.event_type,
+            "duration_ms": round(self.duration_ms, 1),
+            "ok": self.ok,
+        }
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+@dataclass
+class BatchReport:
+    """Webhook全体の処理結果"""
+    events: List[EventReport] = field(default_factory=list)
+    total_ms: float = 0.0
+    errors: List[BaseException] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return len(self.events)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for e in self.events if not e.ok)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "total_ms": round(self.total_ms, 1),
+            "events": [e.to_dict() for e in self.events],
+        }
+
+
+def group_by_session(
+    events: List[Dict[str, Any]],
+    session_key_of: Callable[[Dict[str, Any]], Optional[str]],
+) -> Dict[str, List[Tuple[int, Dict[str, Any]]]]:
+    """イベントをセッションキーごとに受信順のままグループ化
+
+    セッションキーを持たないイベントは単独のグループとして扱う
+    """
+    groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    for index, event in enumerate(events):
+        try:
+            key = session_key_of(event)
+        except (KeyError, TypeError):
+            key = None
+        groups.setdefault(key or f"#{index}", []).append((index, event))
+    return groups
+
+
+def process_events(
+    events: List[Dict[str, Any]],
+    handle: Callable[[Dict[str, Any]], None],
+    session_key_of: Callable[[Dict[str, Any]], Optional[str]],
+    concurrent: bool = True,
+    executor: Optional[ThreadPoolExecutor] = None,
+) -> BatchReport:
+    """イベントを処理してイベントごとの所要時間を返す
+
+    1つのイベントが失敗しても、残りのイベントの処理は継続する
+    """
+    report = BatchReport()
+    started = time.perf_counter()
+    groups = group_by_session(events, session_key_of)
+
+    def run_group(session_key: str, items: List[Tuple[int, Dict[str, Any]]]) -> List[Tuple[EventReport, Optional[BaseException]]]:
+        outcomes = []
+        for index, event in items:
+            event_started = time.perf_counter()
+            error = None
+            try:
+                handle(event)
+            except Exception as e:
+                error = e
+            outcomes.append((
+                EventReport(
+                    index=index,
+                    event_type=str(event.get("type")),
+                    session_key=session_key,
+                    duration_ms=(time.perf_counter() - event_started) * 1000,
+                    ok=error is None,
+                    error=str(error) if error else None,
+                ),
+                error,
+            ))
+        return outcomes
+
+    if concurrent and len(groups) > 1:
+        pool = executor or get_executor()
+        futures = [log.submit_with_context(pool, run_group, key, items) for key, items in groups.items()]
+        outcomes = [o for f in futures for o in f.result()]
+    else:
+        outcomes = [o for key, items in groups.items() for o in run_group(key, items)]
+
+    for event_report, error in sorted(outcomes, key=lambda o: o[0].index):
+        report.events.append(event_report)
+        if error is not None:
+            report.errors.append(error)
+    report.total_ms = (time.perf_counter() - started) * 1000
+    return report
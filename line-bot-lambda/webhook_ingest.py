@@ -0,0 +1,80 @@
+"""
+Webhookのリクエストボディの読み込み（バイト列で1度だけデコードし、署名検証と解析に使い回す）
+
+- Lambda Function URLの isBase64Encoded に対応
+- 上限（WEBHOOK_MAX_BODY_BYTES）を超えるボディは、デコード・署名検証・解析の前に拒否する
+- 署名検証は、チャネルシークレットから作ったHMACの初期状態をコピーして使う（鍵の準備を毎回しない）
+- orjsonがインストールされていればJSONの解析に使う（なければ標準のjson）
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+WEBHOOK_MAX_BODY_BYTES = int(os.environ.get("WEBHOOK_MAX_BODY_BYTES", "1048576"))
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+class BodyTooLarge(ValueError):
+    """ボディが上限を超えている"""
+
+
+class InvalidBody(ValueError):
+    """ボディをデコード・解析できない"""
+
+
+def read_body(event: Dict[str, Any], max_bytes: int = WEBHOOK_MAX_BODY_BYTES) -> bytes:
+    """Function URLイベントのボディを生のバイト列で返す"""
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        # デコード後の長さはbase64の長さの3/4以上になるため、デコード前に判定できる
+        if (len(body) // 4) * 3 - 2 > max_bytes:
+            raise BodyTooLarge(f"Body exceeds {max_bytes} bytes")
+        try:
+            raw = base64.b64decode(body, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise InvalidBody(f"Invalid base64 body: {e}") from e
+    else:
+        # UTF-8では1文字が1バイト以上なので、文字数が上限を超えていればエンコードせずに拒否できる
+        if len(body) > max_bytes:
+            raise BodyTooLarge(f"Body exceeds {max_bytes} bytes")
+        raw = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+    if len(raw) > max_bytes:
+        raise BodyTooLarge(f"Body exceeds {max_bytes} bytes")
+    return raw
+
+
+class SignatureVerifier:
+    """LINE署名（X-Line-Signature）の検証"""
+
+    def __init__(self, channel_secret: str):
+        self._template = hmac.new(channel_secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+    def verify(self, body: Union[bytes, str], signature: str) -> bool:
+        if not signature.isascii():
+            return False
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        mac = self._template.copy()
+        mac.update(body)
+        return hmac.compare_digest(signature.encode("ascii"), base64.b64encode(mac.digest()))
+
+
+def parse_json(raw: bytes) -> Any:
+    """JSONを解析（orjsonにはバイト列のまま渡す）"""
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        # 標準のjsonはバイト列だと文字コードの判定が入るため、UTF-8として明示的にデコードする
+        return json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        raise InvalidBody(f"Invalid JSON body: {e}") from e